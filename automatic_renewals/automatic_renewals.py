@@ -6,63 +6,257 @@ Skript som automatiskt förlänger lån.
 
 import datetime
 import logging
+import os
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from dataclasses import dataclass, field
 
-from pyfolioclient import FolioClient, UnprocessableContentError
+from pyfolioclient import UnprocessableContentError
 
-from utils import utils
+from automatic_renewals.renewal_filter import load_renewal_filter
+from automatic_renewals.renewal_state import RenewalState
+from utils import metrics, utils
 
 DAYS_LOOK_AHEAD = 3
 
+# Antal lån som förnyas samtidigt (1 = ett i taget) och max antal anrop per sekund
+# mot circulation (0 = obegränsat)
+RENEWAL_WORKERS = 8
+MAX_REQUESTS_PER_SECOND = 10
+
+# Hoppa över lån som lånepolicyn eller reservationer gör omöjliga att förnya
+# (se renewal_filter.py), stäng av för att jämföra med att försöka förnya alla
+PREFILTER_RENEWALS = True
+
+# Minne av nekade förnyelser mellan körningar (se renewal_state.py), tom sökväg
+# stänger av minnet
+RENEWAL_STATE_FILE = os.path.join(".cache", "renewal_state.sqlite")
+STATE_MAX_AGE_DAYS = 2
+
+RENEWED = "renewed"
+REFUSED = "refused"
+FAILED = "failed"
+
+
+@dataclass
+class RenewalSettings:
+    """Inställningar för förnyelser (avsnittet "automatic_renewals" i config.json)
+
+    workers: antal lån som förnyas samtidigt
+    max_requests_per_second: max antal anrop per sekund (0 = obegränsat)
+    prefilter: hoppa över lån som inte kan förnyas enligt lånepolicyn
+    state_file: fil för minnet av nekade förnyelser ("" = inget minne)
+    state_max_age_days: antal dagar som en nekad förnyelse kommer ihåg
+    """
+
+    workers: int = RENEWAL_WORKERS
+    max_requests_per_second: float = MAX_REQUESTS_PER_SECOND
+    prefilter: bool = PREFILTER_RENEWALS
+    state_file: str = RENEWAL_STATE_FILE
+    state_max_age_days: float = STATE_MAX_AGE_DAYS
+
+
+@dataclass
+class RenewalSummary:
+    """Sammanställning av en körning"""
+
+    renewed: int = 0
+    refused: int = 0
+    failed: int = 0
+    missing_barcode: int = 0
+    unchanged_refusals: int = 0
+    avoided: Counter = field(default_factory=Counter)
+
+    def add(self, outcome):
+        """Räkna utfallet för ett lån"""
+        setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def record_metrics(self):
+        """Räkna utfallen i körningens mätvärden"""
+        metrics.increment("loans_renewed", self.renewed)
+        metrics.increment("loans_refused", self.refused)
+        metrics.increment("loans_failed", self.failed)
+        metrics.increment("loans_missing_barcode", self.missing_barcode)
+        metrics.increment("loans_unchanged_refusals", self.unchanged_refusals)
+        for reason, count in self.avoided.items():
+            metrics.increment(f"loans_avoided_{reason}", count)
+
+    def log(self):
+        """Logga en sammanfattning av körningen"""
+        logging.info(
+            "Förnyade %s lån, %s kunde inte förnyas, %s misslyckades, "
+            "%s saknade streckkod",
+            self.renewed,
+            self.refused,
+            self.failed,
+            self.missing_barcode,
+        )
+        if self.unchanged_refusals:
+            logging.info(
+                "Hoppade över %s lån som nekats förnyelse tidigare och inte ändrats",
+                self.unchanged_refusals,
+            )
+        if self.avoided:
+            logging.info(
+                "Undvek %s anrop till circulation genom förhandskontroll (%s)",
+                sum(self.avoided.values()),
+                ", ".join(
+                    f"{reason}: {count}" for reason, count in self.avoided.items()
+                ),
+            )
+
+
+def load_renewal_settings():
+    """Läs inställningar för förnyelser från config.json (om den finns)"""
+    config = utils.load_config_section("automatic_renewals")
+    return RenewalSettings(
+        workers=max(1, int(config.get("workers", RENEWAL_WORKERS))),
+        max_requests_per_second=float(
+            config.get("max_requests_per_second", MAX_REQUESTS_PER_SECOND)
+        ),
+        prefilter=bool(config.get("prefilter", PREFILTER_RENEWALS)),
+        state_file=config.get("state_file", RENEWAL_STATE_FILE),
+        state_max_age_days=float(config.get("state_max_age_days", STATE_MAX_AGE_DAYS)),
+    )
+
+
+def open_renewal_state(settings):
+    """Öppna minnet av nekade förnyelser (om det används)"""
+    if not settings.state_file:
+        return nullcontext()
+    state_dir = os.path.dirname(settings.state_file)
+    if state_dir:
+        os.makedirs(state_dir, exist_ok=True)
+    return RenewalState(settings.state_file, settings.state_max_age_days)
+
+
+def get_barcodes(loan):
+    """Streckkoder för verk och användare, eller None om någon saknas"""
+    loan_id = loan.get("id")
+
+    if "borrower" in loan and loan["borrower"].get("barcode"):
+        user_barcode = loan["borrower"]["barcode"]
+    else:
+        logging.error("Lån %s saknar streckkod för användare", loan_id)
+        return None
+
+    if "item" in loan and loan["item"].get("barcode"):
+        item_barcode = loan["item"]["barcode"]
+    else:
+        logging.error("Lån %s saknar streckkod för verk", loan_id)
+        return None
+
+    return item_barcode, user_barcode
+
+
+def renew_loan(folio, rate_limiter, item_barcode, user_barcode):
+    """Förnya ett lån. Returnerar RENEWED, REFUSED eller FAILED."""
+    rate_limiter.wait()
+    utils.ensure_token(folio)
+    try:
+        with metrics.span("renewal_request"):
+            folio.renew_loan_by_barcode(
+                item_barcode=item_barcode, user_barcode=user_barcode
+            )
+    except UnprocessableContentError:
+        # If a loan cannot be renewed, just continue
+        return REFUSED
+    except RuntimeError as e:
+        logging.error(
+            "Kunde inte förnya lån för %s och användare %s: %s",
+            item_barcode,
+            user_barcode,
+            e,
+        )
+        return FAILED
+    return RENEWED
+
+
+def renew_loans(folio, loans, settings, renewal_filter=None, renewal_state=None):
+    """Förnya lån med högst settings.workers anrop samtidigt och högst
+    settings.max_requests_per_second anrop per sekund. Lånen hämtas allteftersom,
+    så bara ett begränsat antal väntar på att förnyas åt gången. Lån som
+    renewal_filter vet inte kan förnyas, eller som renewal_state minns som nekade
+    och oförändrade, hoppas över."""
+    summary = RenewalSummary()
+    rate_limiter = utils.RateLimiter(settings.max_requests_per_second)
+
+    def add_outcome(future, loan):
+        outcome = future.result()
+        summary.add(outcome)
+        if renewal_state:
+            renewal_state.record(loan, outcome)
+
+    with ThreadPoolExecutor(max_workers=settings.workers) as executor:
+        pending = {}
+        try:
+            for loan in loans:
+                barcodes = get_barcodes(loan)
+                if barcodes is None:
+                    summary.missing_barcode += 1
+                    continue
+
+                if renewal_state and renewal_state.is_unchanged_refusal(loan):
+                    summary.unchanged_refusals += 1
+                    continue
+
+                skip_reason = renewal_filter and renewal_filter.skip_reason(loan)
+                if skip_reason:
+                    summary.avoided[skip_reason] += 1
+                    continue
+
+                if len(pending) >= settings.workers * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        add_outcome(future, pending.pop(future))
+                future = executor.submit(renew_loan, folio, rate_limiter, *barcodes)
+                pending[future] = loan
+
+            for future, loan in pending.items():
+                add_outcome(future, loan)
+        except BaseException:
+            # Anslutningsfel avbryter körningen som tidigare
+            for future in pending:
+                future.cancel()
+            raise
+
+    return summary
+
 
 def main():
     """Huvudfunktion för att förnya lån."""
     folio_config = utils.load_env()
+    settings = load_renewal_settings()
 
     today = datetime.date.today()
     end_date = today + datetime.timedelta(days=DAYS_LOOK_AHEAD)
     end_date_str = str(end_date)
 
     try:
-        with FolioClient(
-            folio_config.base_url,
-            folio_config.tenant,
-            folio_config.username,
-            folio_config.password,
-        ) as folio:
+        with utils.folio_session(folio_config) as folio:
             print(folio)
-            for loan in folio.iter_open_loans_by_due_date_bl(end_date_str):
-                load_id = loan.get("id")
-
-                if "borrower" in loan and loan["borrower"].get("barcode"):
-                    user_barcode = loan["borrower"]["barcode"]
-                else:
-                    logging.error("Lån %s saknar streckkod för användare", load_id)
-                    continue
-
-                if "item" in loan and loan["item"].get("barcode"):
-                    item_barcode = loan["item"]["barcode"]
-                else:
-                    logging.error("Lån %s saknar streckkod för verk", load_id)
-                    continue
-
-                try:
-                    folio.renew_loan_by_barcode(
-                        item_barcode=item_barcode, user_barcode=user_barcode
-                    )
-                except UnprocessableContentError:
-                    # If a loan cannot be renewed, just continue
-                    continue
-                except RuntimeError as e:
-                    logging.error(
-                        "Kunde inte förnya lån för %s och användare %s: %s",
-                        item_barcode,
-                        user_barcode,
-                        e,
-                    )
+            with metrics.span("renewal_filter"):
+                renewal_filter = (
+                    load_renewal_filter(folio) if settings.prefilter else None
+                )
+            with open_renewal_state(settings) as renewal_state, metrics.span(
+                "renew_loans"
+            ):
+                summary = renew_loans(
+                    folio,
+                    folio.iter_open_loans_by_due_date_bl(end_date_str),
+                    settings,
+                    renewal_filter,
+                    renewal_state,
+                )
+            summary.log()
+            summary.record_metrics()
 
     except (ConnectionError, TimeoutError, RuntimeError) as e:
         logging.error("Misslyckades att ansluta fill Folio: %s", e)
 
 
 if __name__ == "__main__":
-    main()
+    with utils.collect_metrics("automatic_renewals"):
+        main()
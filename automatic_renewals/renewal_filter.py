@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""
+Förhandskontroll av lån innan de förnyas.
+
+Lånepolicyer och öppna reservationer (hold/recall) hämtas en gång per körning.
+Lån som Folio ändå skulle neka förnyelse hoppas över utan anrop till circulation:
+lånepolicyn tillåter inte förnyelse, lånet har redan förnyats så många gånger som
+policyn tillåter, eller verket har en recall (eller en hold och policyn tillåter
+inte förnyelse av reserverade verk). Lån där något är okänt förnyas som vanligt.
+"""
+
+import logging
+
+from pyfolioclient import BadRequestError
+
+NOT_RENEWABLE = "not_renewable"
+RENEWAL_LIMIT = "renewal_limit"
+REQUESTED = "requested"
+
+OPEN_REQUESTS_QUERY = (
+    'status=="Open*" and (requestType=="Recall" or requestType=="Hold")'
+)
+
+
+class RenewalFilter:
+    """Lånepolicyer och reserverade verk för en körning"""
+
+    def __init__(self, loan_policies, recalled_items, held_items):
+        self.loan_policies = loan_policies
+        self.recalled_items = recalled_items
+        self.held_items = held_items
+
+    @classmethod
+    def load(cls, folio):
+        """Hämta lånepolicyer och öppna reservationer från Folio"""
+        loan_policies = {
+            policy["id"]: policy
+            for policy in folio.iter_data(
+                "/loan-policy-storage/loan-policies", key="loanPolicies"
+            )
+        }
+        recalled_items = set()
+        held_items = set()
+        for request in folio.iter_data(
+            "/circulation/requests", key="requests", cql_query=OPEN_REQUESTS_QUERY
+        ):
+            if request.get("requestType") == "Recall":
+                recalled_items.add(request.get("itemId"))
+            else:
+                held_items.add(request.get("itemId"))
+        logging.info(
+            "Hämtade %s lånepolicyer och %s reserverade verk",
+            len(loan_policies),
+            len(recalled_items | held_items),
+        )
+        return cls(loan_policies, recalled_items, held_items)
+
+    def skip_reason(self, loan):
+        """Orsak till att lånet inte kan förnyas, eller None om det ska försökas"""
+        policy = self.loan_policies.get(loan.get("loanPolicyId"))
+        if policy is None:
+            return None
+
+        if policy.get("loanable") is False or policy.get("renewable") is False:
+            return NOT_RENEWABLE
+
+        renewals_policy = policy.get("renewalsPolicy", {})
+        number_allowed = renewals_policy.get("numberAllowed")
+        if (
+            not renewals_policy.get("unlimited", False)
+            and number_allowed is not None
+            and loan.get("renewalCount", 0) >= number_allowed
+        ):
+            return RENEWAL_LIMIT
+
+        item_id = loan.get("itemId")
+        if item_id in self.recalled_items:
+            return REQUESTED
+        holds = policy.get("requestManagement", {}).get("holds", {})
+        if item_id in self.held_items and not holds.get("renewItemsWithRequest"):
+            return REQUESTED
+
+        return None
+
+
+def load_renewal_filter(folio):
+    """Hämta förhandskontrollen, eller None om policyer inte kunde hämtas"""
+    try:
+        return RenewalFilter.load(folio)
+    except (BadRequestError, RuntimeError) as e:
+        logging.warning(
+            "Kunde inte hämta lånepolicyer, förnyar utan förhandskontroll: %s", e
+        )
+        return None
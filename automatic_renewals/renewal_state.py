@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+"""
+Lokalt minne av utfallet för förnyelser mellan körningar.
+
+För varje lån (lån-ID) sparas utfallet av senaste försöket tillsammans med lånets
+förfallodatum och antal förnyelser. Ett lån som nekades förnyelse försöks inte
+igen så länge förfallodatum och antal förnyelser är oförändrade. Poster äldre än
+max_age_days raderas när minnet öppnas, så att nekade lån ändå försöks igen
+(t.ex. om en reservation tagits bort).
+"""
+
+import sqlite3
+import time
+
+REFUSED = "refused"
+
+
+class RenewalState:
+    """SQLite-baserat minne lån-ID -> utfall, förfallodatum och antal förnyelser"""
+
+    def __init__(self, path, max_age_days):
+        self.skipped = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS loans (
+                loan_id TEXT PRIMARY KEY,
+                outcome TEXT NOT NULL,
+                due_date TEXT,
+                renewal_count INTEGER NOT NULL,
+                updated REAL NOT NULL
+            ) WITHOUT ROWID;
+            """)
+        with self.connection:
+            self.expired = self.connection.execute(
+                "DELETE FROM loans WHERE updated < ?",
+                (time.time() - max_age_days * 24 * 60 * 60,),
+            ).rowcount
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def is_unchanged_refusal(self, loan):
+        """Kontrollera om lånet nekades senast och inte ändrats sedan dess"""
+        row = self.connection.execute(
+            "SELECT outcome, due_date, renewal_count FROM loans WHERE loan_id = ?",
+            (loan.get("id"),),
+        ).fetchone()
+        if row == (REFUSED, loan.get("dueDate"), loan.get("renewalCount", 0)):
+            self.skipped += 1
+            return True
+        return False
+
+    def record(self, loan, outcome):
+        """Spara utfallet för ett lån"""
+        self.connection.execute(
+            "INSERT OR REPLACE INTO loans "
+            "(loan_id, outcome, due_date, renewal_count, updated) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (
+                loan.get("id"),
+                outcome,
+                loan.get("dueDate"),
+                loan.get("renewalCount", 0),
+                time.time(),
+            ),
+        )
+
+    def close(self):
+        """Spara och stäng minnet"""
+        self.connection.commit()
+        self.connection.close()
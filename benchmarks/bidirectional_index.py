@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+"""
+Jämför BidirectionalIndex med det tidigare blandade uppslagsverket (namn och id
+som nycklar i samma dict): tid för att bygga, tid för uppslag åt båda hållen och
+minnesanvändning. Körs helt lokalt med syntetiska referensdata.
+
+Exempel:
+    python -m benchmarks.bidirectional_index --entries 1000 --entries 100000
+"""
+
+import argparse
+import random
+import timeit
+import tracemalloc
+import uuid
+
+from utils.bidirectional_index import BidirectionalIndex
+
+DEFAULT_ENTRIES = [100, 10000, 100000]
+LOOKUPS = 100000
+
+
+def build_mixed_dict(entries):
+    """Uppslagsverket så som build_bidirectional_dict byggde det tidigare"""
+    index = {}
+    for value, entry_id in entries:
+        index[value] = entry_id
+        index[entry_id] = value
+    return index
+
+
+def make_entries(count):
+    """Syntetiska (namn, id)-par med slumpade UUID:n"""
+    # Strängarna skapas på nytt som vid inläsning av JSON från Folio
+    return [(f"Location {number:06d}", str(uuid.uuid4())) for number in range(count)]
+
+
+def measure_memory(build, entries):
+    """Minne (bytes) som används av ett byggt uppslagsverk"""
+    tracemalloc.start()
+    index = build(entries)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del index
+    return size
+
+
+def measure(name, build, entries, values, ids, split=False):
+    """Mät bygge, uppslag och minne för ett sätt att bygga uppslagsverket.
+    Med split slås namn upp i index.forward och id i index.reverse."""
+    index = build(entries)
+    value_index, id_index = (index.forward, index.reverse) if split else (index, index)
+    return {
+        "name": name,
+        "build": min(timeit.repeat(lambda: build(entries), number=1, repeat=5)),
+        "value_to_id": min(
+            timeit.repeat(
+                lambda: [value_index[value] for value in values], number=1, repeat=5
+            )
+        ),
+        "id_to_value": min(
+            timeit.repeat(
+                lambda: [id_index[entry_id] for entry_id in ids], number=1, repeat=5
+            )
+        ),
+        "memory": measure_memory(build, entries),
+    }
+
+
+def print_results(count, results):
+    """Skriv ut en jämförelse för ett antal poster"""
+    print(f"\n{count} poster, {LOOKUPS} uppslag per riktning")
+    print(
+        f"{'Typ':<22}{'Bygge (ms)':>12}{'Namn->id (ms)':>15}"
+        f"{'Id->namn (ms)':>15}{'Minne (kB)':>12}"
+    )
+    for result in results:
+        print(
+            f"{result['name']:<22}"
+            f"{result['build'] * 1000:>12.2f}"
+            f"{result['value_to_id'] * 1000:>15.2f}"
+            f"{result['id_to_value'] * 1000:>15.2f}"
+            f"{result['memory'] / 1024:>12.0f}"
+        )
+
+
+def main():
+    """Kör jämförelsen för alla storlekar"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--entries", type=int, action="append", help="antal poster i tabellen"
+    )
+    args = parser.parse_args()
+
+    for count in args.entries or DEFAULT_ENTRIES:
+        entries = make_entries(count)
+        values = random.choices([value for value, _ in entries], k=LOOKUPS)
+        ids = random.choices([entry_id for _, entry_id in entries], k=LOOKUPS)
+        print_results(
+            count,
+            [
+                measure("dict (blandad)", build_mixed_dict, entries, values, ids),
+                measure("BidirectionalIndex", BidirectionalIndex, entries, values, ids),
+                measure(
+                    "forward/reverse",
+                    BidirectionalIndex,
+                    entries,
+                    values,
+                    ids,
+                    split=True,
+                ),
+                measure(
+                    "BidirectionalIndex ci",
+                    lambda entries: BidirectionalIndex(entries, case_insensitive=True),
+                    entries,
+                    values,
+                    ids,
+                ),
+            ],
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+"""
+Jämför hur lång tid Folio tar på sig för olika sätt att dela upp en MARC-fil.
+
+Varje strategi delar upp samma fil, laddar upp den till Folio, initierar importen
+och väntar tills jobben är klara. OBS! Posterna importeras på riktigt - kör mot
+en testmiljö. Använder samma .env som libris_to_folio.
+
+Exempel:
+    python -m benchmarks.chunk_strategies export.mrc --strategy count:200 \\
+        --strategy bytes:5000000 --strategy single
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from pyfolioclient import FolioClient
+
+from libris_import import import_monitor, libris_to_folio
+from utils import utils
+
+DEFAULT_STRATEGIES = ["count:200", "count:1000", "bytes:5000000", "single"]
+
+
+def parse_strategy(strategy):
+    """Tolka en strategi: count:<poster>, bytes:<bytes>, count:<poster>,bytes:<bytes>
+    eller single"""
+    settings = libris_to_folio.ChunkSettings(chunk_size=0, chunk_max_bytes=0)
+    if strategy == "single":
+        settings.single_file = True
+        return settings
+    for part in strategy.split(","):
+        kind, _, value = part.partition(":")
+        if kind == "count":
+            settings.chunk_size = int(value)
+        elif kind == "bytes":
+            settings.chunk_max_bytes = int(value)
+        else:
+            raise ValueError(f"Okänd strategi: {strategy}")
+    return settings
+
+
+def run_strategy(folio, marc_file, strategy, libris_jobprofile):
+    """Dela upp, ladda upp och importera med en strategi - returnera tidsåtgång"""
+    chunk_size, chunk_max_bytes = parse_strategy(strategy).limits()
+    with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as output_dir:
+        shutil.copy(marc_file, input_dir)
+
+        start = time.perf_counter()
+        record_count = libris_to_folio.process_mrc_files(
+            Path(input_dir),
+            Path(output_dir),
+            chunk_size,
+            change_index=None,
+            chunk_max_bytes=chunk_max_bytes,
+        )
+        split_done = time.perf_counter()
+        chunk_count = len(libris_to_folio.get_mrc_files(Path(output_dir)))
+
+        # En upload definition per strategi, utan att vänta på andra jobb
+        [upload_definition_id] = libris_to_folio.import_marc_files_to_folio(
+            folio,
+            output_dir,
+            libris_jobprofile,
+            submission_settings=libris_to_folio.SubmissionSettings(
+                chunks_per_import=0, max_running_jobs=0
+            ),
+        )
+        submit_done = time.perf_counter()
+
+        report = import_monitor.wait_for_import(folio, upload_definition_id)
+        import_done = time.perf_counter()
+        report.log()
+
+    return {
+        "strategy": strategy,
+        "records": record_count,
+        "chunks": chunk_count,
+        "split": split_done - start,
+        "upload": submit_done - split_done,
+        "folio": import_done - submit_done,
+        "per_chunk": (import_done - split_done) / max(chunk_count, 1),
+        "records_per_second": report.records_per_second,
+        "errors": report.errors + len(report.failed_jobs),
+    }
+
+
+def print_results(results):
+    """Skriv ut resultat som tabell"""
+    header = (
+        f"{'strategi':<28}{'poster':>8}{'chunks':>8}{'dela s':>9}"
+        f"{'ladda upp s':>13}{'folio s':>10}{'s/chunk':>10}{'poster/s':>10}"
+        f"{'fel':>5}"
+    )
+    print(header)
+    for result in results:
+        print(
+            f"{result['strategy']:<28}{result['records']:>8}{result['chunks']:>8}"
+            f"{result['split']:>9.1f}{result['upload']:>13.1f}{result['folio']:>10.1f}"
+            f"{result['per_chunk']:>10.2f}{result['records_per_second']:>10.1f}"
+            f"{result['errors']:>5}"
+        )
+
+
+def main():
+    """Kör alla strategier mot Folio och skriv ut en jämförelse"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("marc_file", help="MARC-fil att importera")
+    parser.add_argument(
+        "--strategy",
+        action="append",
+        help="count:<poster>, bytes:<bytes>, kombinationen av dem eller single",
+    )
+    args = parser.parse_args()
+
+    folio_config = utils.load_env()
+    libris_jobprofile = os.environ["LIBRIS_JOBPROFILE"]
+
+    with FolioClient(
+        folio_config.base_url,
+        folio_config.tenant,
+        folio_config.username,
+        folio_config.password,
+    ) as folio:
+        results = []
+        for strategy in args.strategy or DEFAULT_STRATEGIES:
+            logging.info("Kör strategi %s", strategy)
+            results.append(
+                run_strategy(folio, args.marc_file, strategy, libris_jobprofile)
+            )
+    print_results(results)
+
+
+if __name__ == "__main__":
+    main()
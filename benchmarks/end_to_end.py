@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+"""
+Kör skripten från början till slut mot den lokala servern i fake_server.py och
+mät tid, antal anrop och minnesanvändning.
+
+Varje skript körs som en egen process i en temporär katalog (med egna .env-
+variabler, tom cache och config.json bara om --config anges), så att tid och
+minne bara gäller skriptet. Antal anrop räknas av servern per endpoint.
+
+Exempel:
+    python -m benchmarks.end_to_end --libris-records 20000 --loans 5000 --latency 10
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+
+from benchmarks.fake_server import FakeServerSettings, start_server
+
+# Skript -> modul och eventuella argument
+SCRIPTS = {
+    "libris_import": "libris_import.libris_to_folio",
+    "automatic_renewals": "automatic_renewals.automatic_renewals",
+    # Båda skripten i samma process med en gemensam inloggning
+    "run_jobs": (
+        "utils.run_jobs libris_import.libris_to_folio "
+        "automatic_renewals.automatic_renewals"
+    ),
+}
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+
+def prepare_environment(work_dir, base_url):
+    """Skapa kataloger och miljövariabler för en körning mot servern"""
+    libris_folder = work_dir / "libris"
+    (libris_folder / "chunks").mkdir(parents=True)
+    (libris_folder / "export.properties").write_text("format=marc21\n")
+    # Sex timmar sedan senaste körning ger ett tidsfönster utan uppdelning
+    last_run = datetime.now(timezone.utc) - timedelta(hours=6)
+    (libris_folder / "lastRun.timestamp").write_text(
+        last_run.strftime("%Y-%m-%dT%H:%M:%SZ")
+    )
+
+    env = dict(os.environ)
+    env.update(
+        {
+            "PYTHONPATH": str(PROJECT_ROOT),
+            "MODE": "prod",
+            # Avslutande snedstreck behövs för anrop som pyfolioclient gör utan
+            # inledande snedstreck (renew-by-barcode)
+            "FOLIO_ENDPOINT": base_url,
+            "FOLIO_OKAPI_TENANT": "fake",
+            "FOLIO_USERNAME": "fake",
+            "FOLIO_PASSWORD": "fake",
+            "LIBRIS_BASE_FOLDER": str(libris_folder),
+            "LIBRIS_CHUNKS_FOLDER": "chunks",
+            "LIBRIS_JOBPROFILE": "00000000-0000-0000-0000-000000000000",
+            "LIBRIS_API_URL": f"{base_url}libris/marc_export",
+        }
+    )
+    return env
+
+
+def run_script(name, module, base_url, config_path=None):
+    """Kör ett skript som egen process och mät tid, minne och anrop"""
+    httpx.post(f"{base_url}_reset")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = Path(temp_dir)
+        env = prepare_environment(work_dir, base_url)
+        if config_path:
+            shutil.copy(config_path, work_dir / "config.json")
+        start = time.perf_counter()
+        process = subprocess.Popen(  # pylint: disable=consider-using-with
+            [sys.executable, "-m", *module.split()], cwd=work_dir, env=env
+        )
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+    stats = httpx.get(f"{base_url}_stats").json()
+    return {
+        "script": name,
+        "exit_code": process.returncode,
+        "wall_time": wall_time,
+        "requests": sum(stats.values()),
+        # ru_maxrss är i kB på Linux
+        "peak_rss_mb": usage.ru_maxrss / 1024,
+        "requests_by_endpoint": stats,
+    }
+
+
+def print_results(results, verbose=False):
+    """Skriv ut en jämförelse av körningarna"""
+    print(f"{'Skript':<20}{'Tid (s)':>10}{'Anrop':>10}{'Minne (MB)':>12}{'Status':>8}")
+    for result in results:
+        print(
+            f"{result['script']:<20}"
+            f"{result['wall_time']:>10.2f}"
+            f"{result['requests']:>10}"
+            f"{result['peak_rss_mb']:>12.1f}"
+            f"{result['exit_code']:>8}"
+        )
+        if verbose:
+            for endpoint, count in sorted(result["requests_by_endpoint"].items()):
+                print(f"    {endpoint:<70}{count:>8}")
+
+
+def main():
+    """Starta servern och kör valda skript mot den"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--script",
+        action="append",
+        choices=sorted(SCRIPTS),
+        help="skript att köra (standard: alla)",
+    )
+    parser.add_argument("--latency", type=float, default=0, help="svarstid i ms")
+    parser.add_argument("--error-rate", type=float, default=0, help="andel fel")
+    parser.add_argument("--loans", type=int, default=1000)
+    parser.add_argument("--libris-records", type=int, default=1000)
+    parser.add_argument("--reference-entries", type=int, default=50)
+    parser.add_argument(
+        "--job-failure-rate",
+        type=float,
+        default=0,
+        help="andel importjobb som misslyckas",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="visa anrop per endpoint"
+    )
+    parser.add_argument("--config", help="config.json att använda för skripten")
+    parser.add_argument("--json", help="spara resultatet som JSON i denna fil")
+    args = parser.parse_args()
+
+    server, _ = start_server(
+        FakeServerSettings(
+            latency=args.latency / 1000,
+            error_rate=args.error_rate,
+            reference_entries=args.reference_entries,
+            loans=args.loans,
+            libris_records=args.libris_records,
+            job_failure_rate=args.job_failure_rate,
+        )
+    )
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/"
+    try:
+        results = [
+            run_script(name, SCRIPTS[name], base_url, args.config)
+            for name in args.script or sorted(SCRIPTS)
+        ]
+    finally:
+        server.shutdown()
+
+    print_results(results, args.verbose)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,550 @@
+# -*- coding: utf-8 -*-
+
+"""
+Lokal ersättare för Folio och Libris för att kunna köra och mäta skripten utan
+riktiga system.
+
+Implementerar de anrop som skripten använder: inloggning (authn), data-import
+(uploadDefinitions, files, processFiles, jobExecutions, jobSummary, antal
+pågående jobb), öppna lån
+och renew-by-barcode, lånepolicyer och reservationer, referensdata samt Libris
+marc_export. Svarstid, andel fel, andel importjobb som misslyckas och mängden
+syntetiska data går att ställa in.
+Antal anrop per endpoint kan läsas från GET /_stats och nollställas med
+POST /_reset.
+
+Exempel:
+    python -m benchmarks.fake_server --port 8080 --latency 20 --error-rate 0.01
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from collections import Counter
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from libris_import import iso2709
+from utils import utils
+
+_ID_QUERY = re.compile(r"id>([0-9a-f-]{36})")
+_NAMESPACE = uuid.UUID("6ba7b811-9dad-11d1-80b4-00c04fd430c8")
+
+
+@dataclass
+class FakeServerSettings:
+    """Inställningar för den lokala servern
+
+    latency: svarstid per anrop i sekunder
+    error_rate: andel anrop (utom inloggning) som ger 500
+    reference_entries: antal poster per referenstabell
+    loans: antal öppna lån
+    libris_records: antal poster i varje export från Libris
+    record_seconds: tid per post för importjobb i data-import
+    job_failure_rate: andel importjobb som avslutas med status ERROR
+    """
+
+    latency: float = 0.0
+    error_rate: float = 0.0
+    reference_entries: int = 50
+    loans: int = 1000
+    libris_records: int = 1000
+    record_seconds: float = 0.001
+    job_failure_rate: float = 0.0
+    seed: int = 1
+
+
+def make_id(*parts):
+    """Deterministiskt UUID för syntetiska data"""
+    return str(uuid.uuid5(_NAMESPACE, "/".join(str(part) for part in parts)))
+
+
+def make_marc_record(number):
+    """En syntetisk MARC-post i Libris-stil"""
+    return iso2709.build_record(
+        b"00000nam a2200000 i 4500",
+        [
+            ("001", str(number).encode("ascii")),
+            ("005", b"20240101120000.0"),
+            ("008", b"240101s2024    sw |||||||||||000 ||swe| "),
+            ("035", f"  \x1fa(LIBRIS){number}".encode("utf-8")),
+            ("035", f"  \x1fa(OCoLC){number + 1000000}".encode("utf-8")),
+            ("100", "1 \x1faÅström, Märta\x1fd1970-".encode("utf-8")),
+            (
+                "245",
+                f"10\x1faSyntetisk titel {number} /\x1fcMärta Åström".encode("utf-8"),
+            ),
+            ("830", f" 0\x1faSerie\x1fv{number % 100}\x1f9{number}".encode("utf-8")),
+        ],
+    )
+
+
+class FakeData:
+    """Syntetiska data och tillstånd för data-import och lån"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.lock = threading.Lock()
+        self.stats = Counter()
+        rng = random.Random(settings.seed)
+        self.job_rng = random.Random(settings.seed)
+
+        self.reference_tables = {}
+        for endpoint, key, field_name in utils.REFERENCE_TABLES.values():
+            entries = [
+                {"id": make_id(endpoint, number), field_name: f"{key}-{number}"}
+                for number in range(settings.reference_entries)
+            ]
+            self.reference_tables[endpoint] = (key, sorted(entries, key=id_key))
+
+        self.loan_policies = [
+            {
+                "id": make_id("policy", "limited"),
+                "loanable": True,
+                "renewable": True,
+                "renewalsPolicy": {"unlimited": False, "numberAllowed": 3},
+                "requestManagement": {"holds": {"renewItemsWithRequest": False}},
+            },
+            {"id": make_id("policy", "none"), "loanable": True, "renewable": False},
+            {
+                "id": make_id("policy", "unlimited"),
+                "loanable": True,
+                "renewable": True,
+                "renewalsPolicy": {"unlimited": True},
+            },
+        ]
+        self.reference_tables["/loan-policy-storage/loan-policies"] = (
+            "loanPolicies",
+            sorted(self.loan_policies, key=id_key),
+        )
+
+        due_date = (date.today() + timedelta(days=1)).isoformat()
+        self.loans = {}
+        for number in range(settings.loans):
+            loan_id = make_id("loan", number)
+            self.loans[loan_id] = {
+                "id": loan_id,
+                "itemId": make_id("item", number),
+                "loanPolicyId": rng.choice(self.loan_policies)["id"],
+                "renewalCount": rng.randint(0, 4),
+                "dueDate": f"{due_date}T23:59:59.000+00:00",
+                "status": {"name": "Open"},
+                "borrower": {"barcode": f"U{number:08d}"},
+                "item": {"barcode": f"I{number:08d}"},
+            }
+        self.sorted_loans = sorted(self.loans.values(), key=id_key)
+        self.loans_by_item = {
+            loan["item"]["barcode"]: loan for loan in self.loans.values()
+        }
+        requests = [
+            {
+                "id": make_id("request", loan["id"]),
+                "itemId": loan["itemId"],
+                "requestType": rng.choice(["Hold", "Recall"]),
+                "status": "Open - Not yet filled",
+            }
+            for loan in rng.sample(list(self.loans.values()), settings.loans // 20)
+        ]
+        self.requested_items = {request["itemId"] for request in requests}
+        self.reference_tables["/circulation/requests"] = (
+            "requests",
+            sorted(requests, key=id_key),
+        )
+
+        self.upload_definitions = {}
+        self.jobs = {}
+
+    def page(self, endpoint, query, limit):
+        """Sida med poster sorterade på id efter id>... i frågan"""
+        if endpoint == "/circulation/loans":
+            key, entries = "loans", self.sorted_loans
+        else:
+            key, entries = self.reference_tables[endpoint]
+        match = _ID_QUERY.search(query)
+        after = match.group(1) if match else ""
+        return {key: [entry for entry in entries if entry["id"] > after][:limit]}
+
+    def renew(self, item_barcode):
+        """Förnya ett lån - None om det inte kan förnyas"""
+        with self.lock:
+            loan = self.loans_by_item.get(item_barcode)
+            if loan is None:
+                return None
+            policy = next(
+                policy
+                for policy in self.loan_policies
+                if policy["id"] == loan["loanPolicyId"]
+            )
+            renewals_policy = policy.get("renewalsPolicy", {})
+            if (
+                not policy["renewable"]
+                or loan["itemId"] in self.requested_items
+                or (
+                    not renewals_policy.get("unlimited")
+                    and loan["renewalCount"] >= renewals_policy["numberAllowed"]
+                )
+            ):
+                return None
+            loan["renewalCount"] += 1
+            return loan
+
+    def create_upload_definition(self, payload):
+        """Skapa en upload definition med en file definition per fil"""
+        upload_definition_id = str(uuid.uuid4())
+        upload_definition = {
+            "id": upload_definition_id,
+            "status": "NEW",
+            "fileDefinitions": [
+                {
+                    "id": str(uuid.uuid4()),
+                    "name": file_definition["name"],
+                    "uploadDefinitionId": upload_definition_id,
+                    "status": "NEW",
+                    "records": 0,
+                }
+                for file_definition in payload.get("fileDefinitions", [])
+            ],
+        }
+        with self.lock:
+            self.upload_definitions[upload_definition_id] = upload_definition
+        return upload_definition
+
+    def delete_upload_definition(self, upload_definition_id):
+        """Radera en upload definition"""
+        with self.lock:
+            return self.upload_definitions.pop(upload_definition_id, None) is not None
+
+    def add_file_definition(self, upload_definition_id, payload):
+        """Lägg till en file definition i en upload definition"""
+        with self.lock:
+            upload_definition = self.upload_definitions.get(upload_definition_id)
+            if upload_definition is None:
+                return None
+            upload_definition["fileDefinitions"].append(
+                {
+                    "id": str(uuid.uuid4()),
+                    "name": payload["name"],
+                    "uploadDefinitionId": upload_definition_id,
+                    "status": "NEW",
+                    "records": 0,
+                }
+            )
+            return upload_definition
+
+    def upload_file(self, upload_definition_id, file_definition_id, content):
+        """Ta emot filinnehåll för en file definition"""
+        with self.lock:
+            upload_definition = self.upload_definitions.get(upload_definition_id)
+            if upload_definition is None:
+                return None
+            for file_definition in upload_definition["fileDefinitions"]:
+                if file_definition["id"] == file_definition_id:
+                    file_definition["status"] = "UPLOADED"
+                    file_definition["records"] = content.count(b"\x1d")
+                    return upload_definition
+        return None
+
+    def process_files(self, upload_definition_id):
+        """Starta ett importjobb per fil, klart efter record_seconds per post.
+        Andelen job_failure_rate av jobben avslutas med status ERROR."""
+        now = time.time()
+        with self.lock:
+            upload_definition = self.upload_definitions.get(upload_definition_id)
+            if upload_definition is None:
+                return False
+            for file_definition in upload_definition["fileDefinitions"]:
+                job_id = str(uuid.uuid4())
+                file_definition["jobExecutionId"] = job_id
+                self.jobs[job_id] = {
+                    "records": file_definition["records"],
+                    "started": now,
+                    "completed": now
+                    + file_definition["records"] * self.settings.record_seconds,
+                    "failed": self.job_rng.random() < self.settings.job_failure_rate,
+                }
+        return True
+
+    def job_execution(self, job_id):
+        """Status för ett importjobb"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        done = time.time() >= job["completed"]
+        if not done:
+            status = "PARSING_IN_PROGRESS"
+        else:
+            status = "ERROR" if job["failed"] else "COMMITTED"
+        return {
+            "id": job_id,
+            "status": status,
+            "progress": {"total": job["records"]},
+            "startedDate": folio_date(job["started"]),
+            "completedDate": folio_date(job["completed"]) if done else None,
+        }
+
+    def job_summary(self, job_id):
+        """Sammanfattning av ett importjobb, alla poster räknas som fel om jobbet
+        misslyckats"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        return {
+            "jobExecutionId": job_id,
+            "totalErrors": job["records"] if job["failed"] else 0,
+        }
+
+    def running_jobs(self):
+        """Antal importjobb som inte är klara"""
+        now = time.time()
+        with self.lock:
+            return sum(1 for job in self.jobs.values() if job["completed"] > now)
+
+
+def id_key(entry):
+    """Sorteringsnyckel för poster"""
+    return entry["id"]
+
+
+def folio_date(timestamp):
+    """Tidsstämpel i Folios format"""
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(
+        timespec="milliseconds"
+    )
+
+
+class FakeRequestHandler(BaseHTTPRequestHandler):
+    """Hanterar anrop mot den lokala servern"""
+
+    protocol_version = "HTTP/1.1"
+    data = None
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def read_body(self):
+        """Läs hela anropets innehåll (även med chunked transfer encoding)"""
+        if self.headers.get("Transfer-Encoding", "").lower() != "chunked":
+            return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        body = bytearray()
+        while True:
+            size = int(self.rfile.readline().split(b";")[0], 16)
+            if not size:
+                self.rfile.readline()
+                return bytes(body)
+            body += self.rfile.read(size)
+            self.rfile.readline()
+
+    def send(self, status, payload=None, headers=None):
+        """Skicka ett svar, JSON om payload är angiven"""
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if payload is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def route(self):
+        """Sökväg (utan dubbla snedstreck) och frågeparametrar"""
+        url = urllib.parse.urlsplit(self.path)
+        path = re.sub(r"/+", "/", url.path).rstrip("/") or "/"
+        return path, dict(urllib.parse.parse_qsl(url.query))
+
+    def before(self, path):
+        """Räkna anropet, vänta latency och ge ibland ett fel. True = fortsätt."""
+        settings = self.data.settings
+        with self.data.lock:
+            self.data.stats[f"{self.command} {normalize_path(path)}"] += 1
+        if settings.latency:
+            time.sleep(settings.latency)
+        if (
+            settings.error_rate
+            and not path.startswith(("/authn", "/_"))
+            and random.random() < settings.error_rate
+        ):
+            self.read_body()
+            self.send(500, {"error": "injicerat fel"})
+            return False
+        return True
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """GET-anrop"""
+        path, params = self.route()
+        if path == "/_stats":
+            with self.data.lock:
+                self.send(200, dict(self.data.stats))
+            return
+        if not self.before(path):
+            return
+
+        parts = path.split("/")
+        if path.startswith("/data-import/uploadDefinitions/"):
+            upload_definition = self.data.upload_definitions.get(parts[3])
+            if upload_definition is None:
+                self.send(404, {"error": "not found"})
+            else:
+                with self.data.lock:
+                    self.send(200, upload_definition)
+        elif path.startswith("/change-manager/jobExecutions/"):
+            job_execution = self.data.job_execution(parts[3])
+            self.send(404 if job_execution is None else 200, job_execution or {})
+        elif path == "/metadata-provider/jobExecutions":
+            self.send(
+                200, {"jobExecutions": [], "totalRecords": self.data.running_jobs()}
+            )
+        elif path.startswith("/metadata-provider/jobSummary/"):
+            job_summary = self.data.job_summary(parts[3])
+            self.send(404 if job_summary is None else 200, job_summary or {})
+        elif path == "/circulation/loans" or path in self.data.reference_tables:
+            self.send(
+                200,
+                self.data.page(
+                    path, params.get("query", ""), int(params.get("limit", 10))
+                ),
+            )
+        else:
+            self.send(404, {"error": "not found"})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """POST-anrop"""
+        path, _ = self.route()
+        if path == "/_reset":
+            self.read_body()
+            with self.data.lock:
+                self.data.stats.clear()
+            self.send(204)
+            return
+        if not self.before(path):
+            return
+
+        body = self.read_body()
+        parts = path.split("/")
+        if path in ("/authn/login-with-expiry", "/authn/refresh"):
+            expiration = datetime.now(timezone.utc) + timedelta(minutes=10)
+            self.send(
+                201,
+                {"accessTokenExpiration": expiration.isoformat()},
+                {
+                    "Set-Cookie": f"folioAccessToken={uuid.uuid4()}; Path=/",
+                },
+            )
+        elif path == "/authn/logout":
+            self.send(204)
+        elif path == "/circulation/renew-by-barcode":
+            loan = self.data.renew(json.loads(body).get("itemBarcode"))
+            if loan is None:
+                self.send(422, {"errors": [{"message": "loan is not renewable"}]})
+            else:
+                self.send(200, loan)
+        elif path == "/data-import/uploadDefinitions":
+            self.send(201, self.data.create_upload_definition(json.loads(body)))
+        elif len(parts) == 5 and parts[4] == "files":
+            upload_definition = self.data.add_file_definition(
+                parts[3], json.loads(body)
+            )
+            self.send(404 if upload_definition is None else 201, upload_definition)
+        elif len(parts) == 6 and parts[4] == "files":
+            upload_definition = self.data.upload_file(parts[3], parts[5], body)
+            self.send(404 if upload_definition is None else 200, upload_definition)
+        elif len(parts) == 5 and parts[4] == "processFiles":
+            self.send(204 if self.data.process_files(parts[3]) else 404)
+        elif path.startswith("/libris"):
+            self.send_libris_export()
+        else:
+            self.send(404, {"error": "not found"})
+
+    def do_DELETE(self):  # pylint: disable=invalid-name
+        """DELETE-anrop"""
+        path, _ = self.route()
+        if not self.before(path):
+            return
+        self.read_body()
+        parts = path.split("/")
+        if path.startswith("/data-import/uploadDefinitions/") and len(parts) == 4:
+            self.send(204 if self.data.delete_upload_definition(parts[3]) else 404)
+        else:
+            self.send(404, {"error": "not found"})
+
+    def send_libris_export(self):
+        """Strömma en syntetisk export från Libris"""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        block = bytearray()
+        for number in range(self.data.settings.libris_records):
+            block += make_marc_record(number)
+            if len(block) >= 64 * 1024:
+                self.write_chunk(bytes(block))
+                block.clear()
+        if block:
+            self.write_chunk(bytes(block))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, chunk):
+        """Skriv ett block med chunked transfer encoding"""
+        self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+
+
+def normalize_path(path):
+    """Sökväg med UUID:n ersatta, för statistik per endpoint"""
+    return re.sub(
+        r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", "{id}", path
+    )
+
+
+def start_server(settings, port=0):
+    """Starta servern i en egen tråd. Returnerar servern och dess data."""
+    data = FakeData(settings)
+    handler = type("Handler", (FakeRequestHandler,), {"data": data})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, data
+
+
+def main():
+    """Kör servern tills den avbryts"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0, help="svarstid i ms")
+    parser.add_argument("--error-rate", type=float, default=0, help="andel fel")
+    parser.add_argument("--loans", type=int, default=1000)
+    parser.add_argument("--reference-entries", type=int, default=50)
+    parser.add_argument("--libris-records", type=int, default=1000)
+    parser.add_argument(
+        "--job-failure-rate",
+        type=float,
+        default=0,
+        help="andel importjobb som misslyckas",
+    )
+    args = parser.parse_args()
+
+    server, _ = start_server(
+        FakeServerSettings(
+            latency=args.latency / 1000,
+            error_rate=args.error_rate,
+            reference_entries=args.reference_entries,
+            loans=args.loans,
+            libris_records=args.libris_records,
+            job_failure_rate=args.job_failure_rate,
+        ),
+        args.port,
+    )
+    print(f"Lyssnar på http://127.0.0.1:{server.server_address[1]}/")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
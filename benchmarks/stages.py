@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+"""
+Mät stegen i uppdelningen av MARC-filer i libris_to_folio mot syntetiska filer
+från marc_corpus.py: poster/s, MB/s och högsta minnesanvändning (RSS) per steg
+och filstorlek.
+
+Varje steg körs i en egen process så att minnesanvändningen bara gäller steget.
+För custom_transform och write_marc_chunk läses posterna in innan tiden börjar
+mätas, så minnet för de stegen inkluderar posterna i minnet. Resultatet kan
+sparas som baslinje (--save-baseline) och senare jämföras mot (--baseline).
+
+Exempel:
+    python -m benchmarks.stages --records 10000 --records 50000 --save-baseline baslinje.json
+    python -m benchmarks.stages --records 10000 --records 50000 --baseline baslinje.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from benchmarks.marc_corpus import CorpusSettings, generate_corpus
+from libris_import import iso2709
+from libris_import import libris_to_folio
+
+DEFAULT_RECORDS = [1000, 10000, 50000]
+CHUNK_SIZE = 1000
+
+
+def split_raw_records(corpus_path, _work_dir):
+    """Dela upp filen i råa poster på bytenivå"""
+    return sum(1 for _ in iso2709.read_raw_records(corpus_path))
+
+
+def read_marc_records(corpus_path, _work_dir):
+    """Läs och tolka filen med pymarc"""
+    return sum(1 for _ in libris_to_folio.read_marc_records(corpus_path))
+
+
+def parse_marc_records(corpus_path, _work_dir):
+    """Dela upp filen och tolka posterna (snabbväg eller pymarc)"""
+    return sum(
+        1
+        for raw_record in iso2709.read_raw_records(corpus_path)
+        if libris_to_folio.parse_marc_record(raw_record) is not None
+    )
+
+
+def custom_transform(records, _work_dir):
+    """Transformera redan tolkade poster"""
+    for record in records:
+        libris_to_folio.custom_transform(record)
+    return len(records)
+
+
+def write_marc_chunk(records, work_dir):
+    """Skriv redan transformerade poster till en fil"""
+    libris_to_folio.write_marc_chunk(records, Path(work_dir) / "chunk.mrc")
+    return len(records)
+
+
+def process_mrc_files_serial(corpus_path, work_dir):
+    """Hela uppdelningen i en process"""
+    return libris_to_folio.process_mrc_files(
+        Path(corpus_path).parent, Path(work_dir) / "chunks", CHUNK_SIZE, workers=1
+    )
+
+
+def process_mrc_files_parallel(corpus_path, work_dir):
+    """Hela uppdelningen med en processpool"""
+    return libris_to_folio.process_mrc_files(
+        Path(corpus_path).parent, Path(work_dir) / "chunks", CHUNK_SIZE
+    )
+
+
+def parsed_records(corpus_path):
+    """Tolkade poster för steg som mäts på poster i minnet"""
+    return [
+        libris_to_folio.parse_marc_record(raw_record)
+        for raw_record in iso2709.read_raw_records(corpus_path)
+    ]
+
+
+def transformed_records(corpus_path):
+    """Transformerade poster för steg som mäts på poster i minnet"""
+    return [
+        libris_to_folio.custom_transform(record)
+        for record in parsed_records(corpus_path)
+    ]
+
+
+# Steg -> (funktion, förberedelse av indata eller None om funktionen läser filen)
+STAGES = {
+    "split_raw_records": (split_raw_records, None),
+    "read_marc_records": (read_marc_records, None),
+    "parse_marc_record": (parse_marc_records, None),
+    "custom_transform": (custom_transform, parsed_records),
+    "write_marc_chunk": (write_marc_chunk, transformed_records),
+    "process_mrc_files": (process_mrc_files_serial, None),
+    "process_mrc_files_parallel": (process_mrc_files_parallel, None),
+}
+
+
+def run_stage(stage, corpus_path, work_dir):
+    """Kör ett steg och mät tid och minne (körs i en egen process)"""
+    function, prepare = STAGES[stage]
+    arguments = prepare(corpus_path) if prepare else corpus_path
+    start = time.perf_counter()
+    records = function(arguments, work_dir)
+    seconds = time.perf_counter() - start
+    # ru_maxrss är i kB på Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return records, seconds, peak_rss
+
+
+def measure_stage(stage, corpus_path):
+    """Kör ett steg i en ny process"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        with ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+            max_tasks_per_child=1,
+        ) as executor:
+            return executor.submit(run_stage, stage, corpus_path, work_dir).result()
+
+
+def measure_corpus(records, stages, corpus_settings):
+    """Skapa en syntetisk fil och mät valda steg på den"""
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        corpus_path = str(Path(corpus_dir) / "corpus.mrc")
+        size = generate_corpus(corpus_path, corpus_settings)
+        results = []
+        for stage in stages:
+            count, seconds, peak_rss = measure_stage(stage, corpus_path)
+            results.append(
+                {
+                    "stage": stage,
+                    "records": records,
+                    "processed": count,
+                    "seconds": seconds,
+                    "records_per_second": records / seconds if seconds else 0,
+                    "mb_per_second": size / 1024 / 1024 / seconds if seconds else 0,
+                    "peak_rss_mb": peak_rss,
+                }
+            )
+        return size, results
+
+
+def load_baseline(path):
+    """Läs en sparad baslinje som {(steg, antal poster): resultat}"""
+    with open(path, encoding="utf-8") as f:
+        return {
+            (result["stage"], result["records"]): result
+            for result in json.load(f)["results"]
+        }
+
+
+def change(value, baseline_value):
+    """Förändring mot baslinjen i procent som text"""
+    if not baseline_value:
+        return ""
+    return f"{(value - baseline_value) / baseline_value * 100:+.0f}%"
+
+
+def print_results(size, results, baseline=None):
+    """Skriv ut resultatet för en filstorlek, med förändring mot baslinjen"""
+    print(f"\n{results[0]['records']} poster, {size / 1024 / 1024:.1f} MB")
+    print(
+        f"{'Steg':<28}{'Tid (s)':>10}{'Poster/s':>12}{'MB/s':>8}"
+        f"{'Minne (MB)':>12}{'Tid mot baslinje':>18}{'Minne mot baslinje':>20}"
+    )
+    for result in results:
+        previous = (baseline or {}).get((result["stage"], result["records"]), {})
+        print(
+            f"{result['stage']:<28}"
+            f"{result['seconds']:>10.3f}"
+            f"{result['records_per_second']:>12.0f}"
+            f"{result['mb_per_second']:>8.1f}"
+            f"{result['peak_rss_mb']:>12.1f}"
+            f"{change(result['seconds'], previous.get('seconds')):>18}"
+            f"{change(result['peak_rss_mb'], previous.get('peak_rss_mb')):>20}"
+        )
+
+
+def main():
+    """Mät stegen för valda filstorlekar"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--records",
+        type=int,
+        action="append",
+        help=f"antal poster i filen, kan anges flera gånger (standard: {DEFAULT_RECORDS})",
+    )
+    parser.add_argument(
+        "--stage",
+        action="append",
+        choices=list(STAGES),
+        help="steg att mäta (standard: alla)",
+    )
+    parser.add_argument(
+        "--duplicate-ratio", type=float, default=CorpusSettings.duplicate_ratio
+    )
+    parser.add_argument(
+        "--fallback-ratio", type=float, default=CorpusSettings.fallback_ratio
+    )
+    parser.add_argument("--seed", type=int, default=CorpusSettings.seed)
+    parser.add_argument("--baseline", help="jämför med baslinjen i denna fil")
+    parser.add_argument("--save-baseline", help="spara resultatet som baslinje")
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline) if args.baseline else None
+    all_results = []
+    for records in args.records or DEFAULT_RECORDS:
+        size, results = measure_corpus(
+            records,
+            args.stage or list(STAGES),
+            CorpusSettings(
+                records=records,
+                duplicate_ratio=args.duplicate_ratio,
+                fallback_ratio=args.fallback_ratio,
+                seed=args.seed,
+            ),
+        )
+        print_results(size, results, baseline)
+        all_results += results
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "duplicate_ratio": args.duplicate_ratio,
+                    "fallback_ratio": args.fallback_ratio,
+                    "seed": args.seed,
+                    "results": all_results,
+                },
+                f,
+                indent=4,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""
+Mät kostnaden per post för custom_transform med olika många regler (se
+libris_import/marc_rules.py). De kompilerade reglerna går igenom varje post en
+gång oavsett antal regler och jämförs med att köra reglerna en i taget (en
+genomgång av posten per regel, som den tidigare hårdkodade transformationen).
+Körs helt lokalt med syntetiska poster från marc_corpus.py.
+
+Exempel:
+    python -m benchmarks.transform_rules --records 5000 --rules 2 --rules 20
+"""
+
+import argparse
+import time
+
+from benchmarks.marc_corpus import CorpusSettings, generate_records
+from libris_import import iso2709, marc_rules
+
+DEFAULT_RULE_COUNTS = [2, 5, 10, 20]
+
+# Regler utöver standardreglerna, i den ordning de läggs till
+EXTRA_RULES = [
+    {
+        "action": "replace",
+        "tag": "245",
+        "code": "a",
+        "pattern": " :$",
+        "replacement": "",
+    },
+    {"action": "move", "tag": "500", "to_tag": "590"},
+    {"action": "remove_subfield", "tag": "700", "code": "4"},
+    {
+        "action": "replace",
+        "tag": "650",
+        "indicator": 2,
+        "pattern": "7",
+        "replacement": "4",
+    },
+    {"action": "replace", "tag": "008", "pattern": "swe", "replacement": "swe"},
+    {"action": "move", "tag": "020", "code": "q", "to_code": "c"},
+    {"action": "remove_field", "tag": "040"},
+    {
+        "action": "replace",
+        "tag": "264",
+        "code": "b",
+        "pattern": ",$",
+        "replacement": "",
+    },
+    {
+        "action": "replace",
+        "tag": "300",
+        "code": "a",
+        "pattern": r" s\.",
+        "replacement": " sidor",
+    },
+    {"action": "remove_subfield", "tag": "100", "code": "4"},
+]
+
+
+def make_rules(count, absent=False):
+    """Standardreglerna följda av count - 2 regler till (byggs på vid behov).
+    Med absent gäller de extra reglerna taggar som inte finns i posterna, så att
+    bara kostnaden för själva uppslaget mäts."""
+    rules = list(marc_rules.DEFAULT_RULES)
+    extra = []
+    while len(rules) + len(extra) < count:
+        extra += EXTRA_RULES
+    extra = extra[: max(count - len(rules), 0)]
+    if absent:
+        extra = [
+            {
+                **rule,
+                # 009 är ett kontrollfält som inte finns i posterna
+                "tag": (
+                    "009"
+                    if marc_rules.is_control_tag(rule["tag"])
+                    else f"9{number:02d}"
+                ),
+                **({"to_tag": "999"} if "to_tag" in rule else {}),
+            }
+            for number, rule in enumerate(extra)
+        ]
+    return rules + extra
+
+
+def measure(raw_records, transform):
+    """Tid för att transformera alla poster (tolkning ingår inte)"""
+    records = [iso2709.RawRecord(raw) for raw in raw_records]
+    start = time.perf_counter()
+    for record in records:
+        transform(record)
+    return time.perf_counter() - start
+
+
+def main():
+    """Mät transformationen för olika antal regler"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument(
+        "--rules",
+        type=int,
+        action="append",
+        help=f"antal regler, kan anges flera gånger (standard: {DEFAULT_RULE_COUNTS})",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    raw_records = list(generate_records(CorpusSettings(records=args.records)))
+    print(f"{args.records} poster, bästa av {args.repeat} körningar")
+    print("Tid per post i µs. Saknade taggar: de extra reglerna matchar inga fält.")
+    print(
+        f"{'Regler':>8}{'Kompilerade':>14}{'En i taget':>14}"
+        f"{'Kompilerade, saknade taggar':>30}{'En i taget, saknade taggar':>30}"
+    )
+    for count in args.rules or DEFAULT_RULE_COUNTS:
+        times = []
+        for absent in (False, True):
+            rules = make_rules(count, absent)
+            compiled = marc_rules.TransformRules(rules)
+            separate = [marc_rules.TransformRules([rule]) for rule in rules]
+
+            def apply_separately(record, separate=separate):
+                for rule in separate:
+                    rule.apply(record)
+
+            for transform in (compiled.apply, apply_separately):
+                times.append(
+                    min(measure(raw_records, transform) for _ in range(args.repeat))
+                    / args.records
+                    * 1e6
+                )
+        print(
+            f"{count:>8}{times[0]:>14.2f}{times[1]:>14.2f}"
+            f"{times[2]:>30.2f}{times[3]:>30.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
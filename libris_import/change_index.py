@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+"""
+Index över vad som senast importerats till Folio per Libris-ID.
+
+För varje post sparas en hash av den transformerade posten. Poster vars hash inte
+ändrats sedan förra lyckade importen kan hoppas över. Nya hashar sparas först i en
+väntande tabell och flyttas till indexet med commit() när importen gått bra, så
+att en misslyckad körning inte påverkar indexet. De väntande hasharna sparas med
+save_pending() när uppdelningen är klar (och när indexet stängs), så att en
+avbruten körning kan återupptas med keep_pending.
+"""
+
+import hashlib
+import sqlite3
+
+
+class ChangeIndex:
+    """SQLite-baserat index Libris-ID -> hash av transformerad post"""
+
+    def __init__(self, path, keep_pending=False):
+        self.skipped = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS records (
+                libris_id TEXT PRIMARY KEY,
+                digest BLOB NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS pending (
+                libris_id TEXT PRIMARY KEY,
+                digest BLOB NOT NULL
+            ) WITHOUT ROWID;
+            """)
+        # Väntande hashar behålls bara när en avbruten körning återupptas
+        if not keep_pending:
+            self.discard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def is_unchanged(self, libris_id, marc):
+        """Kontrollera om posten är oförändrad sedan senaste import.
+        Ändrade poster läggs som väntande i indexet."""
+        digest = hashlib.blake2b(marc, digest_size=16).digest()
+        row = self.connection.execute(
+            "SELECT digest FROM records WHERE libris_id = ?", (libris_id,)
+        ).fetchone()
+        if row and row[0] == digest:
+            self.skipped += 1
+            return True
+        self.connection.execute(
+            "INSERT OR REPLACE INTO pending (libris_id, digest) VALUES (?, ?)",
+            (libris_id, digest),
+        )
+        return False
+
+    def save_pending(self):
+        """Spara väntande hashar till disk - anropas när uppdelningen är klar"""
+        self.connection.commit()
+
+    def commit(self):
+        """Flytta väntande hashar till indexet - anropas efter lyckad import"""
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO records SELECT libris_id, digest FROM pending"
+            )
+            self.connection.execute("DELETE FROM pending")
+
+    def discard(self):
+        """Släng väntande hashar - anropas efter misslyckad import"""
+        with self.connection:
+            self.connection.execute("DELETE FROM pending")
+
+    def close(self):
+        """Spara väntande hashar och stäng indexet. De flyttas inte till indexet
+        och slängs vid nästa körning om den inte återupptar denna."""
+        self.save_pending()
+        self.connection.close()
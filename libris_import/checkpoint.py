@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+"""
+Checkpoint för körningar som kan återupptas.
+
+Ett manifest (resume.json i LIBRIS_BASE_FOLDER) håller reda på vilket tidsfönster
+som hämtats från Libris och hur långt körningen kom: exporten nedladdad, chunks
+skrivna, vilka chunks som laddats upp, vilka importer (upload definitions) som
+initierats och om alla chunks importerats. Misslyckas en
+körning sparas exporten, chunks och manifestet så att nästa körning kan fortsätta
+från första ofullständiga steg utan att hämta data från Libris igen.
+"""
+
+import logging
+import os
+import threading
+
+from utils import utils
+
+MAX_ATTEMPTS = 3
+
+
+class Checkpoint:
+    """Manifest över hur långt en körning kommit"""
+
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, last_run_timestamp, current_timestamp):
+        """Läs in manifestet från en tidigare misslyckad körning om det gäller samma
+        tidsfönster och inte försökts för många gånger, annars skapa ett nytt"""
+        if os.path.exists(path):
+            try:
+                data = utils.load_json_file(path)
+            except ValueError:
+                data = {}
+            if (
+                data.get("from") == last_run_timestamp
+                and data.get("downloaded")
+                and data.get("export_file")
+                and os.path.isfile(
+                    os.path.join(os.path.dirname(path), data["export_file"])
+                )
+                and data.get("attempts", 0) < MAX_ATTEMPTS
+            ):
+                checkpoint = cls(path, data)
+                checkpoint.update(attempts=data.get("attempts", 0) + 1)
+                logging.info(
+                    "Återupptar körning för perioden %s - %s (försök %s)",
+                    data["from"],
+                    data["until"],
+                    checkpoint.attempts,
+                )
+                return checkpoint
+            logging.info("Kastar checkpoint från tidigare körning: %s", path)
+
+        return cls(
+            path,
+            {
+                "from": last_run_timestamp,
+                "until": current_timestamp,
+                "attempts": 1,
+                "downloaded": False,
+                "export_file": None,
+                "chunked": False,
+                "upload_definition_id": None,
+                "uploaded": [],
+                "imports": [],
+                "imported": [],
+                "submitted": False,
+            },
+        )
+
+    @property
+    def resumed(self):
+        """Checkpointen kommer från en tidigare körning"""
+        return self.attempts > 1
+
+    @property
+    def attempts(self):
+        """Antal försök för tidsfönstret"""
+        return self.data["attempts"]
+
+    @property
+    def until(self):
+        """Slutet på tidsfönstret som hämtats från Libris"""
+        return self.data["until"]
+
+    @property
+    def downloaded(self):
+        """Exporten från Libris är nedladdad"""
+        return self.data["downloaded"]
+
+    @property
+    def export_file(self):
+        """Filnamn för exporten från Libris"""
+        return self.data["export_file"]
+
+    @property
+    def chunked(self):
+        """Alla chunks är skrivna"""
+        return self.data["chunked"]
+
+    @property
+    def upload_definition_id(self):
+        """Upload definition som chunks laddas upp till"""
+        return self.data["upload_definition_id"]
+
+    @property
+    def uploaded(self):
+        """Filnamn för chunks som laddats upp till upload definition"""
+        return set(self.data["uploaded"])
+
+    @property
+    def imports(self):
+        """Upload definitions vars import initierats i Folio"""
+        return list(self.data.get("imports", []))
+
+    @property
+    def imported(self):
+        """Filnamn för chunks som ingår i en initierad import"""
+        return set(self.data.get("imported", []))
+
+    @property
+    def submitted(self):
+        """Importen av alla chunks har initierats i Folio"""
+        return self.data["submitted"]
+
+    def update(self, **changes):
+        """Uppdatera och spara manifestet"""
+        with self._lock:
+            self.data.update(changes)
+            utils.save_json_file(self.path, self.data)
+
+    def mark_uploaded(self, file_name):
+        """Markera en chunk som uppladdad (kan anropas från flera trådar)"""
+        with self._lock:
+            self.data["uploaded"].append(file_name)
+            utils.save_json_file(self.path, self.data)
+
+    def mark_imported(self, upload_definition_id, file_names):
+        """Markera att importen för en upload definition initierats"""
+        with self._lock:
+            self.data["imports"] = self.imports + [upload_definition_id]
+            self.data["imported"] = sorted(self.imported | set(file_names))
+            self.data["upload_definition_id"] = None
+            self.data["uploaded"] = []
+            utils.save_json_file(self.path, self.data)
+
+    def remove(self):
+        """Ta bort manifestet efter en lyckad körning"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
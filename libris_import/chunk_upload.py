@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+"""
+Uppladdning av chunks till Folio direkt från minnet.
+
+I stället för att varje chunk skrivs till fil, läses in igen vid uppladdningen
+och raderas efteråt laddas den upp så snart den är full. Upload definition skapas
+med den första chunken och övriga läggs till en i taget. Med chunks_per_import
+skapas en ny upload definition när den förra har så många chunks, så att stora
+körningar kan importeras i flera omgångar. Högst concurrency chunks
+laddas upp samtidigt - är alla upptagna väntar uppdelningen, så minnet begränsas
+av antalet chunks under uppladdning.
+
+Med spill_dir (återupptagbara körningar, standard i libris_to_folio) skrivs varje
+chunk även till fil, så att en misslyckad körning kan fortsätta från filerna som
+tidigare. Direktuppladdningen sparar då läsningen av filerna men inte
+skrivningen - bara utan spill_dir hålls chunks enbart i minnet.
+
+Går en uppladdning fel laddas inga fler chunks upp men uppdelningen fortsätter
+(och filerna skrivs om spill_dir används). Felet lyfts av finish() och upload
+definitions som inte ska användas kan raderas med delete_upload_definitions().
+Lämnas with-blocket utan att finish() anropats (t.ex. efter fel vid hämtning
+eller uppdelning) raderas alla upload definitions, eftersom de aldrig importeras.
+"""
+
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from httpx import TimeoutException
+from pyfolioclient import BadRequestError, ItemNotFoundError
+
+from utils import metrics, utils
+
+UPLOAD_DEFINITIONS_PATH = "/data-import/uploadDefinitions"
+
+
+def content_size(content):
+    """Storlek i bytes för en chunk (bytes eller fil)"""
+    if isinstance(content, bytes):
+        return len(content)
+    position = content.tell()
+    size = content.seek(0, os.SEEK_END)
+    content.seek(position)
+    return size
+
+
+def close_content(content):
+    """Stäng en chunk som lämnats över som fil"""
+    if not isinstance(content, bytes):
+        content.close()
+
+
+class ChunkUploader:
+    """Laddar upp chunks till en upload definition medan de skapas"""
+
+    def __init__(self, folio, concurrency=1, spill_dir=None, chunks_per_import=0):
+        self.folio = folio
+        self.concurrency = max(concurrency, 1)
+        self.spill_dir = spill_dir
+        self.chunks_per_import = chunks_per_import
+        # (id, filnamn) för varje upload definition i den ordning de skapats
+        self.upload_definitions = []
+        self.uploaded = []
+        self.error = None
+        self.finished = False
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        if not self.finished:
+            self.delete_upload_definitions(
+                [
+                    upload_definition_id
+                    for upload_definition_id, _ in self.upload_definitions
+                ]
+            )
+
+    def add(self, file_name, content, record_count):
+        """Ladda upp en chunk: MARC-data som bytes, eller en binär fil positionerad
+        i början som stängs när den laddats upp. Väntar om concurrency chunks
+        redan laddas upp."""
+        if self.spill_dir is not None:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with open(os.path.join(self.spill_dir, file_name), "wb") as fh:
+                if isinstance(content, bytes):
+                    fh.write(content)
+                else:
+                    shutil.copyfileobj(content, fh, 1024 * 1024)
+                    content.seek(0)
+        metrics.increment("chunks_written")
+        metrics.increment("records_written", record_count)
+        if self.error is not None:
+            close_content(content)
+            return
+
+        self._slots.acquire()  # pylint: disable=consider-using-with
+        try:
+            upload_definition_id, file_definition_id = self.add_file_definition(
+                file_name
+            )
+        except RuntimeError as e:
+            self._slots.release()
+            self.error = e
+            close_content(content)
+            return
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        future = self._executor.submit(
+            self.upload, upload_definition_id, file_name, file_definition_id, content
+        )
+        future.add_done_callback(lambda _: self._slots.release())
+        logging.info("Laddar upp %s poster som %s", record_count, file_name)
+
+    def add_file_definition(self, file_name):
+        """Skapa en upload definition (första chunken, eller när den förra är full)
+        eller lägg till en file definition i den senaste. Returnerar id för upload
+        definition och file definition."""
+        current = self.upload_definitions[-1] if self.upload_definitions else None
+        try:
+            if current is None or (
+                self.chunks_per_import and len(current[1]) >= self.chunks_per_import
+            ):
+                upload_definition = self.folio.post_data(
+                    UPLOAD_DEFINITIONS_PATH,
+                    payload={"fileDefinitions": [{"name": file_name}]},
+                )
+                current = (upload_definition["id"], [])
+                self.upload_definitions.append(current)
+            else:
+                upload_definition = self.folio.post_data(
+                    f"{UPLOAD_DEFINITIONS_PATH}/{current[0]}/files",
+                    payload={"uploadDefinitionId": current[0], "name": file_name},
+                )
+        except (
+            ConnectionError,
+            TimeoutError,
+            TimeoutException,
+            BadRequestError,
+            ItemNotFoundError,
+            RuntimeError,
+        ) as e:
+            logging.error(
+                "Fel vid skapande av file definition för %s: %s", file_name, e
+            )
+            raise RuntimeError(f"Fel vid skapande av file definition: {e}") from e
+
+        for file_definition in upload_definition.get("fileDefinitions", []):
+            if file_definition["name"] == file_name:
+                current[1].append(file_name)
+                return current[0], file_definition["id"]
+        raise RuntimeError(f"File definition för {file_name} saknas i svaret")
+
+    def upload(self, upload_definition_id, file_name, file_definition_id, content):
+        """Ladda upp innehållet för en file definition (körs i en tråd)"""
+        size = content_size(content)
+        try:
+            with metrics.span("chunk_upload"):
+                utils.post_binary(
+                    self.folio,
+                    f"{UPLOAD_DEFINITIONS_PATH}/{upload_definition_id}"
+                    f"/files/{file_definition_id}",
+                    content=content,
+                )
+        except (
+            ConnectionError,
+            TimeoutError,
+            TimeoutException,
+            BadRequestError,
+            ItemNotFoundError,
+            RuntimeError,
+        ) as e:
+            logging.error(
+                "Fel vid uppladdning av %s (id %s) till upload definition %s: %s",
+                file_name,
+                file_definition_id,
+                upload_definition_id,
+                e,
+            )
+            with self._lock:
+                if self.error is None:
+                    self.error = RuntimeError(f"Fel vid uppladdning av fil: {e}")
+            return
+        finally:
+            close_content(content)
+        metrics.increment("bytes_uploaded", size)
+        with self._lock:
+            self.uploaded.append(file_name)
+
+    def finish(self):
+        """Vänta tills alla uppladdningar är klara. Returnerar (id, filnamn) för
+        varje upload definition (tom lista om inga chunks laddats upp) eller lyfter
+        RuntimeError om någon uppladdning misslyckats."""
+        self.close()
+        self.finished = True
+        if self.error is not None:
+            raise self.error
+        return self.upload_definitions
+
+    def delete_upload_definitions(self, upload_definition_ids):
+        """Radera upload definitions som skapats men inte ska importeras, t.ex.
+        efter ett fel. Fel vid raderingen loggas bara."""
+        if upload_definition_ids:
+            logging.info(
+                "Raderar %s upload definitions som inte importeras",
+                len(upload_definition_ids),
+            )
+        for upload_definition_id in upload_definition_ids:
+            try:
+                self.folio.delete_data(
+                    f"{UPLOAD_DEFINITIONS_PATH}/{upload_definition_id}"
+                )
+            except (
+                ConnectionError,
+                TimeoutError,
+                TimeoutException,
+                BadRequestError,
+                ItemNotFoundError,
+                RuntimeError,
+            ) as e:
+                logging.warning(
+                    "Kunde inte radera upload definition %s: %s",
+                    upload_definition_id,
+                    e,
+                )
+                continue
+            logging.info("Raderade upload definition %s", upload_definition_id)
+
+    def close(self):
+        """Vänta in pågående uppladdningar"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""
+Dublettkontroll med begränsat minne för återladdning av hela beståndet.
+
+Första genomläsningen sparar för varje Libris-ID positionen för den sista
+förekomsten i en temporär SQLite-databas på disk. Vid andra genomläsningen
+behålls bara poster vars position finns kvar (senaste förekomsten vinner).
+Positionerna läses i stigande ordning, så minnesanvändningen är oberoende av
+antalet poster.
+"""
+
+import os
+import sqlite3
+import tempfile
+
+
+class LastOccurrenceIndex:
+    """Temporärt index Libris-ID -> position för sista förekomsten"""
+
+    def __init__(self, directory=None):
+        file_descriptor, self.path = tempfile.mkstemp(
+            prefix="dedup_", suffix=".sqlite", dir=directory
+        )
+        os.close(file_descriptor)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript("""
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            PRAGMA cache_size = -65536;
+            CREATE TABLE last_occurrence (
+                libris_id TEXT PRIMARY KEY,
+                position INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            """)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, libris_id, position):
+        """Registrera en förekomst - senare positioner ersätter tidigare"""
+        self.connection.execute(
+            "INSERT OR REPLACE INTO last_occurrence (libris_id, position) VALUES (?, ?)",
+            (libris_id, position),
+        )
+
+    def iter_positions(self):
+        """Ge positionerna för sista förekomsten av varje Libris-ID i stigande ordning"""
+        self.connection.commit()
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS position_index ON last_occurrence (position)"
+        )
+        for (position,) in self.connection.execute(
+            "SELECT position FROM last_occurrence ORDER BY position"
+        ):
+            yield position
+
+    def filter_last(self, items):
+        """Behåll bara de element i items (i samma ordning som vid registreringen)
+        som är sista förekomsten av sitt Libris-ID"""
+        positions = self.iter_positions()
+        next_position = next(positions, None)
+        for position, item in enumerate(items):
+            if next_position is None:
+                return
+            if position == next_position:
+                yield item
+                next_position = next(positions, None)
+
+    def close(self):
+        """Stäng och radera indexet"""
+        self.connection.close()
+        os.remove(self.path)
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+"""
+Index över posternas position i exportfiler från Libris och komprimerat arkiv
+över tidigare exporter.
+
+Exportfilen gås igenom via mmap utan att posterna tolkas: postlängden i leadern
+ger nästa post och fält 001 läses direkt ur katalogen. Indexet (Libris-ID ->
+position och längd i bytes) sparas i en SQLite-fil bredvid exporten, så att
+enskilda poster kan plockas ut utan att allt före dem tolkas. Data som inte går
+att dela upp i poster hoppas över (som i karantänen, se iso2709.scan_records).
+Indexet byggs när exporten hämtats, i en temporär fil som tas bort om
+indexeringen misslyckas.
+
+Efter en lyckad import komprimeras exporten (gzip, eller zstd om paketet
+zstandard är installerat) och flyttas tillsammans med indexet till arkivet. Bara
+de senaste exporterna sparas. Positionerna i indexet avser den okomprimerade
+exporten - för en komprimerad export packas allt fram till posten upp.
+
+Plocka ut poster ur en arkiverad export:
+    python -m libris_import.export_archive archive/export_<tidsstämpel>.mrc.gz \\
+        <Libris-ID> [...] --output poster.mrc
+"""
+
+import argparse
+import gzip
+import logging
+import mmap
+import os
+import shutil
+import sqlite3
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:  # zstd är valfritt, gzip används annars
+    zstandard = None
+
+from libris_import import iso2709
+
+INDEX_SUFFIX = ".idx.sqlite"
+COMPRESSED_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def index_path_for(export_path):
+    """Sökväg till indexet för en export (okomprimerad eller arkiverad)"""
+    path = str(export_path)
+    for suffix in COMPRESSED_SUFFIXES.values():
+        if path.endswith(suffix):
+            path = path[: -len(suffix)]
+    return path + INDEX_SUFFIX
+
+
+def scan_records(buffer, on_invalid=None):
+    """Ge (position, längd) för varje post i en buffert med ISO2709-data. Data som
+    inte går att dela upp i poster hoppas över och skickas som (position, längd,
+    orsak) till on_invalid."""
+    end = 0
+    for offset, length, reason in iso2709.scan_records(buffer, tolerant=True):
+        end = offset + length
+        if reason is None:
+            yield offset, length
+        elif on_invalid is not None:
+            on_invalid(offset, length, reason)
+    if end < len(buffer) and on_invalid is not None:
+        on_invalid(end, len(buffer) - end, "ofullständig post")
+
+
+def read_control_field(buffer, offset, length, tag=b"001"):
+    """Läs ett kontrollfält direkt ur katalogen för posten vid offset, eller None"""
+    try:
+        base_address = int(buffer[offset + 12 : offset + 17])
+    except ValueError:
+        return None
+    directory_end = offset + base_address - 1
+    for entry in range(
+        offset + iso2709.LEADER_LEN, directory_end, iso2709.DIRECTORY_ENTRY_LEN
+    ):
+        if buffer[entry : entry + 3] == tag:
+            try:
+                field_length = int(buffer[entry + 3 : entry + 7])
+                field_start = (
+                    offset + base_address + int(buffer[entry + 7 : entry + 12])
+                )
+            except ValueError:
+                return None
+            # Fältlängden inkluderar fältavslutet
+            if field_start + field_length > offset + length:
+                return None
+            return bytes(buffer[field_start : field_start + field_length - 1])
+    return None
+
+
+def build_offset_index(export_path, index_path=None):
+    """Bygg indexet Libris-ID -> (position, längd) för en export.
+    Returnerar antalet poster."""
+    index_path = index_path or index_path_for(export_path)
+    temp_path = index_path + ".tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    skipped = []
+    try:
+        count = write_offset_index(
+            export_path, temp_path, lambda *invalid: skipped.append(invalid)
+        )
+        os.replace(temp_path, index_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    for offset, length, reason in skipped:
+        logging.warning(
+            "Hoppade över %s bytes vid position %s i %s vid indexering: %s",
+            length,
+            offset,
+            export_path,
+            reason,
+        )
+    return count
+
+
+def write_offset_index(export_path, index_path, on_invalid=None):
+    """Skriv indexet för en export till en ny SQLite-fil. Returnerar antalet
+    poster."""
+    connection = sqlite3.connect(index_path)
+    try:
+        connection.executescript("""
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            CREATE TABLE records (
+                libris_id TEXT,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            );
+            """)
+        count = 0
+        with open(export_path, "rb") as fh:
+            if os.fstat(fh.fileno()).st_size:
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    rows = (
+                        (
+                            (read_control_field(buffer, offset, length) or b"").decode(
+                                "utf-8", "replace"
+                            )
+                            or None,
+                            offset,
+                            length,
+                        )
+                        for offset, length in scan_records(buffer, on_invalid)
+                    )
+                    count = connection.executemany(
+                        "INSERT INTO records (libris_id, offset, length) "
+                        "VALUES (?, ?, ?)",
+                        rows,
+                    ).rowcount
+        connection.execute("CREATE INDEX libris_id_index ON records (libris_id)")
+        connection.commit()
+    finally:
+        connection.close()
+    return count
+
+
+class OffsetIndex:
+    """Läsning av indexet för en export"""
+
+    def __init__(self, index_path):
+        self.connection = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def lookup(self, libris_id):
+        """Alla (position, längd) för ett Libris-ID i exportordning"""
+        return self.connection.execute(
+            "SELECT offset, length FROM records WHERE libris_id = ? ORDER BY offset",
+            (libris_id,),
+        ).fetchall()
+
+    def ranges(self):
+        """Alla (position, längd) i exportordning"""
+        return self.connection.execute(
+            "SELECT offset, length FROM records ORDER BY offset"
+        )
+
+    def close(self):
+        """Stäng indexet"""
+        self.connection.close()
+
+
+def open_export(export_path):
+    """Öppna en export för läsning, okomprimerad eller arkiverad"""
+    path = str(export_path)
+    if path.endswith(COMPRESSED_SUFFIXES["gzip"]):
+        return gzip.open(path, "rb")
+    if path.endswith(COMPRESSED_SUFFIXES["zstd"]):
+        if zstandard is None:
+            raise RuntimeError("Paketet zstandard behövs för att läsa " + path)
+        return zstandard.open(path, "rb")
+    return open(path, "rb")
+
+
+def read_records(export_path, ranges):
+    """Läs poster vid givna (position, längd), i stigande position"""
+    with open_export(export_path) as fh:
+        for offset, length in sorted(ranges):
+            fh.seek(offset)
+            yield fh.read(length)
+
+
+def compress_file(source_path, target_path, compression):
+    """Komprimera en fil med gzip eller zstd"""
+    with open(source_path, "rb") as source:
+        if compression == "zstd":
+            with zstandard.open(target_path, "wb") as target:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+        else:
+            with gzip.open(target_path, "wb", compresslevel=6) as target:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+
+
+def archive_export(export_path, archive_folder, compression="gzip"):
+    """Komprimera och flytta en export och dess index till arkivet (indexet byggs
+    om det saknas). Returnerar sökvägen till den arkiverade exporten."""
+    if compression == "zstd" and zstandard is None:
+        compression = "gzip"
+    archive_folder = Path(archive_folder)
+    archive_folder.mkdir(parents=True, exist_ok=True)
+    export_path = Path(export_path)
+
+    index_path = index_path_for(export_path)
+    if not os.path.exists(index_path):
+        build_offset_index(export_path, index_path)
+
+    target_path = archive_folder / (export_path.name + COMPRESSED_SUFFIXES[compression])
+    temp_path = target_path.with_name(target_path.name + ".tmp")
+    compress_file(export_path, temp_path, compression)
+    os.replace(temp_path, target_path)
+    shutil.move(index_path, index_path_for(target_path))
+    return target_path
+
+
+def get_archived_exports(archive_folder):
+    """Arkiverade exporter, äldst först (tidsstämpeln i filnamnet sorterar rätt)"""
+    return sorted(
+        path
+        for suffix in COMPRESSED_SUFFIXES.values()
+        for path in Path(archive_folder).glob(f"*.mrc{suffix}")
+    )
+
+
+def apply_retention(archive_folder, keep):
+    """Radera de äldsta arkiverade exporterna så att högst keep finns kvar.
+    Returnerar antalet raderade exporter."""
+    archived = get_archived_exports(archive_folder)
+    removed = archived[: max(len(archived) - keep, 0)]
+    for path in removed:
+        path.unlink()
+        index_path = index_path_for(path)
+        if os.path.exists(index_path):
+            os.remove(index_path)
+    return len(removed)
+
+
+def main():
+    """Plocka ut poster ur en export med hjälp av indexet"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("export", help="export (okomprimerad eller arkiverad)")
+    parser.add_argument("libris_ids", nargs="+", metavar="Libris-ID")
+    parser.add_argument("--output", required=True, help="MARC-fil att skriva")
+    args = parser.parse_args()
+
+    with OffsetIndex(index_path_for(args.export)) as index:
+        ranges = [
+            record_range
+            for libris_id in args.libris_ids
+            for record_range in index.lookup(libris_id)
+        ]
+    with open(args.output, "wb") as fh:
+        for record in read_records(args.export, ranges):
+            fh.write(record)
+    print(f"Skrev {len(ranges)} poster till {args.output}")
+
+
+if __name__ == "__main__":
+    main()
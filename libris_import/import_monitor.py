@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+"""
+Uppföljning av importjobb i Folio efter att processFiles anropats.
+
+Jobben (ett per fil i upload definition) pollas med exponentiell backoff tills de
+är klara. Resultatet sammanfattas i en ImportReport med antal poster, poster per
+sekund, tid per chunk och antal fel.
+
+Före varje import kan wait_for_capacity användas för att vänta tills antalet
+pågående importjobb i Folio (från alla användare) är nere på en given nivå.
+"""
+
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from pyfolioclient import BadRequestError, ItemNotFoundError
+
+FINISHED_STATUSES = {"COMMITTED", "ERROR", "CANCELLED", "DISCARDED"}
+SUCCESS_STATUS = "COMMITTED"
+# Jobb som bearbetas av data-import (NEW och FILE_UPLOADED räknas inte, de har
+# inte initierats)
+RUNNING_STATUSES = [
+    "PARSING_IN_PROGRESS",
+    "PARSING_FINISHED",
+    "PROCESSING_IN_PROGRESS",
+    "PROCESSING_FINISHED",
+    "COMMIT_IN_PROGRESS",
+]
+INITIAL_DELAY = 5
+MAX_DELAY = 120
+TIMEOUT = 2 * 60 * 60
+
+
+@dataclass
+class JobResult:
+    """Resultat för ett importjobb (en chunk)"""
+
+    job_id: str
+    file_name: str
+    status: str = ""
+    records: int = 0
+    errors: int = 0
+    duration: float | None = None
+
+    @property
+    def succeeded(self):
+        """Jobbet är klart utan fel"""
+        return self.status == SUCCESS_STATUS and not self.errors
+
+
+@dataclass
+class ImportReport:
+    """Sammanställning av alla jobb för en upload definition"""
+
+    upload_definition_id: str
+    jobs: list[JobResult] = field(default_factory=list)
+    elapsed: float = 0.0
+    timed_out: bool = False
+
+    @property
+    def records(self):
+        """Totalt antal poster i jobben"""
+        return sum(job.records for job in self.jobs)
+
+    @property
+    def errors(self):
+        """Totalt antal fel i jobben"""
+        return sum(job.errors for job in self.jobs)
+
+    @property
+    def failed_jobs(self):
+        """Jobb som inte blev klara eller som fick fel"""
+        return [job for job in self.jobs if not job.succeeded]
+
+    @property
+    def records_per_second(self):
+        """Poster per sekund räknat från att importen initierades"""
+        return self.records / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def succeeded(self):
+        """Alla jobb är klara utan fel (och det fanns jobb att följa upp)"""
+        return not self.timed_out and bool(self.jobs) and not self.failed_jobs
+
+    def log(self):
+        """Logga en sammanfattning av importen"""
+        durations = [job.duration for job in self.jobs if job.duration is not None]
+        logging.info(
+            "Import %s: %s poster i %s jobb på %.1f s (%.1f poster/s), "
+            "tid per chunk %.1f-%.1f s, %s fel",
+            self.upload_definition_id,
+            self.records,
+            len(self.jobs),
+            self.elapsed,
+            self.records_per_second,
+            min(durations, default=0.0),
+            max(durations, default=0.0),
+            self.errors,
+        )
+        if self.timed_out:
+            logging.error(
+                "Import %s blev inte klar inom %.0f s",
+                self.upload_definition_id,
+                self.elapsed,
+            )
+        for job in self.failed_jobs:
+            logging.error(
+                "Importjobb %s (%s) avslutades med status %s och %s fel",
+                job.job_id,
+                job.file_name,
+                job.status or "okänd",
+                job.errors,
+            )
+
+
+def get_jobs(folio, upload_definition_id):
+    """Hämta importjobben (ett per fil) för en upload definition"""
+    upload_definition = folio.get_data(
+        f"/data-import/uploadDefinitions/{upload_definition_id}", limit=0
+    )
+    return [
+        JobResult(
+            job_id=file_definition["jobExecutionId"],
+            file_name=file_definition.get("name", ""),
+        )
+        for file_definition in upload_definition.get("fileDefinitions", [])
+        if file_definition.get("jobExecutionId")
+    ]
+
+
+def parse_folio_date(value):
+    """Tolka datum från Folio, t.ex. 2024-01-01T12:00:00.000+00:00"""
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def update_job(folio, job):
+    """Uppdatera status för ett jobb, returnera True om jobbet är klart"""
+    job_execution = folio.get_data(
+        f"/change-manager/jobExecutions/{job.job_id}", limit=0
+    )
+    job.status = job_execution.get("status", "")
+    job.records = job_execution.get("progress", {}).get("total", 0)
+    if job.status not in FINISHED_STATUSES:
+        return False
+
+    started = parse_folio_date(job_execution.get("startedDate"))
+    completed = parse_folio_date(job_execution.get("completedDate"))
+    if started and completed:
+        job.duration = (completed - started).total_seconds()
+
+    try:
+        summary = folio.get_data(f"/metadata-provider/jobSummary/{job.job_id}", limit=0)
+        job.errors = summary.get("totalErrors", 0)
+    except (ItemNotFoundError, BadRequestError, RuntimeError):
+        # Sammanfattning saknas i äldre versioner av Folio
+        job.errors = 0 if job.status == SUCCESS_STATUS else 1
+    return True
+
+
+def wait_for_import(
+    folio, upload_definition_id, timeout=TIMEOUT, initial_delay=INITIAL_DELAY
+):
+    """Polla importjobben med exponentiell backoff tills alla är klara eller
+    tidsgränsen nåtts. Tillfälliga fel vid pollning, eller att Folio ännu inte
+    skapat några jobb, ger bara en ny pollning."""
+    start = time.monotonic()
+    report = ImportReport(upload_definition_id=upload_definition_id)
+    delay = initial_delay
+    pending = None
+
+    while True:
+        time.sleep(delay)
+        try:
+            if pending is None:
+                report.jobs = get_jobs(folio, upload_definition_id)
+                # Utan jobb har Folio ännu inte hunnit skapa dem
+                pending = list(report.jobs) or None
+            if pending is not None:
+                pending = [job for job in pending if not update_job(folio, job)]
+        except (
+            ConnectionError,
+            TimeoutError,
+            BadRequestError,
+            ItemNotFoundError,
+            RuntimeError,
+        ) as e:
+            logging.warning(
+                "Fel vid uppföljning av import %s: %s", upload_definition_id, e
+            )
+
+        report.elapsed = time.monotonic() - start
+        if pending == []:
+            return report
+        if report.elapsed + delay > timeout:
+            report.timed_out = True
+            return report
+        delay = min(delay * 2, MAX_DELAY)
+
+
+def count_running_jobs(folio):
+    """Antal importjobb som pågår i Folio. Deljobb för uppdelade filer räknas inte
+    för sig."""
+    job_executions = folio.get_data(
+        "/metadata-provider/jobExecutions",
+        params={
+            "statusAny": RUNNING_STATUSES,
+            "subordinationTypeNotAny": "COMPOSITE_CHILD",
+        },
+        limit=1,
+    )
+    return job_executions.get("totalRecords", 0)
+
+
+def wait_for_capacity(folio, max_running_jobs, poll_interval, timeout=TIMEOUT):
+    """Vänta så länge fler än max_running_jobs importjobb pågår i Folio (0 = vänta
+    inte). Efter timeout sekunder, eller om antalet inte går att hämta, fortsätter
+    vi ändå. Returnerar väntetiden i sekunder."""
+    if not max_running_jobs:
+        return 0.0
+    start = time.monotonic()
+    while True:
+        try:
+            running = count_running_jobs(folio)
+        except (
+            ConnectionError,
+            TimeoutError,
+            BadRequestError,
+            ItemNotFoundError,
+            RuntimeError,
+        ) as e:
+            logging.warning("Kunde inte hämta antal pågående importjobb: %s", e)
+            return time.monotonic() - start
+
+        waited = time.monotonic() - start
+        if running <= max_running_jobs:
+            return waited
+        if waited + poll_interval > timeout:
+            logging.warning(
+                "%s importjobb pågår fortfarande i Folio efter %.0f s, "
+                "initierar importen ändå",
+                running,
+                waited,
+            )
+            return waited
+        logging.info(
+            "%s importjobb pågår i Folio (max %s), väntar %s s",
+            running,
+            max_running_jobs,
+            poll_interval,
+        )
+        time.sleep(poll_interval)
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+"""
+Hantering av MARC-poster (ISO2709) direkt på bytenivå.
+
+Används som snabbväg i stället för pymarc när poster bara ska delas upp, läsas
+för fält 001 och transformeras enligt reglerna i marc_rules. Endast poster som
+pymarc skulle skriva ut oförändrade hanteras (UTF-8, kanonisk katalog, giltiga
+indikatorer och delfält); övriga ger UnsupportedRecordError och ska tolkas med
+pymarc i stället. Det gör att resultatet blir byte-identiskt med pymarc.
+"""
+
+import re
+from itertools import accumulate
+
+LEADER_LEN = 24
+DIRECTORY_ENTRY_LEN = 12
+SUBFIELD_INDICATOR = 0x1F
+END_OF_FIELD = 0x1E
+END_OF_RECORD = 0x1D
+_END_OF_RECORD_BYTE = bytes([END_OF_RECORD])
+READ_BLOCK_SIZE = 1024 * 1024
+
+# Kontrollfält enligt samma regel som pymarc (numeriska taggar under 010)
+_CONTROL_TAGS = frozenset(f"{tag:03d}" for tag in range(10))
+_DIRECTORY = re.compile(rb"(?:[\x20-\x7e]{3}[0-9]{9})+")
+_INDICATORS = re.compile(rb"[\x00-\x1e\x20-\x7f]{2}(?:\x1f|\Z)")
+# Tomma delfält eller delfältskoder utanför ASCII normaliseras av pymarc
+_NON_CANONICAL_SUBFIELD = re.compile(rb"\x1f[\x1e\x1f\x80-\xff]")
+
+
+class UnsupportedRecordError(ValueError):
+    """Posten kan inte hanteras på bytenivå och måste tolkas med pymarc"""
+
+
+def scan_records(buffer, offset=0, tolerant=False):
+    """Gå igenom poster (ISO2709) i en buffert utifrån postlängden i leadern och ge
+    (position, längd, orsak) för varje post, där orsak är None för hela poster.
+    Slutar vid en ofullständig post i slutet av bufferten.
+
+    Utan tolerant lyfts RuntimeError vid en ogiltig postlängd. Med tolerant
+    kontrolleras även att posten slutar med postavslut, och vid fel ges i stället
+    data fram till nästa postavslut med orsaken och genomgången fortsätter med
+    posten därefter."""
+    size = len(buffer)
+    while size - offset >= 5:
+        try:
+            length = int(buffer[offset : offset + 5])
+        except ValueError:
+            length = 0
+        if length <= 5:
+            if not tolerant:
+                raise RuntimeError("Ogiltig postlängd i MARC-data")
+            reason = "ogiltig postlängd"
+        elif size - offset < length:
+            return
+        elif not tolerant or buffer[offset + length - 1] == END_OF_RECORD:
+            yield offset, length, None
+            offset += length
+            continue
+        else:
+            reason = "postavslut saknas"
+        # Synkronisera om vid nästa postavslut
+        end = buffer.find(_END_OF_RECORD_BYTE, offset)
+        if end == -1:
+            return
+        yield offset, end + 1 - offset, reason
+        offset = end + 1
+
+
+def split_raw_records(blocks, on_invalid=None):
+    """Dela upp en ström av bytes i hela MARC-poster (ISO2709) utifrån postlängden
+    i leadern. Ofullständiga poster sparas tills resten av posten kommit.
+
+    Utan on_invalid avbryts uppdelningen med RuntimeError vid en ogiltig postlängd.
+    Med on_invalid kontrolleras även att posten slutar med postavslut. Vid fel
+    skickas i stället data fram till nästa postavslut till on_invalid(data, orsak)
+    och uppdelningen fortsätter med posten därefter (se scan_records)."""
+    buffer = bytearray()
+    for block in blocks:
+        buffer += block
+        end = 0
+        for offset, length, reason in scan_records(buffer, 0, on_invalid is not None):
+            end = offset + length
+            if reason is None:
+                yield bytes(buffer[offset:end])
+            else:
+                on_invalid(bytes(buffer[offset:end]), reason)
+        del buffer[:end]
+
+    if buffer:
+        if on_invalid is None:
+            raise RuntimeError("MARC-data avslutas med en ofullständig post")
+        on_invalid(bytes(buffer), "ofullständig post")
+
+
+def read_raw_records(file_path, on_invalid=None):
+    """Läs råa MARC-poster från fil (se split_raw_records för on_invalid)"""
+    with open(file_path, "rb") as fh:
+        yield from split_raw_records(
+            iter(lambda: fh.read(READ_BLOCK_SIZE), b""), on_invalid
+        )
+
+
+def check_record(raw):
+    """Snabb kontroll av att en post går att tolka: postlängd, postavslut, katalog
+    inom posten, giltig UTF-8 (för UTF-8-poster) och ett fält 001 med värde.
+    Returnerar orsaken om posten är ogiltig, annars None."""
+    record_length = len(raw)
+    if record_length <= LEADER_LEN or raw[:5] != b"%05d" % record_length:
+        return "postlängden stämmer inte"
+    if raw[-1] != END_OF_RECORD:
+        return "postavslut saknas"
+    try:
+        base_address = int(raw[12:17])
+    except ValueError:
+        return "ogiltig basadress"
+    directory_end = base_address - 1
+    if (
+        directory_end <= LEADER_LEN
+        or base_address >= record_length
+        or raw[directory_end] != END_OF_FIELD
+        or (directory_end - LEADER_LEN) % DIRECTORY_ENTRY_LEN
+    ):
+        return "ogiltig katalog"
+    if raw[9:10] == b"a":
+        try:
+            raw.decode("utf-8")
+        except UnicodeDecodeError:
+            return "ogiltig UTF-8"
+
+    has_001 = False
+    data_length = record_length - base_address
+    for entry in range(LEADER_LEN, directory_end, DIRECTORY_ENTRY_LEN):
+        try:
+            length = int(raw[entry + 3 : entry + 7])
+            offset = int(raw[entry + 7 : entry + 12])
+        except ValueError:
+            return "ogiltig katalog"
+        if offset + length > data_length:
+            return "fält utanför posten"
+        if raw[entry : entry + 3] == b"001" and length > 1:
+            has_001 = True
+    if not has_001:
+        return "fält 001 saknas"
+    return None
+
+
+class RawRecord:
+    """En MARC-post som lista av (tagg, fältdata) där fältdata saknar fältavslut"""
+
+    __slots__ = ("raw", "leader", "fields", "modified")
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.modified = False
+        self.leader, self.fields = parse_record(raw)
+
+    def get_control_field(self, tag):
+        """Returnera värdet i första förekomsten av ett kontrollfält"""
+        for field_tag, data in self.fields:
+            if field_tag == tag:
+                return data.decode("utf-8")
+        raise KeyError(tag)
+
+    def as_marc(self):
+        """Serialisera posten till ISO2709"""
+        if not self.modified:
+            return self.raw
+        return build_record(self.leader, self.fields)
+
+
+def parse_record(raw):
+    """Tolka leader och katalog för en rå MARC-post.
+    Returnerar leader och lista av (tagg, fältdata utan fältavslut)."""
+    record_length = len(raw)
+    if record_length <= LEADER_LEN or raw[-1] != END_OF_RECORD:
+        raise UnsupportedRecordError("Ogiltig post")
+    if raw[9:10] != b"a":
+        raise UnsupportedRecordError("Posten är inte UTF-8-kodad")
+
+    try:
+        base_address = int(raw[12:17])
+        raw.decode("utf-8")
+    except (ValueError, UnicodeDecodeError) as e:
+        raise UnsupportedRecordError("Ogiltig leader eller kodning") from e
+
+    directory_end = base_address - 1
+    if (
+        directory_end <= LEADER_LEN
+        or base_address >= record_length
+        or raw[directory_end] != END_OF_FIELD
+        or not raw[:LEADER_LEN].isascii()
+        or not _DIRECTORY.fullmatch(raw, LEADER_LEN, directory_end)
+    ):
+        raise UnsupportedRecordError("Ogiltig katalog")
+
+    directory = raw[LEADER_LEN:directory_end].decode("ascii")
+    entries = range(0, len(directory), DIRECTORY_ENTRY_LEN)
+    tags = [directory[i : i + 3] for i in entries]
+    lengths = [int(directory[i + 3 : i + 7]) for i in entries]
+    offsets = [int(directory[i + 7 : i + 12]) for i in entries]
+
+    # pymarc packar om fälten i katalogordning och lägger till fältavslut, så
+    # fälten måste redan ligga tätt i katalogordning med exakt ett fältavslut var
+    field_data = raw[base_address:-1].split(b"\x1e")
+    if (
+        field_data.pop()
+        or [len(data) + 1 for data in field_data] != lengths
+        or offsets != list(accumulate(lengths[:-1], initial=0))
+    ):
+        raise UnsupportedRecordError("Fälten stämmer inte med katalogen")
+
+    # pymarc normaliserar saknade eller extra indikatorer
+    for tag, data in zip(tags, field_data):
+        if tag not in _CONTROL_TAGS and not _INDICATORS.match(data):
+            raise UnsupportedRecordError("Ogiltiga indikatorer")
+    if _NON_CANONICAL_SUBFIELD.search(raw, base_address):
+        raise UnsupportedRecordError("Tomma delfält eller ogiltig delfältskod")
+
+    return raw[:LEADER_LEN], list(zip(tags, field_data))
+
+
+def build_record(leader, fields):
+    """Bygg en rå MARC-post från leader och lista av (tagg, fältdata)"""
+    entries = []
+    offset = 0
+    for tag, data in fields:
+        length = len(data) + 1
+        entries.append(f"{tag}{length:04d}{offset:05d}")
+        offset += length
+    directory = "".join(entries).encode("ascii") + b"\x1e"
+    data = b"\x1e".join([data for _, data in fields]) + b"\x1e\x1d"
+
+    base_address = LEADER_LEN + len(directory)
+    record_length = base_address + len(data)
+    return (
+        f"{record_length:05d}".encode("ascii")
+        + leader[5:12]
+        + f"{base_address:05d}".encode("ascii")
+        + leader[17:]
+        + directory
+        + data
+    )
@@ -4,22 +4,254 @@
 Skript för att exportera data från Libris och importera till Folio
 """
 
+import argparse
 import datetime
 import logging
+import multiprocessing
 import os
+import queue
+import sqlite3
 import sys
+import tempfile
+import threading
+import time
 import urllib.parse
-from datetime import datetime, timezone
+from collections import deque
+from contextlib import nullcontext
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from itertools import chain, islice
 from pathlib import Path
 
 from httpx import Client, ConnectError, HTTPStatusError, TimeoutException
-from pyfolioclient import BadRequestError, FolioClient, ItemNotFoundError
-from pymarc import MARCReader, MARCWriter
+from pyfolioclient import BadRequestError, ItemNotFoundError
+from pymarc import MARCReader, MARCWriter, Record
+
+from libris_import import export_archive, import_monitor, iso2709, marc_rules
+from libris_import.change_index import ChangeIndex
+from libris_import.checkpoint import Checkpoint
+from libris_import.chunk_upload import ChunkUploader
+from libris_import.dedup_index import LastOccurrenceIndex
+from libris_import.quarantine import Quarantine
+from utils import metrics, utils
+
+LIBRIS_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+CURRENT_UTC_TIMESTAMP = datetime.now(timezone.utc).strftime(LIBRIS_TIMESTAMP_FORMAT)
+CHUNK_SIZE = 200
+CHUNK_MAX_BYTES = 0
+# En enda chunk (single_file) som laddas upp direkt hålls i minnet upp till så här
+# många bytes, större skrivs till en temporär fil
+SINGLE_CHUNK_SPOOL_BYTES = 64 * 1024 * 1024
+
+# Strömmande nedladdning: exporten skrivs till fil block för block och poster
+# delas upp medan överföringen pågår, i stället för att hela svaret hålls i minnet
+STREAM_LIBRIS_EXPORT = True
+STREAM_BLOCK_SIZE = 64 * 1024
+STREAM_QUEUE_SIZE = 64
+
+# Dela upp och transformera poster direkt på bytenivå när det går (se iso2709.py),
+# poster som inte kan hanteras där tolkas med pymarc som tidigare
+RAW_MARC_FAST_PATH = True
+
+# Kompilerade regler för custom_transform (se get_transform_rules)
+_TRANSFORM_RULES = None
+
+# Transformation i flera processer: antal arbetsprocesser (1 = seriellt), poster
+# per batch och minsta antal poster för att det ska löna sig att starta processer
+TRANSFORM_WORKERS = os.cpu_count() or 1
+TRANSFORM_BATCH_SIZE = 1000
+PARALLEL_MIN_RECORDS = 20000
+# Arbetsprocesserna startas inte med fork: huvudprocessen har då trådar igång
+# (nedladdning från Libris, uppladdning av chunks) och en fork kan ärva lås som
+# hålls av dem. Reglerna skickas med till processerna (init_transform_worker).
+TRANSFORM_START_METHOD = (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+# Hoppa över poster som är oförändrade sedan senaste lyckade import
+CHANGE_INDEX_ENABLED = True
+CHANGE_INDEX_FILENAME = "changeIndex.sqlite"
+
+# Följ importjobben i Folio tills de är klara, körningen räknas som misslyckad om
+# något jobb får fel
+MONITOR_IMPORT = True
+
+# Långa tidsfönster (t.ex. efter driftstopp) delas upp i delfönster om
+# LIBRIS_WINDOW_HOURS timmar (0 = ingen uppdelning) som hämtas parallellt och
+# försöks igen var för sig vid fel. Ett fönster delas först när det är minst 1,5
+# gånger så långt, så att en vanlig nattlig körning hämtas i ett anrop.
+LIBRIS_WINDOW_HOURS = 24
+LIBRIS_FETCH_CONCURRENCY = 3
+LIBRIS_FETCH_RETRIES = 3
+LIBRIS_RETRY_DELAY = 10
+
+# Spara export, chunks och ett manifest (resume.json) om en körning misslyckas, så
+# att nästa körning kan fortsätta där den avbröts i stället för att hämta från Libris
+RESUMABLE_RUNS = True
+CHECKPOINT_FILENAME = "resume.json"
+
+# Lägg poster som inte går att läsa i en karantänfil i mappen QUARANTINE_FOLDER i
+# LIBRIS_BASE_FOLDER och fortsätt med övriga poster, i stället för att avbryta
+QUARANTINE_INVALID_RECORDS = True
+QUARANTINE_FOLDER = "quarantine"
+
+# Antal chunks som laddas upp till Folio samtidigt (1 = en i taget), kan ändras med
+# upload_concurrency i config.json
+UPLOAD_CONCURRENCY = 4
+
+# Ladda upp chunks direkt från minnet medan posterna delas upp (se chunk_upload.py)
+# i stället för att skriva dem till fil först. Med RESUMABLE_RUNS (standard) skrivs
+# de ändå även till fil så att en misslyckad körning kan återupptas - då sparas
+# bara läsningen av filerna. Stäng av RESUMABLE_RUNS för att hålla chunks i minnet.
+DIRECT_UPLOAD = True
+
+# Stora körningar importeras i flera upload definitions om högst IMPORT_MAX_CHUNKS
+# chunks (0 = alla i en). Nästa import initieras först när högst
+# IMPORT_MAX_RUNNING_JOBS importjobb pågår i Folio (0 = vänta inte); antalet
+# kontrolleras var IMPORT_POLL_INTERVAL sekund i högst IMPORT_MAX_WAIT sekunder.
+IMPORT_MAX_CHUNKS = 50
+IMPORT_MAX_RUNNING_JOBS = 50
+IMPORT_POLL_INTERVAL = 30
+IMPORT_MAX_WAIT = 2 * 60 * 60
+
+# Spara exporten komprimerad med ett index över posternas position efter en lyckad
+# import (se export_archive.py), de senaste ARCHIVE_KEEP exporterna sparas. Indexet
+# byggs när exporten hämtats.
+ARCHIVE_EXPORTS = True
+ARCHIVE_FOLDER = "archive"
+ARCHIVE_KEEP = 14
+ARCHIVE_COMPRESSION = "gzip"
+
+
+class LibrisFetchError(RuntimeError):
+    """Fel vid hämtning från Libris under strömmande bearbetning (skiljs från fel
+    vid transformation och uppdelning av posterna)"""
+
+
+@dataclass
+class ChunkSettings:
+    """Inställningar för uppdelning i chunks (avsnittet "libris_import" i config.json)
+
+    chunk_size: max antal poster per chunk (0 = obegränsat)
+    chunk_max_bytes: max storlek per chunk i bytes (0 = obegränsat)
+    single_file: skicka en enda stor fil per körning utan uppdelning
+    """
 
-from utils import utils
+    chunk_size: int = CHUNK_SIZE
+    chunk_max_bytes: int = CHUNK_MAX_BYTES
+    single_file: bool = False
+
+    def limits(self):
+        """Max antal poster och bytes per chunk (0 = obegränsat)"""
+        if self.single_file:
+            return 0, 0
+        return self.chunk_size, self.chunk_max_bytes
+
+
+def load_chunk_settings():
+    """Läs inställningar för uppdelning i chunks från config.json (om den finns)"""
+    config = utils.load_config_section("libris_import")
+    return ChunkSettings(
+        chunk_size=int(config.get("chunk_size", CHUNK_SIZE)),
+        chunk_max_bytes=int(config.get("chunk_max_bytes", CHUNK_MAX_BYTES)),
+        single_file=bool(config.get("single_file", False)),
+    )
+
+
+@dataclass
+class HarvestSettings:
+    """Inställningar för hämtning från Libris (avsnittet "libris_import" i config.json)
+
+    window_hours: max längd på delfönster i timmar (0 = ingen uppdelning)
+    concurrency: antal delfönster som hämtas samtidigt
+    retries: antal nya försök per delfönster vid fel
+    """
+
+    window_hours: float = LIBRIS_WINDOW_HOURS
+    concurrency: int = LIBRIS_FETCH_CONCURRENCY
+    retries: int = LIBRIS_FETCH_RETRIES
+
+
+def load_harvest_settings():
+    """Läs inställningar för hämtning från Libris från config.json (om den finns)"""
+    config = utils.load_config_section("libris_import")
+    return HarvestSettings(
+        window_hours=float(config.get("window_hours", LIBRIS_WINDOW_HOURS)),
+        concurrency=max(
+            1, int(config.get("fetch_concurrency", LIBRIS_FETCH_CONCURRENCY))
+        ),
+        retries=max(0, int(config.get("fetch_retries", LIBRIS_FETCH_RETRIES))),
+    )
 
-CURRENT_UTC_TIMESTAMP = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-CHUNK_SIZE = 200
+
+@dataclass
+class ArchiveSettings:
+    """Inställningar för arkivet med exporter (avsnittet "libris_import" i config.json)
+
+    enabled: arkivera exporten efter en lyckad import
+    folder: mapp för arkivet (relativ till LIBRIS_BASE_FOLDER)
+    keep: antal exporter som sparas
+    compression: "gzip" eller "zstd" (kräver paketet zstandard)
+    """
+
+    enabled: bool = ARCHIVE_EXPORTS
+    folder: str = ARCHIVE_FOLDER
+    keep: int = ARCHIVE_KEEP
+    compression: str = ARCHIVE_COMPRESSION
+
+
+def load_archive_settings():
+    """Läs inställningar för arkivet med exporter från config.json (om den finns)"""
+    config = utils.load_config_section("libris_import")
+    compression = config.get("archive_compression", ARCHIVE_COMPRESSION)
+    if compression not in export_archive.COMPRESSED_SUFFIXES:
+        raise ValueError(f"Okänd komprimering för arkivet: {compression}")
+    return ArchiveSettings(
+        enabled=bool(config.get("archive_exports", ARCHIVE_EXPORTS)),
+        folder=config.get("archive_folder", ARCHIVE_FOLDER),
+        keep=max(1, int(config.get("archive_keep", ARCHIVE_KEEP))),
+        compression=compression,
+    )
+
+
+@dataclass
+class SubmissionSettings:
+    """Inställningar för import till Folio (avsnittet "libris_import" i config.json)
+
+    chunks_per_import: max antal chunks per upload definition (0 = alla i en)
+    upload_concurrency: antal chunks som laddas upp samtidigt
+    max_running_jobs: initiera inte nästa import så länge fler importjobb pågår i
+        Folio (0 = vänta inte)
+    poll_interval: sekunder mellan kontrollerna av antalet pågående jobb
+    max_wait: initiera importen ändå efter så här många sekunder
+    """
+
+    chunks_per_import: int = IMPORT_MAX_CHUNKS
+    upload_concurrency: int = UPLOAD_CONCURRENCY
+    max_running_jobs: int = IMPORT_MAX_RUNNING_JOBS
+    poll_interval: float = IMPORT_POLL_INTERVAL
+    max_wait: float = IMPORT_MAX_WAIT
+
+
+def load_submission_settings():
+    """Läs inställningar för import till Folio från config.json (om den finns)"""
+    config = utils.load_config_section("libris_import")
+    return SubmissionSettings(
+        chunks_per_import=max(
+            0, int(config.get("chunks_per_import", IMPORT_MAX_CHUNKS))
+        ),
+        upload_concurrency=max(
+            1, int(config.get("upload_concurrency", UPLOAD_CONCURRENCY))
+        ),
+        max_running_jobs=max(
+            0, int(config.get("max_running_jobs", IMPORT_MAX_RUNNING_JOBS))
+        ),
+        poll_interval=max(
+            1.0, float(config.get("import_poll_interval", IMPORT_POLL_INTERVAL))
+        ),
+        max_wait=max(0.0, float(config.get("import_max_wait", IMPORT_MAX_WAIT))),
+    )
 
 
 def get_last_run_timestamp(last_run_timestamp_path):
@@ -32,30 +264,90 @@ def get_last_run_timestamp(last_run_timestamp_path):
         return f.read().strip()
 
 
-def update_last_run_timestamp(last_run_timestamp_path):
-    """Uppdatera tidsstämpeln för senaste körning till tidsstämpel när skripetet startades"""
+def update_last_run_timestamp(last_run_timestamp_path, timestamp=None):
+    """Uppdatera tidsstämpeln för senaste körning till tidsstämpel när skripetet startades
+    (eller slutet på tidsfönstret för en återupptagen körning)"""
     with open(last_run_timestamp_path, "w", encoding="utf-8") as f:
-        f.write(CURRENT_UTC_TIMESTAMP)
+        f.write(timestamp or CURRENT_UTC_TIMESTAMP)
 
 
-def get_libris_data(last_run_timestamp, libris_export_properties_path):
-    """Hämta MARC-data från Libris"""
+def build_libris_url(last_run_timestamp, until_timestamp=None):
+    """Bygg URL för export från Libris för perioden från senaste körning"""
     libris_api_url = os.getenv("LIBRIS_API_URL")
-    libris_client = Client()
     params = {
         "from": last_run_timestamp,
-        "until": CURRENT_UTC_TIMESTAMP,
+        "until": until_timestamp or CURRENT_UTC_TIMESTAMP,
         "deleted": "ignore",
         "virtualDelete": "false",
     }
 
     # Eftersom inte Libris klarar att ":"" URL-kodas behvövs denna lösning
-    url = f"{libris_api_url}/?{urllib.parse.urlencode(params, safe=':')}"
+    return f"{libris_api_url}/?{urllib.parse.urlencode(params, safe=':')}"
+
+
+def split_libris_window(from_timestamp, until_timestamp, window_hours):
+    """Dela upp tidsfönstret i delfönster om window_hours timmar i tidsordning. En
+    kort rest läggs till det sista delfönstret, så inget delfönster är längre än
+    1,5 gånger window_hours och ett fönster som är lite längre än window_hours
+    delas inte. Delfönstren möts i samma sekund, så en post som ändrats precis då
+    kan komma med två gånger - dubletter tas ändå bort vid uppdelningen i chunks."""
+    try:
+        start = datetime.strptime(from_timestamp, LIBRIS_TIMESTAMP_FORMAT)
+        end = datetime.strptime(until_timestamp, LIBRIS_TIMESTAMP_FORMAT)
+    except ValueError:
+        return [(from_timestamp, until_timestamp)]
+    if window_hours <= 0:
+        return [(from_timestamp, until_timestamp)]
+
+    step = timedelta(hours=window_hours)
+    windows = []
+    while start + step * 1.5 < end:
+        windows.append(
+            (
+                start.strftime(LIBRIS_TIMESTAMP_FORMAT),
+                (start + step).strftime(LIBRIS_TIMESTAMP_FORMAT),
+            )
+        )
+        start += step
+    windows.append((start.strftime(LIBRIS_TIMESTAMP_FORMAT), until_timestamp))
+    return windows
+
+
+def get_libris_windows(last_run_timestamp, harvest_settings):
+    """Delfönster för perioden från senaste körning fram till nu"""
+    return split_libris_window(
+        last_run_timestamp, CURRENT_UTC_TIMESTAMP, harvest_settings.window_hours
+    )
+
+
+def get_libris_data(
+    last_run_timestamp, libris_export_properties_path, harvest_settings=None
+):
+    """Hämta MARC-data från Libris (långa tidsfönster som delfönster)"""
+    harvest_settings = harvest_settings or HarvestSettings()
+    windows = get_libris_windows(last_run_timestamp, harvest_settings)
+    if len(windows) > 1:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            return b"".join(
+                Path(part_path).read_bytes()
+                for part_path in fetch_libris_windows(
+                    windows,
+                    libris_export_properties_path,
+                    os.path.join(temp_dir, "export.mrc"),
+                    harvest_settings,
+                )
+            )
+
+    libris_client = Client()
+    url = build_libris_url(last_run_timestamp)
     logging.info("Hämtar data från Libris: %s", url)
     try:
-        with open(libris_export_properties_path, "rb") as prop_file:
+        with open(libris_export_properties_path, "rb") as prop_file, metrics.span(
+            "libris_download"
+        ):
             response = libris_client.post(url, data=prop_file, timeout=60 * 60)  # type: ignore
             response.raise_for_status()
+            metrics.increment("libris_bytes_downloaded", len(response.content))
             return response.content
     except ConnectError as connection_err:
         raise ConnectionError("Kan inte ansluta till Libris") from connection_err
@@ -67,10 +359,195 @@ def get_libris_data(last_run_timestamp, libris_export_properties_path):
         libris_client.close()
 
 
+def download_libris_data(
+    last_run_timestamp,
+    libris_export_properties_path,
+    export_path,
+    on_block=None,
+    until_timestamp=None,
+):
+    """Ladda ned MARC-data från Libris block för block till fil.
+    Varje block skickas även till on_block (om angiven) så fort det skrivits."""
+    libris_client = Client()
+    url = build_libris_url(last_run_timestamp, until_timestamp)
+    logging.info("Hämtar data från Libris (strömmande): %s", url)
+    try:
+        with open(libris_export_properties_path, "rb") as prop_file, open(
+            export_path, "wb"
+        ) as export_file, metrics.span("libris_download"):
+            start = time.perf_counter()
+            with libris_client.stream(
+                "POST", url, data=prop_file, timeout=60 * 60  # type: ignore
+            ) as response:
+                # Tid tills Libris börjar svara (exporten sammanställs)
+                metrics.observe("libris_wait_seconds", time.perf_counter() - start)
+                response.raise_for_status()
+                for block in response.iter_bytes(STREAM_BLOCK_SIZE):
+                    export_file.write(block)
+                    metrics.increment("libris_bytes_downloaded", len(block))
+                    if on_block:
+                        on_block(block)
+    except ConnectError as connection_err:
+        raise ConnectionError("Kan inte ansluta till Libris") from connection_err
+    except TimeoutException as timeout_err:
+        raise TimeoutError("Timeout mot Libris") from timeout_err
+    except HTTPStatusError as http_err:
+        raise RuntimeError(f"HTTP fel från Libris: {http_err}") from http_err
+    finally:
+        libris_client.close()
+
+
+def fetch_libris_window(window, libris_export_properties_path, part_path, retries):
+    """Ladda ned ett delfönster från Libris till fil, med nya försök vid fel"""
+    from_timestamp, until_timestamp = window
+    for attempt in range(retries + 1):
+        try:
+            download_libris_data(
+                from_timestamp,
+                libris_export_properties_path,
+                part_path,
+                until_timestamp=until_timestamp,
+            )
+            return part_path
+        except (ConnectionError, TimeoutError, RuntimeError) as e:
+            if attempt == retries:
+                raise
+            metrics.increment("libris_retries")
+            delay = LIBRIS_RETRY_DELAY * 2**attempt
+            logging.warning(
+                "Fel vid hämtning av %s - %s från Libris: %s (nytt försök om %s s)",
+                from_timestamp,
+                until_timestamp,
+                e,
+                delay,
+            )
+            time.sleep(delay)
+    return part_path
+
+
+def fetch_libris_windows(
+    windows, libris_export_properties_path, export_path, harvest_settings
+):
+    """Hämta delfönster parallellt till var sin fil (export_path med löpnummer).
+    Ger filerna i tidsordning så fort de och alla tidigare delfönster är klara.
+    Misslyckas ett delfönster efter alla försök avbryts återstående hämtningar."""
+    stem = os.path.splitext(export_path)[0]
+    logging.info(
+        "Hämtar %s delfönster från Libris (%s - %s)",
+        len(windows),
+        windows[0][0],
+        windows[-1][1],
+    )
+    with ThreadPoolExecutor(max_workers=harvest_settings.concurrency) as executor:
+        futures = [
+            executor.submit(
+                fetch_libris_window,
+                window,
+                libris_export_properties_path,
+                f"{stem}.part{number:03d}.mrc",
+                harvest_settings.retries,
+            )
+            for number, window in enumerate(windows)
+        ]
+        try:
+            for future in futures:
+                try:
+                    part_path = future.result()
+                except (ConnectionError, TimeoutError, RuntimeError) as e:
+                    raise LibrisFetchError(str(e)) from e
+                yield part_path
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def stream_libris_windows(
+    windows, libris_export_properties_path, export_path, harvest_settings
+):
+    """Strömma delfönster från Libris i tidsordning - varje delfönster läggs till
+    exportfilen och ges block för block när det hämtats klart"""
+    with open(export_path, "wb") as export_file:
+        for part_path in fetch_libris_windows(
+            windows, libris_export_properties_path, export_path, harvest_settings
+        ):
+            with open(part_path, "rb") as part_file:
+                for block in iter(lambda: part_file.read(STREAM_BLOCK_SIZE), b""):
+                    export_file.write(block)
+                    yield block
+            os.remove(part_path)
+
+
+def stream_libris_data(
+    last_run_timestamp,
+    libris_export_properties_path,
+    export_path,
+    harvest_settings=None,
+):
+    """Strömma MARC-data från Libris - ger block av bytes medan nedladdningen pågår.
+    Nedladdningen körs i en egen tråd och kön är begränsad, så minnesanvändningen
+    är densamma oavsett hur stor exporten är. Långa tidsfönster hämtas som delfönster.
+    """
+    harvest_settings = harvest_settings or HarvestSettings()
+    windows = get_libris_windows(last_run_timestamp, harvest_settings)
+    if len(windows) > 1:
+        yield from stream_libris_windows(
+            windows, libris_export_properties_path, export_path, harvest_settings
+        )
+        return
+
+    blocks = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    stopped = threading.Event()
+
+    def put_block(block):
+        while not stopped.is_set():
+            try:
+                blocks.put(block, timeout=1)
+                return
+            except queue.Full:
+                continue
+        raise InterruptedError("Nedladdningen avbröts")
+
+    def download():
+        try:
+            download_libris_data(
+                last_run_timestamp,
+                libris_export_properties_path,
+                export_path,
+                put_block,
+            )
+            put_block(None)
+        except InterruptedError:
+            pass
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # Felet lyfts i konsumentens tråd
+            try:
+                put_block(e)
+            except InterruptedError:
+                pass
+
+    downloader = threading.Thread(target=download, daemon=True)
+    downloader.start()
+    try:
+        while True:
+            block = blocks.get()
+            if block is None:
+                return
+            if isinstance(block, Exception):
+                raise LibrisFetchError(str(block)) from block
+            yield block
+    finally:
+        stopped.set()
+        downloader.join()
+
+
+def get_export_path(libris_base_folder):
+    """Sökväg till fil för nedladdad MARC-data"""
+    return os.path.join(libris_base_folder, f"export_{CURRENT_UTC_TIMESTAMP}.mrc")
+
+
 def save_marc(data, libris_base_folder):
     """Spara MARC-data till fil"""
-    filename = os.path.join(libris_base_folder, f"export_{CURRENT_UTC_TIMESTAMP}.mrc")
-    with open(filename, "wb") as f:
+    with open(get_export_path(libris_base_folder), "wb") as f:
         f.write(data)
 
 
@@ -84,96 +561,739 @@ def get_mrc_files(input_dir):
     return list(input_dir.glob("*.mrc"))
 
 
+def get_mrc_files_by_timestamp(input_dir):
+    """Lista MARC-filer i en mapp sorterade från äldst till nyast. Tidsstämpeln i
+    filnamnet (export_<tidsstämpel>.mrc) används om den finns, annars filens mtime."""
+
+    def file_timestamp(file_path):
+        try:
+            return datetime.strptime(
+                file_path.stem.removeprefix("export_"), "%Y-%m-%dT%H:%M:%SZ"
+            ).timestamp()
+        except ValueError:
+            return file_path.stat().st_mtime
+
+    return sorted(get_mrc_files(input_dir), key=lambda f: (file_timestamp(f), f.name))
+
+
 def read_marc_records(file_path):
     """Läs MARC-poster från fil"""
     with open(file_path, "rb") as fh:
         yield from MARCReader(fh)
 
 
+def parse_marc_record(raw_record):
+    """Tolka en rå MARC-post - på bytenivå om möjligt, annars med pymarc"""
+    if RAW_MARC_FAST_PATH:
+        try:
+            return iso2709.RawRecord(raw_record)
+        except iso2709.UnsupportedRecordError:
+            pass
+    return Record(raw_record)
+
+
 def write_marc_chunk(records, output_path):
     """Skriv MARC-poster till fil"""
     with open(output_path, "wb") as fh:
         writer = MARCWriter(fh)
         for record in records:
-            writer.write(record)
+            if isinstance(record, bytes):
+                fh.write(record)
+            elif isinstance(record, iso2709.RawRecord):
+                fh.write(record.as_marc())
+            else:
+                writer.write(record)
         writer.close()
 
 
+def chunk_file_name(chunk_index):
+    """Filnamn för en chunk"""
+    return f"export_{CURRENT_UTC_TIMESTAMP}_{chunk_index:03}.mrc"
+
+
 def write_chunk(records, output_dir, chunk_index):
     """Skriv chunk till fil"""
-    output_file = output_dir / f"export_{CURRENT_UTC_TIMESTAMP}_{chunk_index:03}.mrc"
-    write_marc_chunk(records, output_file)
+    output_file = output_dir / chunk_file_name(chunk_index)
+    with metrics.span("write_chunk"):
+        write_marc_chunk(records, output_file)
+    metrics.increment("chunks_written")
+    metrics.increment("records_written", len(records))
     logging.info("Skrev %s poster till %s", len(records), output_file)
 
 
 def get_libris_id(record):
     """Hämta Libris-ID från MARC-poster"""
+    if isinstance(record, iso2709.RawRecord):
+        return record.get_control_field("001")
     return record["001"].value()
 
 
-def custom_transform(record):
-    """Anpassad transformation av MARC-poster"""
+def load_transform_rules():
+    """Läs och kompilera reglerna för custom_transform från config.json (avsnittet
+    "marc_transform"). Utan regler i config.json används marc_rules.DEFAULT_RULES
+    (ta bort fält 035 och delfält 9 i fält 830)."""
+    config = utils.load_config_section("marc_transform")
+    return marc_rules.TransformRules(config.get("rules", marc_rules.DEFAULT_RULES))
 
-    # Ta bort hela fält 035
-    record.remove_fields("035")
 
-    # Ta bort delfält 9 i fält 830
-    rec_830s = record.get_fields("830")
-    for rec_830 in rec_830s:
-        for _ in rec_830.get_subfields("9"):
-            rec_830.delete_subfield("9")
+def get_transform_rules():
+    """Reglerna för custom_transform - kompileras första gången de används"""
+    global _TRANSFORM_RULES  # pylint: disable=global-statement
+    if _TRANSFORM_RULES is None:
+        _TRANSFORM_RULES = load_transform_rules()
+    return _TRANSFORM_RULES
 
-    return record
+
+def custom_transform(record):
+    """Anpassad transformation av MARC-poster enligt reglerna i config.json"""
+    return get_transform_rules().apply(record)
+
+
+def process_mrc_files(
+    input_dir,
+    output_dir,
+    chunk_size,
+    workers=TRANSFORM_WORKERS,
+    change_index=None,
+    chunk_max_bytes=0,
+    quarantine=None,
+    uploader=None,
+):
+    """Bearbeta MARC-filer - dela upp dem i mindre delar. Med quarantine läggs
+    poster som inte går att läsa i karantän i stället för att avbryta. Med
+    uploader laddas delarna upp till Folio i stället för att skrivas till fil."""
+    read_raw_records = (
+        quarantine.read_raw_records if quarantine else iso2709.read_raw_records
+    )
+    raw_records = (
+        raw_record
+        for mrc_file in get_mrc_files(input_dir)
+        for raw_record in read_raw_records(mrc_file)
+    )
+    return process_raw_records(
+        raw_records,
+        output_dir,
+        chunk_size,
+        workers,
+        change_index,
+        chunk_max_bytes=chunk_max_bytes,
+        uploader=uploader,
+    )
 
 
-def process_mrc_files(input_dir, output_dir, chunk_size):
-    """Bearbeta MARC-filer - dela upp dem i mindre delar"""
+def process_mrc_files_backfill(
+    input_dir,
+    output_dir,
+    chunk_size,
+    workers=TRANSFORM_WORKERS,
+    change_index=None,
+    chunk_max_bytes=0,
+    quarantine=None,
+    uploader=None,
+):
+    """Bearbeta MARC-filer för återladdning av hela beståndet. Dubletter tas bort med
+    ett index på disk så att minnet inte växer med antalet poster, och den senaste
+    förekomsten (enligt filens tidsstämpel) vinner. Med quarantine läggs poster
+    som inte går att läsa i karantän i stället för att avbryta."""
     ensure_output_dir(output_dir)
+    mrc_files = get_mrc_files_by_timestamp(input_dir)
+
+    def iter_raw_records(record_quarantine):
+        for mrc_file in mrc_files:
+            if record_quarantine:
+                yield from record_quarantine.read_raw_records(mrc_file)
+            else:
+                yield from iso2709.read_raw_records(mrc_file)
+
+    with LastOccurrenceIndex(directory=output_dir) as last_occurrence:
+        for position, raw_record in enumerate(iter_raw_records(quarantine)):
+            last_occurrence.add(get_libris_id(parse_marc_record(raw_record)), position)
+
+        # Andra genomläsningen hoppar över samma poster utan att spara dem igen
+        return process_raw_records(
+            last_occurrence.filter_last(
+                iter_raw_records(Quarantine(None) if quarantine else None)
+            ),
+            output_dir,
+            chunk_size,
+            workers,
+            change_index,
+            deduplicate=False,
+            chunk_max_bytes=chunk_max_bytes,
+            uploader=uploader,
+        )
+
+
+def process_raw_records(
+    raw_records,
+    output_dir,
+    chunk_size,
+    workers=TRANSFORM_WORKERS,
+    change_index=None,
+    deduplicate=True,
+    chunk_max_bytes=0,
+    uploader=None,
+):
+    """Bearbeta råa MARC-poster - i flera processer om workers > 1 och det finns
+    tillräckligt många poster, annars seriellt. Returnerar antalet poster."""
+    if workers > 1:
+        head = list(islice(raw_records, PARALLEL_MIN_RECORDS))
+        if len(head) < PARALLEL_MIN_RECORDS:
+            raw_records = head
+        else:
+            records = transform_unique_records_parallel(
+                chain(head, raw_records), workers, deduplicate
+            )
+            if change_index:
+                records = skip_unchanged_records(records, change_index)
+            return write_chunks(
+                records, output_dir, chunk_size, chunk_max_bytes, uploader
+            )
+
+    return process_marc_records(
+        map(parse_marc_record, raw_records),
+        output_dir,
+        chunk_size,
+        change_index,
+        deduplicate,
+        chunk_max_bytes,
+        uploader,
+    )
 
-    accumulated_records = []
-    unique_records = set()
-    chunk_index = 1
 
-    for mrc_file in get_mrc_files(input_dir):
-        for record in read_marc_records(mrc_file):
-            libris_id = get_libris_id(record)
+def process_marc_records(
+    records,
+    output_dir,
+    chunk_size,
+    change_index=None,
+    deduplicate=True,
+    chunk_max_bytes=0,
+    uploader=None,
+):
+    """Bearbeta MARC-poster - ta bort dubletter, transformera och skriv i chunks.
+    Returnerar antalet poster som skrivits."""
+    records = transform_unique_records(records, deduplicate)
+    if change_index:
+        records = skip_unchanged_records(records, change_index)
+    return write_chunks(records, output_dir, chunk_size, chunk_max_bytes, uploader)
+
+
+def transform_unique_records(records, deduplicate=True):
+    """Ta bort dubletter (första förekomsten vinner) och transformera posterna.
+    Ger par av (Libris-ID, post)."""
+    unique_records = set()
+    for record in records:
+        libris_id = get_libris_id(record)
+        if deduplicate:
             if libris_id in unique_records:
                 continue
             unique_records.add(libris_id)
-            record = custom_transform(record)
-            accumulated_records.append(record)
-            if len(accumulated_records) == chunk_size:
-                write_chunk(accumulated_records, output_dir, chunk_index)
-                accumulated_records = []
-                chunk_index += 1
+        yield libris_id, custom_transform(record)
+
+
+def skip_unchanged_records(records, change_index):
+    """Hoppa över poster som är oförändrade sedan senaste lyckade import"""
+    for libris_id, record in records:
+        marc = record if isinstance(record, bytes) else record.as_marc()
+        if not change_index.is_unchanged(libris_id, marc):
+            yield libris_id, marc
+
+
+def init_transform_worker(rules):
+    """Kompilera reglerna för custom_transform i en arbetsprocess, så att samma
+    regler används som i huvudprocessen"""
+    global _TRANSFORM_RULES  # pylint: disable=global-statement
+    _TRANSFORM_RULES = marc_rules.TransformRules(rules)
+
+
+def transform_raw_batch(raw_records):
+    """Tolka, transformera och serialisera en batch poster i en arbetsprocess.
+    Returnerar lista av (Libris-ID, ISO2709) i samma ordning som posterna."""
+    batch = []
+    for raw_record in raw_records:
+        record = parse_marc_record(raw_record)
+        batch.append((get_libris_id(record), custom_transform(record).as_marc()))
+    return batch
+
+
+def transform_unique_records_parallel(raw_records, workers, deduplicate=True):
+    """Transformera poster i en processpool. Batcharna lämnas tillbaka i ordning och
+    dubletter tas bort här, så resultatet blir detsamma som vid seriell körning.
+    Antalet batcher i arbete är begränsat så att minnesanvändningen hålls nere."""
+    raw_records = iter(raw_records)
+    unique_records = set()
+    pending = deque()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context(TRANSFORM_START_METHOD),
+        initializer=init_transform_worker,
+        initargs=(get_transform_rules().rules,),
+    ) as executor:
+        while True:
+            batch = list(islice(raw_records, TRANSFORM_BATCH_SIZE))
+            if batch:
+                pending.append(executor.submit(transform_raw_batch, batch))
+            if not pending:
+                return
+            if batch and len(pending) < workers * 2:
+                continue
+            for libris_id, marc in pending.popleft().result():
+                if deduplicate:
+                    if libris_id in unique_records:
+                        continue
+                    unique_records.add(libris_id)
+                yield libris_id, marc
+
+
+def write_chunks(records, output_dir, chunk_size, chunk_max_bytes=0, uploader=None):
+    """Skriv par av (Libris-ID, post) i chunks om högst chunk_size poster och
+    chunk_max_bytes bytes (0 = obegränsat). En post som ensam är större än
+    chunk_max_bytes hamnar i en egen chunk. Med uploader (ChunkUploader) laddas
+    varje chunk upp till Folio så snart den är full i stället för att skrivas till
+    fil. Returnerar antalet poster."""
+    if not chunk_size and not chunk_max_bytes:
+        return write_single_chunk(records, output_dir, uploader)
+    if uploader is None:
+        ensure_output_dir(output_dir)
+
+    def write_chunk_to(accumulated_records, chunk_index):
+        if uploader is None:
+            write_chunk(accumulated_records, output_dir, chunk_index)
+        else:
+            uploader.add(
+                chunk_file_name(chunk_index),
+                b"".join(accumulated_records),
+                len(accumulated_records),
+            )
+
+    accumulated_records = []
+    accumulated_bytes = 0
+    chunk_index = 1
+    record_count = 0
+
+    for _, record in records:
+        marc = record if isinstance(record, bytes) else record.as_marc()
+        if (
+            chunk_max_bytes
+            and accumulated_records
+            and accumulated_bytes + len(marc) > chunk_max_bytes
+        ):
+            write_chunk_to(accumulated_records, chunk_index)
+            accumulated_records = []
+            accumulated_bytes = 0
+            chunk_index += 1
+        accumulated_records.append(marc)
+        accumulated_bytes += len(marc)
+        record_count += 1
+        if len(accumulated_records) == chunk_size:
+            write_chunk_to(accumulated_records, chunk_index)
+            accumulated_records = []
+            accumulated_bytes = 0
+            chunk_index += 1
 
     # Skriv de poster som återstår
     if accumulated_records:
-        write_chunk(accumulated_records, output_dir, chunk_index)
+        write_chunk_to(accumulated_records, chunk_index)
+
+    return record_count
+
+
+def write_single_chunk(records, output_dir, uploader=None):
+    """Skriv alla par av (Libris-ID, post) som en enda chunk utan att samla dem i
+    minnet: direkt till fil, eller med uploader till en SpooledTemporaryFile som
+    laddas upp när alla poster skrivits. Returnerar antalet poster."""
+    file_name = chunk_file_name(1)
+    output = None
+    record_count = 0
+    try:
+        with metrics.span("write_chunk"):
+            for _, record in records:
+                if output is None:
+                    if uploader is None:
+                        ensure_output_dir(output_dir)
+                        output = open(  # pylint: disable=consider-using-with
+                            output_dir / file_name, "wb"
+                        )
+                    else:
+                        output = tempfile.SpooledTemporaryFile(
+                            max_size=SINGLE_CHUNK_SPOOL_BYTES
+                        )
+                output.write(record if isinstance(record, bytes) else record.as_marc())
+                record_count += 1
+    except BaseException:
+        if output is not None:
+            output.close()
+        raise
+
+    if output is None:
+        return 0
+    if uploader is None:
+        output.close()
+        metrics.increment("chunks_written")
+        metrics.increment("records_written", record_count)
+        logging.info("Skrev %s poster till %s", record_count, output_dir / file_name)
+    else:
+        # uploader stänger filen när den laddats upp
+        output.seek(0)
+        uploader.add(file_name, output, record_count)
+    return record_count
+
+
+def stream_and_process_libris_data(
+    last_run_timestamp,
+    libris_export_properties_path,
+    libris_base_folder,
+    chunks_folder,
+    change_index=None,
+    chunk_settings=None,
+    harvest_settings=None,
+    quarantine=None,
+    uploader=None,
+):
+    """Strömma MARC-data från Libris till fil och dela upp posterna i chunks
+    samtidigt som nedladdningen pågår. Returnerar antalet poster. Med quarantine
+    läggs poster som inte går att läsa i karantän i stället för att avbryta, med
+    uploader laddas chunks upp till Folio i stället för att skrivas till fil."""
+    chunk_size, chunk_max_bytes = (chunk_settings or ChunkSettings()).limits()
+    export_path = get_export_path(libris_base_folder)
+    blocks = stream_libris_data(
+        last_run_timestamp,
+        libris_export_properties_path,
+        export_path,
+        harvest_settings,
+    )
+    return process_raw_records(
+        (
+            quarantine.split_raw_records(blocks, export_path)
+            if quarantine
+            else iso2709.split_raw_records(blocks)
+        ),
+        output_dir=chunks_folder,
+        chunk_size=chunk_size,
+        change_index=change_index,
+        chunk_max_bytes=chunk_max_bytes,
+        uploader=uploader,
+    )
+
+
+def open_quarantine(libris_base_folder):
+    """Öppna karantänen för poster som inte går att läsa (om den används)"""
+    if not QUARANTINE_INVALID_RECORDS:
+        return nullcontext()
+    return Quarantine(
+        os.path.join(
+            libris_base_folder,
+            QUARANTINE_FOLDER,
+            f"quarantine_{CURRENT_UTC_TIMESTAMP}.jsonl",
+        )
+    )
+
+
+def log_quarantine(quarantine):
+    """Logga och räkna poster som lagts i karantän"""
+    if quarantine:
+        quarantine.log()
+        metrics.increment("records_quarantined", quarantine.total)
 
 
-def import_marc_files_to_folio(folio, chunks_folder, libris_jobprofile):
-    """Importera MARC-filer till Folio"""
-    chunks_path = Path(chunks_folder)
-    marc_files = list(chunks_path.glob("*.mrc"))
+def open_change_index(libris_base_folder, keep_pending=False):
+    """Öppna indexet över importerade poster (om det används)"""
+    if not CHANGE_INDEX_ENABLED:
+        return nullcontext()
+    return ChangeIndex(
+        os.path.join(libris_base_folder, CHANGE_INDEX_FILENAME), keep_pending
+    )
+
+
+def open_chunk_uploader(
+    folio, chunks_folder, checkpoint=None, submission_settings=None
+):
+    """Skapa en ChunkUploader för direktuppladdning (om den används). Med
+    checkpoint skrivs chunks även till fil så att körningen kan återupptas."""
+    if not DIRECT_UPLOAD or (checkpoint and checkpoint.chunked):
+        return nullcontext()
+    submission_settings = submission_settings or SubmissionSettings()
+    return ChunkUploader(
+        folio,
+        concurrency=submission_settings.upload_concurrency,
+        spill_dir=chunks_folder if checkpoint else None,
+        chunks_per_import=submission_settings.chunks_per_import,
+    )
+
+
+def load_checkpoint(libris_base_folder, last_run_timestamp):
+    """Läs in checkpoint för körningen (om återupptagbara körningar används)"""
+    if not RESUMABLE_RUNS:
+        return None
+    return Checkpoint.load(
+        os.path.join(libris_base_folder, CHECKPOINT_FILENAME),
+        last_run_timestamp,
+        CURRENT_UTC_TIMESTAMP,
+    )
+
+
+def import_and_monitor(
+    folio,
+    chunks_folder,
+    libris_jobprofile,
+    checkpoint=None,
+    uploader=None,
+    submission_settings=None,
+):
+    """Importera chunks till Folio och följ upp jobben. Returnerar True om allt gått bra.
+    Har importen redan initierats i en tidigare körning följs de jobben upp först,
+    och importen görs bara om ifall de misslyckats. Med uploader har chunks redan
+    laddats upp direkt och importen initieras när uppladdningen är klar."""
+    if checkpoint and checkpoint.submitted:
+        if not MONITOR_IMPORT or monitor_imports(folio, checkpoint.imports):
+            return True
+        logging.info("Tidigare import misslyckades, importerar på nytt")
+        checkpoint.update(
+            upload_definition_id=None,
+            uploaded=[],
+            imports=[],
+            imported=[],
+            submitted=False,
+        )
+
+    try:
+        if uploader:
+            upload_definition_ids = submit_uploaded_chunks(
+                folio, uploader, libris_jobprofile, checkpoint, submission_settings
+            )
+        else:
+            upload_definition_ids = import_marc_files_to_folio(
+                folio,
+                chunks_folder,
+                libris_jobprofile,
+                checkpoint=checkpoint,
+                submission_settings=submission_settings,
+            )
+    except RuntimeError:
+        return False
+
+    if MONITOR_IMPORT and upload_definition_ids:
+        return monitor_imports(folio, upload_definition_ids)
+    return True
+
+
+def import_marc_files_to_folio(
+    folio,
+    chunks_folder,
+    libris_jobprofile,
+    concurrency=None,
+    checkpoint=None,
+    submission_settings=None,
+):
+    """Importera MARC-filer till Folio i en upload definition per högst
+    chunks_per_import filer. Varje import initieras först när Folio har kapacitet
+    (se submit_import). Returnerar id för alla upload definitions.
+    Med checkpoint hoppas chunks som redan importerats över, upload definition
+    från en avbruten körning återanvänds och chunks som redan laddats upp till den
+    hoppas över. Utan concurrency laddas upload_concurrency filer upp samtidigt."""
+    submission_settings = submission_settings or SubmissionSettings()
+    concurrency = concurrency or submission_settings.upload_concurrency
+    imported = checkpoint.imported if checkpoint else set()
+    upload_definition_ids = checkpoint.imports if checkpoint else []
+    marc_files = [
+        file
+        for file in sorted(Path(chunks_folder).glob("*.mrc"))
+        if file.name not in imported
+    ]
     marc_files_dict = {file.name: file for file in marc_files}
 
-    if not marc_files:
-        return
+    # Fortsätt med upload definition från en avbruten körning
+    upload_definition = get_resumable_upload_definition(folio, checkpoint)
+    if upload_definition is not None:
+        import_upload_definition(
+            folio,
+            upload_definition,
+            marc_files_dict,
+            libris_jobprofile,
+            concurrency,
+            checkpoint,
+            submission_settings,
+        )
+        upload_definition_ids.append(upload_definition.get("id"))
+        resumed = {
+            file_definition["name"]
+            for file_definition in upload_definition.get("fileDefinitions")
+        }
+        marc_files = [file for file in marc_files if file.name not in resumed]
 
-    # Steg 1 - skapa upload definition
-    upload_definition = create_upload_definition(folio, marc_files)
+    batch_size = submission_settings.chunks_per_import or max(len(marc_files), 1)
+    for start in range(0, len(marc_files), batch_size):
+        # Skapa en upload definition för nästa omgång filer
+        upload_definition = create_upload_definition(
+            folio, marc_files[start : start + batch_size]
+        )
+        if checkpoint:
+            checkpoint.update(
+                upload_definition_id=upload_definition.get("id"), uploaded=[]
+            )
+        import_upload_definition(
+            folio,
+            upload_definition,
+            marc_files_dict,
+            libris_jobprofile,
+            concurrency,
+            checkpoint,
+            submission_settings,
+        )
+        upload_definition_ids.append(upload_definition.get("id"))
+
+    if checkpoint:
+        checkpoint.update(submitted=True)
+    return upload_definition_ids
+
+
+def import_upload_definition(
+    folio,
+    upload_definition,
+    marc_files_dict,
+    libris_jobprofile,
+    concurrency,
+    checkpoint=None,
+    submission_settings=None,
+):
+    """Ladda upp filinnehåll för varje file definition i en upload definition och
+    initiera importen när alla filer laddats upp"""
     upload_definition_id = upload_definition.get("id")
+    uploaded = checkpoint.uploaded if checkpoint else set()
+    file_definitions = [
+        file_definition
+        for file_definition in upload_definition.get("fileDefinitions")
+        if file_definition["name"] not in uploaded
+    ]
+    if concurrency > 1:
+        upload_files_concurrently(
+            folio,
+            upload_definition_id,
+            file_definitions,
+            marc_files_dict,
+            concurrency,
+            checkpoint,
+        )
+    else:
+        for file_definition in file_definitions:
+            upload_file_definition(
+                folio,
+                upload_definition_id,
+                file_definition,
+                marc_files_dict,
+                checkpoint,
+            )
+
+    submit_import(
+        folio,
+        upload_definition_id,
+        [
+            file_definition["name"]
+            for file_definition in upload_definition.get("fileDefinitions")
+        ],
+        libris_jobprofile,
+        checkpoint,
+        submission_settings,
+    )
+
 
-    # Steg 2 - ladda upp filinnehåll för varje file definition
-    for file_definition in upload_definition.get("fileDefinitions"):
-        file_definition_id = file_definition["id"]
-        file_name = file_definition["name"]
-        file_path = marc_files_dict.get(file_name)
-        upload_file(folio, upload_definition_id, file_definition_id, file_path)
+def submit_uploaded_chunks(
+    folio, uploader, libris_jobprofile, checkpoint=None, submission_settings=None
+):
+    """Vänta in chunks som laddas upp direkt och initiera importen för varje
+    upload definition. Returnerar id för alla upload definitions.
+
+    Vid fel raderas upload definitions som inte importerats, utom den som sparats
+    i checkpoint och kan återanvändas av nästa körning."""
+    try:
+        upload_definitions = uploader.finish()
+    except RuntimeError:
+        uploader.delete_upload_definitions(
+            [
+                upload_definition_id
+                for upload_definition_id, _ in uploader.upload_definitions
+            ]
+        )
+        raise
 
-    # Steg 3 - initiera import
+    upload_definition_ids = []
+    for number, (upload_definition_id, file_names) in enumerate(upload_definitions):
+        if checkpoint:
+            checkpoint.update(
+                upload_definition_id=upload_definition_id, uploaded=file_names
+            )
+        try:
+            submit_import(
+                folio,
+                upload_definition_id,
+                file_names,
+                libris_jobprofile,
+                checkpoint,
+                submission_settings,
+            )
+        except RuntimeError:
+            unused = upload_definitions[number + 1 if checkpoint else number :]
+            uploader.delete_upload_definitions([unused_id for unused_id, _ in unused])
+            raise
+        upload_definition_ids.append(upload_definition_id)
+
+    if checkpoint:
+        checkpoint.update(submitted=True)
+    return upload_definition_ids
+
+
+def submit_import(
+    folio,
+    upload_definition_id,
+    file_names,
+    libris_jobprofile,
+    checkpoint=None,
+    submission_settings=None,
+):
+    """Initiera importen för en upload definition när högst max_running_jobs
+    importjobb pågår i Folio, så att en stor körning inte tränger undan andra
+    importer"""
+    submission_settings = submission_settings or SubmissionSettings()
+    with metrics.span("import_wait"):
+        import_monitor.wait_for_capacity(
+            folio,
+            submission_settings.max_running_jobs,
+            submission_settings.poll_interval,
+            submission_settings.max_wait,
+        )
     initiate_import(folio, upload_definition_id, libris_jobprofile)
+    metrics.increment("imports_submitted")
+    logging.info(
+        "Initierade import av %s chunks i upload definition %s",
+        len(file_names),
+        upload_definition_id,
+    )
+    if checkpoint:
+        checkpoint.mark_imported(upload_definition_id, file_names)
+
+
+def get_resumable_upload_definition(folio, checkpoint):
+    """Hämta upload definition från en avbruten körning om den kan återanvändas"""
+    if not checkpoint or not checkpoint.upload_definition_id or checkpoint.submitted:
+        return None
+    try:
+        return folio.get_data(
+            f"/data-import/uploadDefinitions/{checkpoint.upload_definition_id}",
+            limit=0,
+        )
+    except (
+        ConnectionError,
+        TimeoutError,
+        BadRequestError,
+        ItemNotFoundError,
+        RuntimeError,
+    ) as e:
+        logging.info(
+            "Upload definition %s kan inte återanvändas: %s",
+            checkpoint.upload_definition_id,
+            e,
+        )
+        return None
 
 
 def create_upload_definition(folio, files):
@@ -199,16 +1319,68 @@ def create_upload_definition(folio, files):
         raise RuntimeError(f"Fel vid skapande av upload definition: {e}") from e
 
 
+def upload_files_concurrently(
+    folio,
+    upload_definition_id,
+    file_definitions,
+    marc_files_dict,
+    concurrency,
+    checkpoint=None,
+):
+    """Ladda upp filinnehåll för flera file definitions parallellt över samma
+    Folio-session. Avbryter återstående uppladdningar vid första fel."""
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(
+                upload_file_definition,
+                folio,
+                upload_definition_id,
+                file_definition,
+                marc_files_dict,
+                checkpoint,
+            )
+            for file_definition in file_definitions
+        ]
+        try:
+            for future in as_completed(futures):
+                # upload_file loggar felet och lyfter RuntimeError
+                future.result()
+        except RuntimeError:
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def upload_file_definition(
+    folio, upload_definition_id, file_definition, marc_files_dict, checkpoint=None
+):
+    """Ladda upp filen för en file definition och markera den som uppladdad"""
+    file_name = file_definition["name"]
+    upload_file(
+        folio,
+        upload_definition_id,
+        file_definition["id"],
+        marc_files_dict.get(file_name),
+    )
+    if checkpoint:
+        checkpoint.mark_uploaded(file_name)
+
+
 def upload_file(folio, upload_definition_id, file_definition_id, file_path):
     """Ladda upp filinnehåll för en given file definition"""
     with open(file_path, "rb") as file:
         try:
-            return folio.post_data(
-                f"/data-import/uploadDefinitions/{upload_definition_id}/files/{file_definition_id}",
-                content=file,
-            )
+            with metrics.span("chunk_upload"):
+                response = utils.post_binary(
+                    folio,
+                    f"/data-import/uploadDefinitions/{upload_definition_id}/files/{file_definition_id}",
+                    content=file,
+                )
+            metrics.increment("bytes_uploaded", os.fstat(file.fileno()).st_size)
+            return response
         except (
             ConnectionError,
+            TimeoutError,
             TimeoutException,
             BadRequestError,
             ItemNotFoundError,
@@ -238,10 +1410,11 @@ def initiate_import(folio, upload_definition_id, job_profile_id):
                 "dataType": "MARC",
             },
         }
-        return folio.post_data(
-            f"/data-import/uploadDefinitions/{upload_definition_id}/processFiles",
-            payload=payload,
-        )
+        with metrics.span("initiate_import"):
+            return folio.post_data(
+                f"/data-import/uploadDefinitions/{upload_definition_id}/processFiles",
+                payload=payload,
+            )
     except (
         ConnectionError,
         TimeoutException,
@@ -257,10 +1430,74 @@ def initiate_import(folio, upload_definition_id, job_profile_id):
         raise RuntimeError(f"Fel vid intiering av import: {e}") from e
 
 
+def monitor_imports(folio, upload_definition_ids):
+    """Följ upp importen för flera upload definitions. Returnerar True om alla
+    jobb blev klara utan fel."""
+    # Följ upp alla även om någon misslyckats, så att alla resultat loggas. De
+    # senare importerna är oftast klara när de tidigare följts upp.
+    results = [
+        monitor_import(
+            folio,
+            upload_definition_id,
+            import_monitor.INITIAL_DELAY if number == 0 else 1,
+        )
+        for number, upload_definition_id in enumerate(upload_definition_ids)
+    ]
+    return all(results)
+
+
+def monitor_import(
+    folio, upload_definition_id, initial_delay=import_monitor.INITIAL_DELAY
+):
+    """Vänta tills importjobben i Folio är klara och logga resultatet.
+    Returnerar True om alla jobb blev klara utan fel."""
+    with metrics.span("import_monitor"):
+        report = import_monitor.wait_for_import(
+            folio, upload_definition_id, initial_delay=initial_delay
+        )
+    report.log()
+    return report.succeeded
+
+
+def index_exports(libris_base_folder):
+    """Bygg index över posternas position för nedladdade exporter som saknar index.
+    Fel loggas men påverkar inte körningen (indexet byggs då vid arkiveringen)."""
+    for export_path in get_mrc_files(Path(libris_base_folder)):
+        if os.path.exists(export_archive.index_path_for(export_path)):
+            continue
+        try:
+            with metrics.span("index_export"):
+                count = export_archive.build_offset_index(export_path)
+            logging.info("Indexerade %s poster i %s", count, export_path)
+        except (OSError, RuntimeError, sqlite3.Error) as e:
+            logging.error("Fel vid indexering av %s: %s", export_path, e)
+
+
+def archive_exports(libris_base_folder, archive_settings):
+    """Arkivera nedladdade exporter och radera de äldsta arkiverade exporterna.
+    Fel loggas men påverkar inte körningen."""
+    archive_folder = Path(libris_base_folder) / archive_settings.folder
+    try:
+        for export_path in get_mrc_files(libris_base_folder):
+            with metrics.span("archive_export"):
+                archived_path = export_archive.archive_export(
+                    export_path, archive_folder, archive_settings.compression
+                )
+            logging.info("Arkiverade %s som %s", export_path, archived_path)
+        removed = export_archive.apply_retention(archive_folder, archive_settings.keep)
+        if removed:
+            logging.info("Raderade %s gamla exporter ur arkivet", removed)
+    except (OSError, RuntimeError, sqlite3.Error) as e:
+        logging.error("Fel vid arkivering av export: %s", e)
+
+
 def clean_up_folders(folders):
-    """Remove .mrc files from specified folders."""
+    """Remove .mrc files and their offset indexes from specified folders."""
     for folder in folders:
-        for file_path in folder.glob("*.mrc"):
+        for file_path in [
+            *folder.glob("*.mrc"),
+            *folder.glob(f"*.mrc{export_archive.INDEX_SUFFIX}*"),
+        ]:
             try:
                 file_path.unlink()
                 logging.info("Removed %s", file_path)
@@ -270,24 +1507,28 @@ def clean_up_folders(folders):
 
 def main():
     """Exportera MARC-data från Libris och importera till Folio:
-    0. Radera nedladdade filer och temporära filer
-    1. Läs in tidsstämpeln för senaste körning
+    0. Läs in tidsstämpeln för senaste körning och ev. checkpoint från en misslyckad körning
+    1. Radera nedladdade filer och temporära filer (utom de en checkpoint behöver)
     2. Hämta MARC-data från Libris (avbryt om det inte finns några nya poster)
     3. Spara MARC-data till fil
-    4. Dela upp MARC-data i mindre delar
-    5. Importera MARC-data till Folio
-    6. Radera nedladdade filer och temporära filer
-    7. Uppdatera tidsstämpeln för senaste körning om allt gått bra
+    4. Dela upp MARC-data i mindre delar och transformera posterna (regler i config.json)
+    (Med STREAM_LIBRIS_EXPORT görs steg 2-4 samtidigt medan data strömmas från Libris)
+    5. Importera MARC-data till Folio i en eller flera omgångar (poster som är oförändrade
+    sedan senaste import hoppas över, nästa omgång väntar om Folio har många pågående jobb)
+    6. Följ importjobben i Folio tills de är klara (om MONITOR_IMPORT)
+    7. Radera nedladdade filer och temporära filer (sparas vid fel om RESUMABLE_RUNS)
+    8. Uppdatera tidsstämpeln för senaste körning om allt gått bra
+    Med en checkpoint hoppas de steg över som redan gjorts i en tidigare körning.
     OBS! I steg 4 tas dubletter bort och posten modifieras enligt custom_transform
+    Returnerar False om hämtningen eller importen misslyckades, annars True.
     """
-    completed_with_errors = False
     folio_config = utils.load_env()
     mode = folio_config.mode
 
     # Kör bara i prod-miljö normalt för att inte belasta Libris i onödan
     if mode != "prod":
         logging.info("Skriptet körs bara i produktionsmiljöer")
-        return
+        return True
 
     libris_base_folder = Path(os.environ["LIBRIS_BASE_FOLDER"])
     chunks_folder = Path(
@@ -298,55 +1539,237 @@ def main():
     libris_export_properties_path = os.path.join(
         libris_base_folder, "export.properties"
     )
-
-    # Rensa upp gamla chunk-filer ifall de mot förmodan inte raderats tidigare
-    clean_up_folders([chunks_folder])
+    chunk_settings = load_chunk_settings()
+    chunk_size, chunk_max_bytes = chunk_settings.limits()
+    harvest_settings = load_harvest_settings()
+    archive_settings = load_archive_settings()
+    submission_settings = load_submission_settings()
+    # Kompilera reglerna innan något hämtas, så att fel i config.json syns direkt
+    get_transform_rules()
+
+    last_run_timestamp = get_last_run_timestamp(last_run_timestamp_path)
+    checkpoint = load_checkpoint(libris_base_folder, last_run_timestamp)
+
+    # Rensa upp gamla filer ifall de mot förmodan inte raderats tidigare - utom de
+    # som en återupptagen körning kan fortsätta från
+    if not (checkpoint and checkpoint.downloaded):
+        clean_up_folders([libris_base_folder])
+    if not (checkpoint and checkpoint.chunked):
+        clean_up_folders([chunks_folder])
 
     try:
-        with FolioClient(
-            folio_config.base_url,
-            folio_config.tenant,
-            folio_config.username,
-            folio_config.password,
-        ) as folio:
-            last_run_timestamp = get_last_run_timestamp(last_run_timestamp_path)
+        with utils.folio_session(folio_config) as folio, open_change_index(
+            libris_base_folder, keep_pending=bool(checkpoint and checkpoint.chunked)
+        ) as change_index, open_quarantine(
+            libris_base_folder
+        ) as quarantine, open_chunk_uploader(
+            folio, chunks_folder, checkpoint, submission_settings
+        ) as uploader:
+            if checkpoint and checkpoint.downloaded:
+                # Exporten finns kvar från en tidigare körning
+                if not checkpoint.chunked:
+                    with metrics.span("split"):
+                        process_mrc_files(
+                            input_dir=libris_base_folder,
+                            output_dir=chunks_folder,
+                            chunk_size=chunk_size,
+                            change_index=change_index,
+                            chunk_max_bytes=chunk_max_bytes,
+                            quarantine=quarantine,
+                            uploader=uploader,
+                        )
+                    if change_index:
+                        change_index.save_pending()
+                    checkpoint.update(chunked=True)
+            elif STREAM_LIBRIS_EXPORT:
+                try:
+                    with metrics.span("download_and_split"):
+                        record_count = stream_and_process_libris_data(
+                            last_run_timestamp,
+                            libris_export_properties_path,
+                            libris_base_folder,
+                            chunks_folder,
+                            change_index,
+                            chunk_settings,
+                            harvest_settings,
+                            quarantine,
+                            uploader,
+                        )
+                except LibrisFetchError as e:
+                    # Fel vid transformation och uppdelning lyfts vidare som de är
+                    logging.error("Fel vid hämtning av data från Libris: %s", e)
+                    clean_up_folders([libris_base_folder, chunks_folder])
+                    return False
+
+                if not record_count and not (change_index and change_index.skipped):
+                    logging.info("Inga nya MARC-poster att hämta")
+                    clean_up_folders([libris_base_folder, chunks_folder])
+                    return True
+
+                if change_index:
+                    change_index.save_pending()
+                if checkpoint:
+                    checkpoint.update(
+                        downloaded=True,
+                        export_file=os.path.basename(
+                            get_export_path(libris_base_folder)
+                        ),
+                        chunked=True,
+                    )
+            else:
+                try:
+                    marc_data = get_libris_data(
+                        last_run_timestamp,
+                        libris_export_properties_path,
+                        harvest_settings,
+                    )
+                except (ConnectionError, TimeoutError, RuntimeError) as e:
+                    logging.error("Fel vid hämtning av data från Libris: %s", e)
+                    return False
+
+                if not marc_data:
+                    logging.info("Inga nya MARC-poster att hämta")
+                    return True
+
+                save_marc(marc_data, libris_base_folder)
+                if checkpoint:
+                    checkpoint.update(
+                        downloaded=True,
+                        export_file=os.path.basename(
+                            get_export_path(libris_base_folder)
+                        ),
+                    )
+
+                with metrics.span("split"):
+                    process_mrc_files(
+                        input_dir=libris_base_folder,
+                        output_dir=chunks_folder,
+                        chunk_size=chunk_size,
+                        change_index=change_index,
+                        chunk_max_bytes=chunk_max_bytes,
+                        quarantine=quarantine,
+                        uploader=uploader,
+                    )
+                if change_index:
+                    change_index.save_pending()
+                if checkpoint:
+                    checkpoint.update(chunked=True)
+
+            if archive_settings.enabled:
+                index_exports(libris_base_folder)
+            log_quarantine(quarantine)
+            if change_index:
+                metrics.increment("records_unchanged", change_index.skipped)
+                logging.info(
+                    "Hoppade över %s poster som är oförändrade sedan senaste import",
+                    change_index.skipped,
+                )
 
-            try:
-                marc_data = get_libris_data(
-                    last_run_timestamp, libris_export_properties_path
+            with metrics.span("import"):
+                completed_with_errors = not import_and_monitor(
+                    folio,
+                    chunks_folder,
+                    libris_jobprofile,
+                    checkpoint,
+                    uploader,
+                    submission_settings,
                 )
-            except (ConnectionError, TimeoutError, RuntimeError) as e:
-                logging.error("Fel vid hämtning av data från Libris: %s", e)
-                return
 
-            if not marc_data:
-                logging.info("Inga nya MARC-poster att hämta")
-                return
+            if completed_with_errors and checkpoint:
+                logging.info(
+                    "Sparar export och chunks så att körningen kan återupptas: %s",
+                    checkpoint.path,
+                )
+            else:
+                if not completed_with_errors and archive_settings.enabled:
+                    archive_exports(libris_base_folder, archive_settings)
+                clean_up_folders([libris_base_folder, chunks_folder])
 
-            save_marc(marc_data, libris_base_folder)
+            # Uppdatera tidsstämpeln och indexet för senaste körning om allt gått bra
+            if not completed_with_errors:
+                if change_index:
+                    change_index.commit()
+                if checkpoint:
+                    update_last_run_timestamp(last_run_timestamp_path, checkpoint.until)
+                    checkpoint.remove()
+                else:
+                    update_last_run_timestamp(last_run_timestamp_path)
+            return not completed_with_errors
+    except (
+        ConnectionError,
+        TimeoutError,
+    ) as e:
+        logging.error("Misslyckades att ansluta fill Folio: %s", e)
+        return False
 
-            process_mrc_files(
-                input_dir=libris_base_folder,
-                output_dir=chunks_folder,
-                chunk_size=CHUNK_SIZE,
-            )
 
-            try:
-                import_marc_files_to_folio(folio, chunks_folder, libris_jobprofile)
-            except RuntimeError:
-                completed_with_errors = True
+def backfill(input_dir):
+    """Importera samtliga MARC-filer i en mapp till Folio, t.ex. vid återladdning av
+    hela beståndet från Libris. Filerna i mappen raderas inte och tidsstämpeln för
+    senaste körning påverkas inte. Returnerar False om importen misslyckades."""
+    folio_config = utils.load_env()
+    libris_base_folder = Path(os.environ["LIBRIS_BASE_FOLDER"])
+    chunks_folder = Path(
+        os.path.join(libris_base_folder, os.environ["LIBRIS_CHUNKS_FOLDER"])
+    )
+    libris_jobprofile = os.environ["LIBRIS_JOBPROFILE"]
+    chunk_size, chunk_max_bytes = load_chunk_settings().limits()
+    submission_settings = load_submission_settings()
+    get_transform_rules()
 
-            clean_up_folders([libris_base_folder, chunks_folder])
+    clean_up_folders([chunks_folder])
 
-            # Uppdatera tidsstämpeln för senaste körning om allt gått bra
-            if not completed_with_errors:
-                update_last_run_timestamp(last_run_timestamp_path)
+    try:
+        with utils.folio_session(folio_config) as folio, open_change_index(
+            libris_base_folder
+        ) as change_index, open_quarantine(
+            libris_base_folder
+        ) as quarantine, open_chunk_uploader(
+            folio, chunks_folder, submission_settings=submission_settings
+        ) as uploader:
+            record_count = process_mrc_files_backfill(
+                input_dir=Path(input_dir),
+                output_dir=chunks_folder,
+                chunk_size=chunk_size,
+                change_index=change_index,
+                chunk_max_bytes=chunk_max_bytes,
+                quarantine=quarantine,
+                uploader=uploader,
+            )
+            log_quarantine(quarantine)
+            logging.info("Återladdning: %s unika poster att importera", record_count)
+
+            succeeded = import_and_monitor(
+                folio,
+                chunks_folder,
+                libris_jobprofile,
+                uploader=uploader,
+                submission_settings=submission_settings,
+            )
+            if succeeded:
+                if change_index:
+                    change_index.commit()
+            else:
+                logging.error("Återladdningen från %s misslyckades", input_dir)
+            clean_up_folders([chunks_folder])
+            return succeeded
     except (
         ConnectionError,
         TimeoutError,
     ) as e:
         logging.error("Misslyckades att ansluta fill Folio: %s", e)
+        return False
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--backfill",
+        metavar="MAPP",
+        help="importera alla MARC-filer i MAPP (senaste filen vinner vid dubletter)",
+    )
+    args = parser.parse_args()
+    with utils.collect_metrics("libris_to_folio"):
+        succeeded = backfill(args.backfill) if args.backfill else main()
+    if not succeeded:
+        sys.exit(1)
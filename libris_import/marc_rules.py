@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+
+"""
+Regelstyrd transformation av MARC-poster.
+
+Reglerna anges i config.json (avsnittet "marc_transform") och kompileras en gång
+till en tabell tagg -> åtgärder. Varje post gås då igenom en gång, fält för fält,
+oavsett hur många regler som finns. Bara fält med regler tolkas, övriga lämnas
+orörda. Reglerna fungerar likadant för poster på bytenivå (iso2709.RawRecord) och
+för pymarc-poster, så resultatet blir byte-identiskt oavsett väg.
+
+Åtgärder:
+    {"action": "remove_field", "tag": "035"}
+    {"action": "remove_subfield", "tag": "830", "code": "9"}
+    {"action": "move", "tag": "500", "to_tag": "590"}
+    {"action": "move", "tag": "830", "code": "9", "to_code": "x"}
+    {"action": "replace", "tag": "245", "code": "a", "pattern": " /$", "replacement": ""}
+    {"action": "replace", "tag": "650", "indicator": 2, "pattern": "7", "replacement": "4"}
+    {"action": "replace", "tag": "008", "pattern": "^(.{35})swe", "replacement": "\\1sv "}
+
+Reglerna för ett fält körs i den ordning de anges. Ett fält som flyttas till en
+annan tagg påverkas inte av reglerna för den nya taggen. En ersättning i en
+indikator ska ge exakt ett tecken, vilket kontrolleras när reglerna kompileras.
+"""
+
+import re
+
+from pymarc import Indicators, Subfield
+
+from libris_import import iso2709
+
+# Samma transformation som tidigare var hårdkodad i custom_transform
+DEFAULT_RULES = [
+    {"action": "remove_field", "tag": "035"},
+    {"action": "remove_subfield", "tag": "830", "code": "9"},
+]
+
+_TAG = re.compile(r"[0-9A-Za-z]{3}")
+# Indikatorer som iso2709 hanterar (se iso2709._INDICATORS)
+_INDICATOR_VALUES = [chr(value) for value in range(0x80) if value != 0x1F]
+
+
+def is_control_tag(tag):
+    """Kontrollfält enligt samma regel som pymarc (numeriska taggar under 010)"""
+    return tag < "010" and tag.isdigit()
+
+
+def is_subfield_code(code):
+    """Delfältskod som kan skrivas på samma sätt av båda vägarna"""
+    return (
+        isinstance(code, str) and len(code) == 1 and code.isascii() and code.isalnum()
+    )
+
+
+class FieldValues:
+    """Ett fält som åtgärderna kan ändra: tagg, indikatorer och delfält, eller
+    data för kontrollfält"""
+
+    __slots__ = ("tag", "indicators", "subfields", "data", "changed")
+
+    def __init__(self, tag, indicators=None, subfields=None, data=None):
+        self.tag = tag
+        self.indicators = indicators
+        self.subfields = subfields
+        self.data = data
+        self.changed = False
+
+    @classmethod
+    def from_raw(cls, tag, data):
+        """Tolka fältdata från iso2709.RawRecord"""
+        if is_control_tag(tag):
+            return cls(tag, data=data.decode("utf-8"))
+        parts = data[2:].split(b"\x1f")
+        return cls(
+            tag,
+            indicators=data[:2].decode("utf-8"),
+            subfields=[
+                [part[:1].decode("ascii"), part[1:].decode("utf-8")]
+                for part in parts[1:]
+            ],
+        )
+
+    def to_raw(self):
+        """Fältdata för iso2709.RawRecord"""
+        if self.data is not None:
+            return self.data.encode("utf-8")
+        return self.indicators.encode("utf-8") + b"".join(
+            b"\x1f" + code.encode("ascii") + value.encode("utf-8")
+            for code, value in self.subfields
+        )
+
+    @classmethod
+    def from_field(cls, field):
+        """Läs ett pymarc-fält"""
+        if field.control_field:
+            return cls(field.tag, data=field.data)
+        return cls(
+            field.tag,
+            indicators=field.indicator1 + field.indicator2,
+            subfields=[[code, value] for code, value in field.subfields],
+        )
+
+    def update_field(self, field):
+        """Skriv tillbaka ändringarna till ett pymarc-fält"""
+        field.tag = self.tag
+        if self.data is not None:
+            field.data = self.data
+        else:
+            field.indicators = Indicators(*self.indicators)
+            field.subfields = [Subfield(code, value) for code, value in self.subfields]
+
+
+def remove_field(_field):
+    """Ta bort hela fältet"""
+    return False
+
+
+def remove_subfield(code):
+    """Ta bort alla delfält med koden"""
+
+    def action(field):
+        if field.subfields is None:
+            return True
+        kept = [subfield for subfield in field.subfields if subfield[0] != code]
+        if len(kept) != len(field.subfields):
+            field.subfields = kept
+            field.changed = True
+        return True
+
+    return action
+
+
+def move_field(to_tag):
+    """Flytta fältet till en annan tagg"""
+
+    def action(field):
+        field.tag = to_tag
+        field.changed = True
+        return True
+
+    return action
+
+
+def move_subfield(code, to_code):
+    """Byt kod på alla delfält med koden"""
+
+    def action(field):
+        for subfield in field.subfields or []:
+            if subfield[0] == code:
+                subfield[0] = to_code
+                field.changed = True
+        return True
+
+    return action
+
+
+def replace_subfield(code, pattern, replacement):
+    """Ersätt med reguljärt uttryck i alla delfält med koden"""
+
+    def action(field):
+        for subfield in field.subfields or []:
+            if subfield[0] == code:
+                value = pattern.sub(replacement, subfield[1])
+                if value != subfield[1]:
+                    subfield[1] = value
+                    field.changed = True
+        return True
+
+    return action
+
+
+def check_indicator_replacement(rule, pattern, replacement):
+    """Kontrollera att ersättningen ger exakt ett tecken för varje indikator"""
+    for value in _INDICATOR_VALUES:
+        try:
+            indicator = pattern.sub(replacement, value)
+        except re.error as e:
+            raise ValueError(f"Ogiltig ersättning i regel {rule}: {e}") from e
+        if len(indicator) != 1:
+            raise ValueError(
+                f"Ersättningen i regel {rule} ger ogiltig indikator {indicator!r} "
+                f"för {value!r}"
+            )
+
+
+def replace_indicator(position, pattern, replacement):
+    """Ersätt med reguljärt uttryck i en indikator (1 eller 2). Ersättningen
+    kontrolleras när regeln kompileras (check_indicator_replacement)."""
+    index = position - 1
+
+    def action(field):
+        if field.indicators is None:
+            return True
+        indicator = pattern.sub(replacement, field.indicators[index])
+        if len(indicator) != 1:
+            raise ValueError(
+                f"Ersättningen ger ogiltig indikator {indicator!r} i fält {field.tag}"
+            )
+        if indicator != field.indicators[index]:
+            indicators = list(field.indicators)
+            indicators[index] = indicator
+            field.indicators = "".join(indicators)
+            field.changed = True
+        return True
+
+    return action
+
+
+def replace_data(pattern, replacement):
+    """Ersätt med reguljärt uttryck i ett kontrollfält"""
+
+    def action(field):
+        if field.data is None:
+            return True
+        data = pattern.sub(replacement, field.data)
+        if data != field.data:
+            field.data = data
+            field.changed = True
+        return True
+
+    return action
+
+
+def compile_action(rule):
+    """Kompilera en regel till en åtgärd för fält med regelns tagg"""
+    action = rule.get("action")
+    tag = rule.get("tag", "")
+    control = is_control_tag(tag)
+    code = rule.get("code")
+    if code is not None and not is_subfield_code(code):
+        raise ValueError(f"Ogiltig delfältskod i regel {rule}")
+
+    if action == "remove_field":
+        return remove_field
+
+    if action == "remove_subfield" and code and not control:
+        return remove_subfield(code)
+
+    if action == "move":
+        to_tag = rule.get("to_tag")
+        to_code = rule.get("to_code")
+        if to_tag and _TAG.fullmatch(to_tag) and is_control_tag(to_tag) == control:
+            return move_field(to_tag)
+        if code and to_code and is_subfield_code(to_code):
+            return move_subfield(code, to_code)
+
+    if action == "replace" and "pattern" in rule:
+        try:
+            pattern = re.compile(rule["pattern"])
+        except re.error as e:
+            raise ValueError(f"Ogiltigt reguljärt uttryck i regel {rule}: {e}") from e
+        replacement = rule.get("replacement", "")
+        if control:
+            return replace_data(pattern, replacement)
+        if code:
+            return replace_subfield(code, pattern, replacement)
+        if rule.get("indicator") in (1, 2):
+            check_indicator_replacement(rule, pattern, replacement)
+            return replace_indicator(rule["indicator"], pattern, replacement)
+
+    raise ValueError(f"Ogiltig regel: {rule}")
+
+
+class TransformRules:
+    """Kompilerade regler: tagg -> åtgärder i den ordning reglerna angavs"""
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        dispatch = {}
+        for rule in self.rules:
+            tag = rule.get("tag")
+            if not isinstance(tag, str) or not _TAG.fullmatch(tag):
+                raise ValueError(f"Ogiltig tagg i regel {rule}")
+            dispatch.setdefault(tag, []).append(compile_action(rule))
+        self.dispatch = {tag: tuple(actions) for tag, actions in dispatch.items()}
+
+    def apply_actions(self, values, actions):
+        """Kör åtgärderna på ett fält. Returnerar False om fältet ska tas bort."""
+        for action in actions:
+            if not action(values):
+                return False
+        return True
+
+    def apply(self, record):
+        """Transformera en post (iso2709.RawRecord eller pymarc.Record) på plats"""
+        if isinstance(record, iso2709.RawRecord):
+            self.apply_raw(record)
+        else:
+            self.apply_pymarc(record)
+        return record
+
+    def apply_raw(self, record):
+        """Transformera en post på bytenivå"""
+        dispatch = self.dispatch
+        fields = []
+        modified = False
+        for tag, data in record.fields:
+            actions = dispatch.get(tag)
+            if actions is None:
+                fields.append((tag, data))
+                continue
+            if actions[0] is remove_field:
+                modified = True
+                continue
+            values = FieldValues.from_raw(tag, data)
+            if not self.apply_actions(values, actions):
+                modified = True
+            elif values.changed:
+                fields.append((values.tag, values.to_raw()))
+                modified = True
+            else:
+                fields.append((tag, data))
+        if modified:
+            record.fields = fields
+            record.modified = True
+
+    def apply_pymarc(self, record):
+        """Transformera en pymarc-post"""
+        dispatch = self.dispatch
+        fields = []
+        for field in record.fields:
+            actions = dispatch.get(field.tag)
+            if actions is None:
+                fields.append(field)
+                continue
+            if actions[0] is remove_field:
+                continue
+            values = FieldValues.from_field(field)
+            if not self.apply_actions(values, actions):
+                continue
+            if values.changed:
+                values.update_field(field)
+            fields.append(field)
+        record.fields = fields
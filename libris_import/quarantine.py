@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+"""
+Karantän för MARC-poster som inte går att läsa.
+
+I stället för att en enda trasig post i exporten från Libris avbryter hela
+körningen kontrolleras varje post snabbt (iso2709.check_record) och ogiltiga
+poster, och data som inte går att dela upp i poster, skrivs till en
+karantänfil. Övriga poster bearbetas som vanligt.
+
+Karantänfilen (JSON Lines, en rad per post) skapas först när den behövs och
+innehåller källfil, position och längd i bytes, orsak och postens data
+(base64-kodad). Utan sökväg räknas posterna bara.
+"""
+
+import base64
+import json
+import logging
+import os
+from collections import Counter
+
+from libris_import import iso2709
+
+
+class Quarantine:
+    """Karantänfil för en körning och räknare per orsak"""
+
+    def __init__(self, path):
+        self.path = path
+        self.counts = Counter()
+        self.source = None
+        self.offset = 0
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def total(self):
+        """Antal poster i karantän"""
+        return sum(self.counts.values())
+
+    def start_source(self, source):
+        """Börja läsa en ny fil eller ström - positionerna räknas från början"""
+        self.source = str(source)
+        self.offset = 0
+
+    def add(self, data, reason, offset=None):
+        """Lägg data i karantän"""
+        offset = self.offset if offset is None else offset
+        self.counts[reason] += 1
+        if self.path is None:
+            return
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.file = open(  # pylint: disable=consider-using-with
+                self.path, "a", encoding="utf-8"
+            )
+        self.file.write(
+            json.dumps(
+                {
+                    "source": self.source,
+                    "offset": offset,
+                    "length": len(data),
+                    "reason": reason,
+                    "record": base64.b64encode(data).decode("ascii"),
+                },
+                ensure_ascii=False,
+            )
+            + "\n"
+        )
+        logging.warning(
+            "Lade post i karantän (%s, position %s i %s)", reason, offset, self.source
+        )
+
+    def add_unreadable(self, data, reason):
+        """Lägg data som inte kunde delas upp i poster i karantän (on_invalid i
+        iso2709.split_raw_records)"""
+        self.add(data, reason)
+        self.offset += len(data)
+
+    def filter(self, raw_records):
+        """Ge giltiga poster och lägg ogiltiga i karantän"""
+        for raw_record in raw_records:
+            reason = iso2709.check_record(raw_record)
+            if reason:
+                self.add(raw_record, reason)
+            else:
+                yield raw_record
+            self.offset += len(raw_record)
+
+    def read_raw_records(self, file_path):
+        """Läs giltiga poster från en fil och lägg ogiltiga i karantän"""
+        self.start_source(file_path)
+        yield from self.filter(
+            iso2709.read_raw_records(file_path, on_invalid=self.add_unreadable)
+        )
+
+    def split_raw_records(self, blocks, source):
+        """Dela upp en ström i giltiga poster och lägg ogiltiga i karantän"""
+        self.start_source(source)
+        yield from self.filter(
+            iso2709.split_raw_records(blocks, on_invalid=self.add_unreadable)
+        )
+
+    def log(self):
+        """Logga antal poster i karantän per orsak"""
+        if not self.counts:
+            return
+        logging.warning(
+            "%s poster lades i karantän (%s): %s",
+            self.total,
+            ", ".join(f"{reason}: {count}" for reason, count in self.counts.items()),
+            self.path,
+        )
+
+    def close(self):
+        """Stäng karantänfilen"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -15,6 +15,7 @@ setup(
     license="MIT license",
     packages=[
         "automatic_renewals",
+        "benchmarks",
         "libris_import",
         "utils",
     ],
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+"""Låtsas-Folio för tester av data-import: upload definitions, uppladdning av
+filer, processFiles och radering. Inget går över nätverket."""
+
+import itertools
+import threading
+import time
+
+import httpx
+
+UPLOAD_DEFINITIONS_PATH = "/data-import/uploadDefinitions"
+
+
+class StubHttpClient:
+    """Tar emot filuppladdningar som utils.post_binary skickar via folio.client"""
+
+    def __init__(self, folio):
+        self.folio = folio
+
+    def post(self, url, content=None, **_):
+        return self.folio.receive_file(url, content)
+
+
+class StubFolio:
+    """Håller upload definitions i minnet och räknar anropen.
+
+    fail_upload: namn på filer vars uppladdning ger 500
+    upload_delay: sekunder varje uppladdning tar
+    gate: threading.Event som uppladdningarna väntar på innan de blir klara
+    """
+
+    _base_url = "http://folio.invalid"
+    _tenant = "test"
+    timeout = 5
+
+    def __init__(self, fail_upload=(), upload_delay=0.0, gate=None):
+        self.client = StubHttpClient(self)
+        self.fail_upload = set(fail_upload)
+        self.upload_delay = upload_delay
+        self.gate = gate
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        # id -> {"id", "fileDefinitions": [{"id", "name", "content"}]}
+        self.upload_definitions = {}
+        self.deleted = []
+        self.processed = []
+        self.uploads = 0
+        self.running_uploads = 0
+        self.max_running_uploads = 0
+
+    def _manage_token(self):
+        pass
+
+    def new_id(self, prefix):
+        """Nästa id"""
+        with self.lock:
+            return f"{prefix}{next(self.ids)}"
+
+    def file_definition(self, name):
+        """En ny file definition"""
+        return {"id": self.new_id("f"), "name": name, "content": None}
+
+    def post_data(self, path, payload=None):
+        """Skapa upload definitions och file definitions, initiera importer"""
+        parts = path.split("/")
+        if path == UPLOAD_DEFINITIONS_PATH:
+            upload_definition = {
+                "id": self.new_id("u"),
+                "fileDefinitions": [
+                    self.file_definition(file_definition["name"])
+                    for file_definition in payload["fileDefinitions"]
+                ],
+            }
+            with self.lock:
+                self.upload_definitions[upload_definition["id"]] = upload_definition
+            return upload_definition
+        if len(parts) == 5 and parts[4] == "files":
+            upload_definition = self.upload_definitions[parts[3]]
+            file_definition = self.file_definition(payload["name"])
+            with self.lock:
+                upload_definition["fileDefinitions"].append(file_definition)
+            return upload_definition
+        if len(parts) == 5 and parts[4] == "processFiles":
+            self.processed.append(parts[3])
+            return {}
+        raise RuntimeError(f"Okänt anrop {path}")
+
+    def get_data(self, path, key="", params=None, cql_query="", limit=10):
+        """Hämta en upload definition"""
+        # pylint: disable=unused-argument
+        upload_definition_id = path.rsplit("/", 1)[-1]
+        if upload_definition_id not in self.upload_definitions:
+            raise RuntimeError(f"Okänd upload definition {upload_definition_id}")
+        return self.upload_definitions[upload_definition_id]
+
+    def delete_data(self, path):
+        """Radera en upload definition"""
+        upload_definition_id = path.rsplit("/", 1)[-1]
+        with self.lock:
+            self.deleted.append(upload_definition_id)
+            self.upload_definitions.pop(upload_definition_id, None)
+        return 204
+
+    def receive_file(self, url, content):
+        """Ta emot innehållet för en file definition"""
+        _, upload_definition_id, _, file_definition_id = url.rsplit("/", 3)
+        with self.lock:
+            self.uploads += 1
+            self.running_uploads += 1
+            self.max_running_uploads = max(
+                self.max_running_uploads, self.running_uploads
+            )
+        try:
+            time.sleep(self.upload_delay)
+            if self.gate is not None:
+                self.gate.wait()
+            data = content if isinstance(content, bytes) else content.read()
+            upload_definition = self.upload_definitions[upload_definition_id]
+            for file_definition in upload_definition["fileDefinitions"]:
+                if file_definition["id"] == file_definition_id:
+                    if file_definition["name"] in self.fail_upload:
+                        return response(url, 500)
+                    file_definition["content"] = data
+                    return response(url, 200)
+            return response(url, 404)
+        finally:
+            with self.lock:
+                self.running_uploads -= 1
+
+    def uploaded_files(self):
+        """Namn och innehåll för alla uppladdade filer som inte raderats"""
+        return {
+            file_definition["name"]: file_definition["content"]
+            for upload_definition in self.upload_definitions.values()
+            for file_definition in upload_definition["fileDefinitions"]
+            if file_definition["content"] is not None
+        }
+
+
+def response(url, status_code):
+    """Ett HTTP-svar utan innehåll"""
+    return httpx.Response(status_code, request=httpx.Request("POST", url))
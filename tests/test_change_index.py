@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+"""Tester för ChangeIndex"""
+
+from libris_import.change_index import ChangeIndex
+
+
+def test_unchanged_after_commit(tmp_path):
+    path = tmp_path / "index.sqlite"
+    with ChangeIndex(path) as index:
+        assert not index.is_unchanged("1", b"post 1")
+        index.commit()
+
+    with ChangeIndex(path) as index:
+        assert index.is_unchanged("1", b"post 1")
+        assert not index.is_unchanged("1", b"post 1, ny version")
+        assert index.skipped == 1
+
+
+def test_pending_kept_when_interrupted_run_is_resumed(tmp_path):
+    path = tmp_path / "index.sqlite"
+    # Första körningen avbryts efter uppdelningen, innan importen är klar
+    index = ChangeIndex(path)
+    assert not index.is_unchanged("1", b"post 1")
+    assert not index.is_unchanged("2", b"post 2")
+    index.save_pending()
+    index.connection.close()
+
+    # Den återupptagna körningen importerar chunks från förra körningen
+    with ChangeIndex(path, keep_pending=True) as index:
+        index.commit()
+
+    with ChangeIndex(path) as index:
+        assert index.is_unchanged("1", b"post 1")
+        assert index.is_unchanged("2", b"post 2")
+
+
+def test_pending_kept_when_closed_before_import(tmp_path):
+    path = tmp_path / "index.sqlite"
+    with ChangeIndex(path) as index:
+        assert not index.is_unchanged("1", b"post 1")
+
+    with ChangeIndex(path, keep_pending=True) as index:
+        index.commit()
+
+    with ChangeIndex(path) as index:
+        assert index.is_unchanged("1", b"post 1")
+
+
+def test_pending_discarded_when_run_is_not_resumed(tmp_path):
+    path = tmp_path / "index.sqlite"
+    with ChangeIndex(path) as index:
+        assert not index.is_unchanged("1", b"post 1")
+
+    with ChangeIndex(path) as index:
+        index.commit()
+        assert not index.is_unchanged("1", b"post 1")
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""Tester för checkpoint för körningar som kan återupptas"""
+
+import json
+
+from libris_import.checkpoint import MAX_ATTEMPTS, Checkpoint
+
+FROM = "2026-01-01T00:00:00Z"
+UNTIL = "2026-01-02T00:00:00Z"
+
+
+def save_checkpoint(tmp_path, **changes):
+    """Spara ett manifest från en tidigare körning som laddat ned exporten"""
+    (tmp_path / "export.mrc").write_bytes(b"")
+    data = {
+        "from": FROM,
+        "until": UNTIL,
+        "attempts": 1,
+        "downloaded": True,
+        "export_file": "export.mrc",
+        "chunked": False,
+        "upload_definition_id": None,
+        "uploaded": [],
+        "imports": [],
+        "imported": [],
+        "submitted": False,
+    }
+    data.update(changes)
+    path = tmp_path / "resume.json"
+    path.write_text(json.dumps(data), encoding="utf-8")
+    return path
+
+
+def test_new_checkpoint_without_earlier_run(tmp_path):
+    checkpoint = Checkpoint.load(tmp_path / "resume.json", FROM, UNTIL)
+
+    assert not checkpoint.resumed
+    assert not checkpoint.downloaded
+    assert checkpoint.until == UNTIL
+
+
+def test_resumes_same_window(tmp_path):
+    path = save_checkpoint(tmp_path, chunked=True, uploaded=["chunk_1.mrc"])
+
+    checkpoint = Checkpoint.load(path, FROM, "2026-01-03T00:00:00Z")
+
+    assert checkpoint.resumed
+    assert checkpoint.attempts == 2
+    # Tidsfönstret är det som redan hämtats, inte fram till nu
+    assert checkpoint.until == UNTIL
+    assert checkpoint.chunked
+    assert checkpoint.uploaded == {"chunk_1.mrc"}
+    assert json.loads(path.read_text(encoding="utf-8"))["attempts"] == 2
+
+
+def test_discarded_for_other_window(tmp_path):
+    path = save_checkpoint(tmp_path)
+
+    assert not Checkpoint.load(path, UNTIL, "2026-01-03T00:00:00Z").resumed
+
+
+def test_discarded_without_export(tmp_path):
+    path = save_checkpoint(tmp_path)
+    (tmp_path / "export.mrc").unlink()
+
+    assert not Checkpoint.load(path, FROM, UNTIL).resumed
+
+
+def test_discarded_before_download(tmp_path):
+    path = save_checkpoint(tmp_path, downloaded=False)
+
+    assert not Checkpoint.load(path, FROM, UNTIL).resumed
+
+
+def test_discarded_after_max_attempts(tmp_path):
+    path = save_checkpoint(tmp_path, attempts=MAX_ATTEMPTS - 1)
+    assert Checkpoint.load(path, FROM, UNTIL).attempts == MAX_ATTEMPTS
+
+    checkpoint = Checkpoint.load(path, FROM, "2026-01-03T00:00:00Z")
+
+    assert not checkpoint.resumed
+    assert not checkpoint.downloaded
+    assert checkpoint.until == "2026-01-03T00:00:00Z"
+
+
+def test_discarded_when_unreadable(tmp_path):
+    path = tmp_path / "resume.json"
+    path.write_text("{", encoding="utf-8")
+
+    assert not Checkpoint.load(path, FROM, UNTIL).resumed
+
+
+def test_mark_imported_starts_next_upload_definition(tmp_path):
+    path = save_checkpoint(tmp_path)
+    checkpoint = Checkpoint.load(path, FROM, UNTIL)
+    checkpoint.update(upload_definition_id="u1", uploaded=[])
+    checkpoint.mark_uploaded("chunk_1.mrc")
+    checkpoint.mark_uploaded("chunk_2.mrc")
+
+    checkpoint.mark_imported("u1", ["chunk_1.mrc", "chunk_2.mrc"])
+
+    saved = Checkpoint.load(path, FROM, UNTIL)
+    assert saved.imports == ["u1"]
+    assert saved.imported == {"chunk_1.mrc", "chunk_2.mrc"}
+    assert saved.upload_definition_id is None
+    assert not saved.uploaded
+
+
+def test_remove(tmp_path):
+    path = save_checkpoint(tmp_path)
+    checkpoint = Checkpoint.load(path, FROM, UNTIL)
+
+    checkpoint.remove()
+    checkpoint.remove()
+
+    assert not path.exists()
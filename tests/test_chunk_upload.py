@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+"""Tester för ChunkUploader mot en låtsas-Folio"""
+
+import io
+import threading
+
+import pytest
+
+from libris_import.chunk_upload import ChunkUploader
+from tests.folio_stub import StubFolio
+
+
+def test_concurrency_limits_running_uploads():
+    folio = StubFolio(upload_delay=0.02)
+    with ChunkUploader(folio, concurrency=2) as uploader:
+        for number in range(8):
+            uploader.add(f"chunk_{number}.mrc", b"data", 1)
+        upload_definitions = uploader.finish()
+
+    assert folio.uploads == 8
+    assert folio.max_running_uploads == 2
+    assert len(upload_definitions) == 1
+    assert sorted(uploader.uploaded) == [f"chunk_{number}.mrc" for number in range(8)]
+
+
+def test_add_waits_while_all_uploads_are_running():
+    gate = threading.Event()
+    folio = StubFolio(gate=gate)
+    with ChunkUploader(folio, concurrency=2) as uploader:
+        uploader.add("chunk_0.mrc", b"data", 1)
+        uploader.add("chunk_1.mrc", b"data", 1)
+
+        # Uppdelningen väntar på en ledig plats innan nästa chunk tas emot
+        splitter = threading.Thread(
+            target=uploader.add, args=("chunk_2.mrc", b"data", 1)
+        )
+        splitter.start()
+        splitter.join(timeout=0.2)
+        assert splitter.is_alive()
+        assert folio.uploads == 2
+
+        gate.set()
+        splitter.join(timeout=5)
+        assert not splitter.is_alive()
+        uploader.finish()
+
+    assert folio.uploads == 3
+
+
+def test_no_uploads_after_first_failure(tmp_path):
+    gate = threading.Event()
+    folio = StubFolio(fail_upload={"chunk_0.mrc"}, gate=gate)
+    with ChunkUploader(folio, concurrency=2, spill_dir=tmp_path) as uploader:
+        uploader.add("chunk_0.mrc", b"data 0", 1)
+        uploader.add("chunk_1.mrc", b"data 1", 1)
+        gate.set()
+        uploader.close()
+        # chunk_0 misslyckades, så resten laddas inte upp
+        uploader.add("chunk_2.mrc", b"data 2", 1)
+        uploader.add("chunk_3.mrc", b"data 3", 1)
+        with pytest.raises(RuntimeError):
+            uploader.finish()
+
+    assert folio.uploads == 2
+    assert uploader.uploaded == ["chunk_1.mrc"]
+    # Uppdelningen fortsätter och skriver alla filer
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        f"chunk_{number}.mrc" for number in range(4)
+    ]
+
+
+def test_spill_dir_gets_every_chunk(tmp_path):
+    folio = StubFolio()
+    spill_dir = tmp_path / "chunks"
+    content = io.BytesIO(b"data 1")
+    with ChunkUploader(folio, spill_dir=spill_dir) as uploader:
+        uploader.add("chunk_0.mrc", b"data 0", 1)
+        uploader.add("chunk_1.mrc", content, 1)
+        uploader.finish()
+
+    assert (spill_dir / "chunk_0.mrc").read_bytes() == b"data 0"
+    assert (spill_dir / "chunk_1.mrc").read_bytes() == b"data 1"
+    assert content.closed
+    assert folio.uploaded_files() == {
+        "chunk_0.mrc": b"data 0",
+        "chunk_1.mrc": b"data 1",
+    }
+
+
+def test_delete_upload_definitions():
+    folio = StubFolio()
+    with ChunkUploader(folio, chunks_per_import=2) as uploader:
+        for number in range(5):
+            uploader.add(f"chunk_{number}.mrc", b"data", 1)
+        upload_definitions = uploader.finish()
+        assert [file_names for _, file_names in upload_definitions] == [
+            ["chunk_0.mrc", "chunk_1.mrc"],
+            ["chunk_2.mrc", "chunk_3.mrc"],
+            ["chunk_4.mrc"],
+        ]
+
+        unused = [
+            upload_definition_id for upload_definition_id, _ in upload_definitions
+        ]
+        uploader.delete_upload_definitions(unused[1:])
+
+    assert folio.deleted == unused[1:]
+    assert list(folio.upload_definitions) == unused[:1]
+
+
+def test_unfinished_uploader_deletes_upload_definitions():
+    folio = StubFolio()
+    with pytest.raises(ValueError):
+        with ChunkUploader(folio, chunks_per_import=1) as uploader:
+            uploader.add("chunk_0.mrc", b"data", 1)
+            uploader.add("chunk_1.mrc", b"data", 1)
+            raise ValueError("fel vid uppdelningen")
+
+    assert len(folio.deleted) == 2
+    assert not folio.upload_definitions
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+"""Tester för indexet över posternas position i en export"""
+
+import sqlite3
+
+import pytest
+
+from libris_import import export_archive, iso2709
+
+
+def make_record(libris_id):
+    """En minimal MARC-post med fält 001"""
+    return iso2709.build_record(
+        b"00000nam a2200000 i 4500",
+        [("001", libris_id.encode("ascii")), ("245", b"10\x1faTitel")],
+    )
+
+
+def test_index_skips_unreadable_data(tmp_path):
+    records = [make_record(libris_id) for libris_id in ("1", "2", "3")]
+    broken = b"00100" + b"x" * 20 + b"\x1d"
+    export_path = tmp_path / "export.mrc"
+    export_path.write_bytes(records[0] + broken + records[1] + records[2][:-3])
+
+    assert export_archive.build_offset_index(export_path) == 2
+
+    index_path = export_archive.index_path_for(export_path)
+    with export_archive.OffsetIndex(index_path) as index:
+        ranges = list(index.ranges())
+        assert index.lookup("2") == [ranges[1]]
+    assert list(export_archive.read_records(export_path, ranges)) == records[:2]
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "export.mrc",
+        "export.mrc.idx.sqlite",
+    ]
+
+
+def test_failed_index_is_removed(tmp_path, monkeypatch):
+    export_path = tmp_path / "export.mrc"
+    export_path.write_bytes(make_record("1"))
+
+    def fail(*_):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(export_archive, "read_control_field", fail)
+    with pytest.raises(sqlite3.OperationalError):
+        export_archive.build_offset_index(export_path)
+    assert [path.name for path in tmp_path.iterdir()] == ["export.mrc"]
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""Tester för uppföljning av importjobb"""
+
+import pytest
+
+from libris_import import import_monitor
+from libris_import.import_monitor import JobResult
+
+
+@pytest.fixture(name="clock")
+def fixture_clock(monkeypatch):
+    """Låtsasklocka som flyttas fram av time.sleep i import_monitor"""
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    monkeypatch.setattr(import_monitor.time, "sleep", sleep)
+    monkeypatch.setattr(import_monitor.time, "monotonic", lambda: now[0])
+    return now
+
+
+def complete(_, job):
+    job.status = import_monitor.SUCCESS_STATUS
+    job.records = 10
+    return True
+
+
+def test_waits_until_folio_has_created_the_jobs(clock, monkeypatch):
+    responses = [[], [], [JobResult("j1", "a.mrc"), JobResult("j2", "b.mrc")]]
+    monkeypatch.setattr(import_monitor, "get_jobs", lambda folio, _: responses.pop(0))
+    monkeypatch.setattr(import_monitor, "update_job", complete)
+
+    report = import_monitor.wait_for_import(None, "u1", timeout=600)
+
+    assert not responses
+    assert report.succeeded
+    assert [job.job_id for job in report.jobs] == ["j1", "j2"]
+    assert report.records == 20
+    assert clock[0] > 0
+
+
+def test_no_jobs_within_timeout_fails(clock, monkeypatch):
+    monkeypatch.setattr(import_monitor, "get_jobs", lambda folio, _: [])
+    monkeypatch.setattr(import_monitor, "update_job", complete)
+
+    report = import_monitor.wait_for_import(None, "u1", timeout=600)
+
+    assert report.timed_out
+    assert not report.succeeded
+    assert clock[0] <= 600
+
+
+def test_failed_job_fails_report(clock, monkeypatch):
+    monkeypatch.setattr(
+        import_monitor, "get_jobs", lambda folio, _: [JobResult("j1", "a.mrc")]
+    )
+
+    def fail(_, job):
+        job.status = "ERROR"
+        job.errors = 1
+        return True
+
+    monkeypatch.setattr(import_monitor, "update_job", fail)
+
+    report = import_monitor.wait_for_import(None, "u1", timeout=600)
+
+    assert not report.timed_out
+    assert not report.succeeded
+    assert report.failed_jobs == report.jobs
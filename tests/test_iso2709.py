@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+"""Tester för uppdelning av MARC-data i poster"""
+
+import pytest
+
+from libris_import import iso2709
+
+
+def make_record(body, length=None):
+    """Post med postlängd i början och postavslut (postlängden kan anges fel)"""
+    length = len(body) + 6 if length is None else length
+    return b"%05d" % length + body + b"\x1d"
+
+
+def split(data, block_size=7):
+    """Dela upp data i block och samla poster och data i karantän"""
+    invalid = []
+    blocks = [data[i : i + block_size] for i in range(0, len(data), block_size)]
+    records = list(
+        iso2709.split_raw_records(
+            blocks, on_invalid=lambda data, reason: invalid.append((data, reason))
+        )
+    )
+    return records, invalid
+
+
+def test_split_records_across_blocks():
+    records = [make_record(b"a" * 30), make_record(b"b" * 3), make_record(b"c" * 50)]
+    assert split(b"".join(records)) == (records, [])
+
+
+@pytest.mark.parametrize("declared", [20, 60])
+def test_wrong_record_length_resyncs_at_next_end_of_record(declared):
+    bad = make_record(b"x" * 30, length=declared)
+    good = [make_record(b"a" * 40), make_record(b"b" * 20)]
+
+    records, invalid = split(good[0] + bad + good[1])
+
+    assert records == good
+    assert invalid == [(bad, "postavslut saknas")]
+
+
+def test_invalid_record_length_resyncs_at_next_end_of_record():
+    bad = b"abcde" + b"x" * 10 + b"\x1d"
+    good = make_record(b"a" * 10)
+
+    assert split(bad + good) == ([good], [(bad, "ogiltig postlängd")])
+
+
+def test_incomplete_record_at_end():
+    good = make_record(b"a" * 10)
+    incomplete = make_record(b"b" * 10)[:-4]
+
+    assert split(good + incomplete) == ([good], [(incomplete, "ofullständig post")])
+
+
+def test_strict_mode_raises_on_invalid_record_length():
+    with pytest.raises(RuntimeError):
+        list(iso2709.split_raw_records([b"abcde" + b"x" * 10 + b"\x1d"]))
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+
+"""Tester för en körning av libris_to_folio.main mot en låtsas-Folio"""
+
+import json
+import os
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+from libris_import import iso2709, libris_to_folio, marc_rules
+from libris_import.checkpoint import MAX_ATTEMPTS
+from tests.folio_stub import StubFolio
+from utils import utils
+
+LAST_RUN = "2026-01-01T00:00:00Z"
+UNTIL = "2026-01-02T00:00:00Z"
+
+
+def make_record(libris_id):
+    """En minimal MARC-post med fält 001"""
+    return iso2709.build_record(
+        b"00000nam a2200000 i 4500",
+        [("001", libris_id.encode("ascii")), ("245", b"10\x1faTitel")],
+    )
+
+
+@pytest.fixture(name="run")
+def fixture_run(tmp_path, monkeypatch):
+    """Miljö för main(): mappar, config.json och en inloggad låtsas-Folio"""
+    monkeypatch.chdir(tmp_path)
+    base_folder = tmp_path / "libris"
+    base_folder.mkdir()
+    monkeypatch.setenv("LIBRIS_BASE_FOLDER", str(base_folder))
+    monkeypatch.setenv("LIBRIS_CHUNKS_FOLDER", "chunks")
+    monkeypatch.setenv("LIBRIS_JOBPROFILE", "jobprofil")
+    (tmp_path / "config.json").write_text(
+        json.dumps(
+            {
+                "libris_import": {
+                    "chunk_size": 2,
+                    "max_running_jobs": 0,
+                    "archive_exports": False,
+                }
+            }
+        ),
+        encoding="utf-8",
+    )
+    folio = StubFolio()
+
+    @contextmanager
+    def folio_session(_):
+        yield folio
+
+    monkeypatch.setattr(utils, "load_env", lambda: SimpleNamespace(mode="prod"))
+    monkeypatch.setattr(utils, "folio_session", folio_session)
+    monkeypatch.setattr(libris_to_folio, "_TRANSFORM_RULES", None)
+    (base_folder / "lastRun.timestamp").write_text(LAST_RUN, encoding="utf-8")
+
+    # Importjobben följs upp av en låtsas-monitor som svarar i tur och ordning
+    monitored = []
+    monitor_results = []
+
+    def monitor_import(_, upload_definition_id, initial_delay=0):
+        # pylint: disable=unused-argument
+        monitored.append(upload_definition_id)
+        return monitor_results.pop(0) if monitor_results else True
+
+    monkeypatch.setattr(libris_to_folio, "monitor_import", monitor_import)
+    return SimpleNamespace(
+        folio=folio,
+        base_folder=base_folder,
+        chunks_folder=base_folder / "chunks",
+        monitored=monitored,
+        monitor_results=monitor_results,
+    )
+
+
+def save_checkpoint(run, records, chunks=(), **changes):
+    """Spara exporten, chunks och manifestet från en tidigare misslyckad körning"""
+    (run.base_folder / "export_old.mrc").write_bytes(b"".join(records))
+    run.chunks_folder.mkdir(exist_ok=True)
+    for number, chunk in enumerate(chunks, 1):
+        (run.chunks_folder / f"chunk_{number}.mrc").write_bytes(chunk)
+    data = {
+        "from": LAST_RUN,
+        "until": UNTIL,
+        "attempts": 1,
+        "downloaded": True,
+        "export_file": "export_old.mrc",
+        "chunked": False,
+        "upload_definition_id": None,
+        "uploaded": [],
+        "imports": [],
+        "imported": [],
+        "submitted": False,
+    }
+    data.update(changes)
+    utils.save_json_file(run.base_folder / libris_to_folio.CHECKPOINT_FILENAME, data)
+
+
+def no_stream(*_):
+    """stream_libris_data för återupptagna körningar, som inte ska hämta något"""
+    raise AssertionError("Libris ska inte anropas")
+
+
+def assert_completed(run):
+    """Körningen blev klar: tidsfönstret från checkpoint sparat, inget kvar"""
+    last_run = (run.base_folder / "lastRun.timestamp").read_text(encoding="utf-8")
+    assert last_run == UNTIL
+    assert not (run.base_folder / libris_to_folio.CHECKPOINT_FILENAME).exists()
+    assert not list(run.base_folder.glob("*.mrc"))
+    assert not list(run.chunks_folder.glob("*.mrc"))
+
+
+def stream(records, error=None):
+    """Ersättning för stream_libris_data som skriver exporten och ger posterna
+    block för block, och till sist lyfter error"""
+
+    def stream_libris_data(_, __, export_path, ___=None):
+        with open(export_path, "wb") as fh:
+            for record in records:
+                fh.write(record)
+                yield record
+        if error is not None:
+            raise error
+
+    return stream_libris_data
+
+
+@pytest.mark.parametrize(
+    "error", [libris_to_folio.LibrisFetchError("nere"), ValueError("trasig regel")]
+)
+def test_failed_stream_deletes_upload_definitions(run, monkeypatch, error):
+    records = [make_record(str(number)) for number in range(1, 8)]
+    monkeypatch.setattr(libris_to_folio, "stream_libris_data", stream(records, error))
+
+    if isinstance(error, libris_to_folio.LibrisFetchError):
+        assert libris_to_folio.main() is False
+    else:
+        with pytest.raises(ValueError):
+            libris_to_folio.main()
+
+    assert run.folio.uploads == 3
+    assert run.folio.deleted
+    assert not run.folio.upload_definitions
+    assert not run.folio.processed
+
+
+def test_resume_after_download_splits_saved_export(run, monkeypatch):
+    records = [make_record(str(number)) for number in range(1, 6)]
+    save_checkpoint(run, records)
+    monkeypatch.setattr(libris_to_folio, "stream_libris_data", no_stream)
+
+    assert libris_to_folio.main() is True
+
+    assert run.folio.uploads == 3
+    assert b"".join(run.folio.uploaded_files().values()) == b"".join(records)
+    assert run.monitored == run.folio.processed
+    assert_completed(run)
+
+
+def test_resume_after_split_uploads_saved_chunks(run, monkeypatch):
+    records = [make_record(str(number)) for number in range(1, 4)]
+    save_checkpoint(run, records, chunks=records, chunked=True)
+    monkeypatch.setattr(libris_to_folio, "stream_libris_data", no_stream)
+
+    assert libris_to_folio.main() is True
+
+    assert run.folio.uploaded_files() == {
+        f"chunk_{number}.mrc": record for number, record in enumerate(records, 1)
+    }
+    assert len(run.folio.processed) == 1
+    assert_completed(run)
+
+
+def test_resume_partial_upload_skips_uploaded_chunks(run, monkeypatch):
+    records = [make_record(str(number)) for number in range(1, 4)]
+    upload_definition = run.folio.post_data(
+        "/data-import/uploadDefinitions",
+        payload={
+            "fileDefinitions": [
+                {"name": f"chunk_{number}.mrc"} for number in range(1, 4)
+            ]
+        },
+    )
+    upload_definition["fileDefinitions"][0]["content"] = records[0]
+    save_checkpoint(
+        run,
+        records,
+        chunks=records,
+        chunked=True,
+        upload_definition_id=upload_definition["id"],
+        uploaded=["chunk_1.mrc"],
+    )
+    monkeypatch.setattr(libris_to_folio, "stream_libris_data", no_stream)
+
+    assert libris_to_folio.main() is True
+
+    # Samma upload definition används och bara de återstående chunks laddas upp
+    assert run.folio.uploads == 2
+    assert run.folio.processed == [upload_definition["id"]]
+    assert len(run.folio.uploaded_files()) == 3
+    assert_completed(run)
+
+
+@pytest.mark.parametrize("previous_import_succeeded", [True, False])
+def test_resume_initiated_import(run, monkeypatch, previous_import_succeeded):
+    records = [make_record(str(number)) for number in range(1, 3)]
+    save_checkpoint(
+        run,
+        records,
+        chunks=records,
+        chunked=True,
+        imports=["u99"],
+        imported=["chunk_1.mrc", "chunk_2.mrc"],
+        submitted=True,
+    )
+    monkeypatch.setattr(libris_to_folio, "stream_libris_data", no_stream)
+    run.monitor_results.append(previous_import_succeeded)
+
+    assert libris_to_folio.main() is True
+
+    assert run.monitored[0] == "u99"
+    if previous_import_succeeded:
+        # Jobben från förra körningen följs bara upp
+        assert run.folio.uploads == 0
+        assert not run.folio.processed
+    else:
+        # Importen görs om från de sparade chunks
+        assert run.folio.uploads == 2
+        assert run.monitored[1:] == run.folio.processed
+    assert_completed(run)
+
+
+def test_checkpoint_reset_after_max_attempts(run, monkeypatch):
+    old_records = [make_record("gammal")]
+    save_checkpoint(
+        run, old_records, chunks=old_records, chunked=True, attempts=MAX_ATTEMPTS
+    )
+    records = [make_record(str(number)) for number in range(1, 4)]
+    fetched = []
+
+    def stream_libris_data(last_run_timestamp, _, export_path, __=None):
+        fetched.append(last_run_timestamp)
+        yield from stream(records)(last_run_timestamp, _, export_path)
+
+    monkeypatch.setattr(libris_to_folio, "stream_libris_data", stream_libris_data)
+
+    assert libris_to_folio.main() is True
+
+    # Exporten och chunks från den gamla körningen kastas och allt hämtas på nytt
+    assert fetched == [LAST_RUN]
+    assert b"".join(run.folio.uploaded_files().values()) == b"".join(records)
+    last_run = (run.base_folder / "lastRun.timestamp").read_text(encoding="utf-8")
+    assert last_run == libris_to_folio.CURRENT_UTC_TIMESTAMP
+    assert not (run.base_folder / libris_to_folio.CHECKPOINT_FILENAME).exists()
+    assert not os.listdir(run.chunks_folder)
+
+
+def test_parallel_transform_matches_serial(run, monkeypatch):
+    # pylint: disable=unused-argument
+    monkeypatch.setattr(libris_to_folio, "TRANSFORM_BATCH_SIZE", 2)
+    # Regler som bara finns i huvudprocessen, inte i config.json
+    monkeypatch.setattr(
+        libris_to_folio,
+        "_TRANSFORM_RULES",
+        marc_rules.TransformRules([{"action": "remove_field", "tag": "245"}]),
+    )
+    records = [make_record(str(number)) for number in (1, 2, 3, 2, 4, 5, 1)]
+
+    parallel = list(libris_to_folio.transform_unique_records_parallel(records, 2))
+    serial = [
+        (libris_id, record.as_marc())
+        for libris_id, record in libris_to_folio.transform_unique_records(
+            map(libris_to_folio.parse_marc_record, records)
+        )
+    ]
+
+    assert parallel == serial
+    assert [libris_id for libris_id, _ in parallel] == ["1", "2", "3", "4", "5"]
+    assert all(b"Titel" not in marc for _, marc in parallel)
+
+
+def test_upload_concurrency_from_config(run, monkeypatch):
+    config = json.loads((run.base_folder.parent / "config.json").read_text("utf-8"))
+    config["libris_import"]["upload_concurrency"] = 1
+    (run.base_folder.parent / "config.json").write_text(
+        json.dumps(config), encoding="utf-8"
+    )
+    run.folio.upload_delay = 0.01
+    records = [make_record(str(number)) for number in range(1, 8)]
+    monkeypatch.setattr(libris_to_folio, "stream_libris_data", stream(records))
+
+    assert libris_to_folio.main() is True
+
+    assert run.folio.uploads == 4
+    assert run.folio.max_running_uploads == 1
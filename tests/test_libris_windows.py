@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+"""Tester för uppdelningen av tidsfönster mot Libris"""
+
+from libris_import.libris_to_folio import split_libris_window
+
+
+def test_nightly_window_slightly_over_limit_is_not_split():
+    assert split_libris_window("2026-10-15T02:00:00Z", "2026-10-16T02:00:04Z", 24) == [
+        ("2026-10-15T02:00:00Z", "2026-10-16T02:00:04Z")
+    ]
+
+
+def test_window_up_to_one_and_a_half_limits_is_not_split():
+    assert split_libris_window("2026-10-15T00:00:00Z", "2026-10-16T12:00:00Z", 24) == [
+        ("2026-10-15T00:00:00Z", "2026-10-16T12:00:00Z")
+    ]
+
+
+def test_long_window_is_split_and_short_tail_merged():
+    assert split_libris_window("2026-10-12T00:00:00Z", "2026-10-15T06:00:00Z", 24) == [
+        ("2026-10-12T00:00:00Z", "2026-10-13T00:00:00Z"),
+        ("2026-10-13T00:00:00Z", "2026-10-14T00:00:00Z"),
+        ("2026-10-14T00:00:00Z", "2026-10-15T06:00:00Z"),
+    ]
+
+
+def test_long_tail_gets_its_own_window():
+    assert split_libris_window("2026-10-14T00:00:00Z", "2026-10-15T13:00:00Z", 24) == [
+        ("2026-10-14T00:00:00Z", "2026-10-15T00:00:00Z"),
+        ("2026-10-15T00:00:00Z", "2026-10-15T13:00:00Z"),
+    ]
+
+
+def test_no_split_without_limit():
+    assert split_libris_window("2026-10-01T00:00:00Z", "2026-10-15T00:00:00Z", 0) == [
+        ("2026-10-01T00:00:00Z", "2026-10-15T00:00:00Z")
+    ]
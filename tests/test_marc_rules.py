@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""Tester för regelstyrd transformation av MARC-poster"""
+
+import pytest
+from pymarc import Record
+
+from libris_import import iso2709
+from libris_import.marc_rules import TransformRules
+
+RULES = [
+    {"action": "remove_field", "tag": "035"},
+    {"action": "move", "tag": "500", "to_tag": "590"},
+    {"action": "move", "tag": "830", "code": "9", "to_code": "x"},
+    {
+        "action": "replace",
+        "tag": "245",
+        "code": "a",
+        "pattern": " /$",
+        "replacement": "",
+    },
+    {
+        "action": "replace",
+        "tag": "650",
+        "indicator": 2,
+        "pattern": "7",
+        "replacement": "4",
+    },
+    {
+        "action": "replace",
+        "tag": "008",
+        "pattern": "^(.{35})swe",
+        "replacement": r"\1sv ",
+    },
+]
+
+
+def make_record():
+    """En UTF-8-post med fält för alla slags regler"""
+    return iso2709.build_record(
+        b"00000nam a2200000 i 4500",
+        [
+            ("001", b"1234"),
+            ("008", b"240101s2024    sw            000 0 swe d"),
+            ("035", b"  \x1fa(LIBRIS)1234"),
+            ("245", "10\x1faTitel på svenska /\x1fcFörfattare".encode("utf-8")),
+            ("500", "  \x1faAnmärkning".encode("utf-8")),
+            ("650", " 7\x1faÄmne\x1f2sao".encode("utf-8")),
+            ("650", b" 0\x1faSubject"),
+            ("830", b" 0\x1faSerie\x1f9123\x1fv2"),
+        ],
+    )
+
+
+def test_raw_and_pymarc_give_identical_output():
+    rules = TransformRules(RULES)
+    raw = make_record()
+
+    raw_record = iso2709.RawRecord(raw)
+    rules.apply(raw_record)
+    pymarc_record = Record(raw)
+    rules.apply(pymarc_record)
+
+    assert raw_record.modified
+    assert raw_record.as_marc() == pymarc_record.as_marc()
+
+    transformed = Record(raw_record.as_marc())
+    assert not transformed.get_fields("035", "500")
+    assert transformed["590"]["a"] == "Anmärkning"
+    assert transformed["830"].get_subfields("x") == ["123"]
+    assert transformed["245"]["a"] == "Titel på svenska"
+    assert [field.indicator2 for field in transformed.get_fields("650")] == ["4", "0"]
+    assert transformed["008"].data.endswith("sv  d")
+
+
+def test_unchanged_raw_record_keeps_original_bytes():
+    rules = TransformRules([{"action": "remove_field", "tag": "999"}])
+    raw = make_record()
+    raw_record = iso2709.RawRecord(raw)
+
+    rules.apply(raw_record)
+
+    assert not raw_record.modified
+    assert raw_record.as_marc() is raw
+
+
+@pytest.mark.parametrize(
+    "pattern, replacement", [("7", ""), ("7", "44"), ("", "4"), ("(7)", r"\2")]
+)
+def test_invalid_indicator_replacement_fails_when_compiled(pattern, replacement):
+    with pytest.raises(ValueError):
+        TransformRules(
+            [
+                {
+                    "action": "replace",
+                    "tag": "650",
+                    "indicator": 2,
+                    "pattern": pattern,
+                    "replacement": replacement,
+                }
+            ]
+        )
+
+
+@pytest.mark.parametrize(
+    "rule",
+    [
+        {"action": "remove_field", "tag": "35"},
+        {"action": "remove_subfield", "tag": "830", "code": "99"},
+        {"action": "move", "tag": "500", "to_tag": "001"},
+        {"action": "replace", "tag": "245", "code": "a", "pattern": "("},
+        {"action": "okänd", "tag": "245"},
+    ],
+)
+def test_invalid_rules_fail_when_compiled(rule):
+    with pytest.raises(ValueError):
+        TransformRules([rule])
@@ -0,0 +1,142 @@
+"""Tests for the reference data cache and build_bidirectional_dict"""
+
+import pytest
+
+from utils import reference_cache, utils
+from utils.reference_cache import ReferenceCache
+
+LOCATIONS = [
+    {"id": "9d1b77e4-f02e-4b7f-b296-3f2042ddac54", "name": "Main Library"},
+    {"id": "53cf956f-c1df-410b-8bea-27f712cca7c0", "name": "Annex"},
+]
+
+
+class StubFolioClient:
+    """Stands in for FolioClient, counting the requests for each endpoint"""
+
+    _base_url = "https://folio.example.org"
+    _tenant = "diku"
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.requests = []
+
+    def iter_data(self, endpoint, key="", **_):
+        self.requests.append(endpoint)
+        yield from self.tables[endpoint][key]
+
+
+@pytest.fixture(name="folio")
+def fixture_folio():
+    return StubFolioClient({"/locations": {"locations": LOCATIONS}})
+
+
+def test_cache_miss_fetches_and_stores(tmp_path, folio):
+    cache = ReferenceCache(str(tmp_path))
+    assert cache.load(folio, "/locations", "name") is None
+
+    entries = cache.get_entries(folio, "/locations", "locations", "name")
+
+    assert entries == [(entry["name"], entry["id"]) for entry in LOCATIONS]
+    assert folio.requests == ["/locations"]
+    assert cache.load(folio, "/locations", "name") == entries
+
+
+def test_cache_hit_does_not_fetch(tmp_path, folio):
+    cache = ReferenceCache(str(tmp_path))
+    entries = cache.get_entries(folio, "/locations", "locations", "name")
+
+    assert cache.get_entries(folio, "/locations", "locations", "name") == entries
+    assert folio.requests == ["/locations"]
+
+
+def test_refresh_fetches_even_if_cached(tmp_path, folio):
+    cache = ReferenceCache(str(tmp_path))
+    cache.get_entries(folio, "/locations", "locations", "name")
+    cache.get_entries(folio, "/locations", "locations", "name", refresh=True)
+
+    assert folio.requests == ["/locations", "/locations"]
+
+
+def test_expired_entries_are_fetched_again(tmp_path, folio, monkeypatch):
+    now = 1_700_000_000.0
+    monkeypatch.setattr(reference_cache.time, "time", lambda: now)
+    cache = ReferenceCache(str(tmp_path), ttl=60)
+    cache.get_entries(folio, "/locations", "locations", "name")
+
+    now += 60
+    cache.get_entries(folio, "/locations", "locations", "name")
+    assert folio.requests == ["/locations"]
+
+    now += 1
+    assert cache.load(folio, "/locations", "name") is None
+    cache.get_entries(folio, "/locations", "locations", "name")
+    assert folio.requests == ["/locations", "/locations"]
+
+
+def test_cache_is_per_tenant(tmp_path, folio):
+    cache = ReferenceCache(str(tmp_path))
+    cache.get_entries(folio, "/locations", "locations", "name")
+
+    other = StubFolioClient(folio.tables)
+    other._tenant = "other"  # pylint: disable=protected-access
+    assert cache.load(other, "/locations", "name") is None
+
+
+def test_invalidate(tmp_path, folio):
+    folio.tables["/material-types"] = {
+        "mtypes": [{"id": "1a54b431-2e4f-452d-9cae-9cee66c9a892", "name": "book"}]
+    }
+    cache = ReferenceCache(str(tmp_path))
+    cache.get_entries(folio, "/locations", "locations", "name")
+    cache.get_entries(folio, "/material-types", "mtypes", "name")
+
+    assert cache.invalidate(["/material-types"]) == 1
+    assert cache.load(folio, "/material-types", "name") is None
+    assert cache.load(folio, "/locations", "name") is not None
+
+    assert cache.invalidate() == 1
+    assert cache.load(folio, "/locations", "name") is None
+    assert cache.invalidate() == 0
+
+
+def test_invalidate_missing_directory(tmp_path):
+    assert ReferenceCache(str(tmp_path / "missing")).invalidate() == 0
+
+
+def test_build_bidirectional_dict(tmp_path, folio, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    index = utils.build_bidirectional_dict(folio, "/locations", "locations", "name")
+
+    for entry in LOCATIONS:
+        assert index[entry["name"]] == entry["id"]
+        assert index[entry["id"]] == entry["name"]
+        assert index.id_for(entry["name"]) == entry["id"]
+        assert index.value_for(entry["id"]) == entry["name"]
+    assert len(index) == 2 * len(LOCATIONS)
+    with pytest.raises(KeyError):
+        index["main library"]  # pylint: disable=pointless-statement
+
+    # The second index is built from the cache
+    utils.build_bidirectional_dict(folio, "/locations", "locations", "name")
+    assert folio.requests == ["/locations"]
+
+
+def test_build_bidirectional_dict_without_cache(tmp_path, folio, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    index = utils.build_bidirectional_dict(
+        folio,
+        "/locations",
+        "locations",
+        "name",
+        use_cache=False,
+        case_insensitive=True,
+    )
+
+    assert index["main library"] == LOCATIONS[0]["id"]
+    assert index[LOCATIONS[1]["id"]] == "Annex"
+    utils.build_bidirectional_dict(
+        folio, "/locations", "locations", "name", use_cache=False
+    )
+    assert folio.requests == ["/locations", "/locations"]
+    assert not (tmp_path / utils.REFERENCE_CACHE_DIR).exists()
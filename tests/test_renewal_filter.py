@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""Tester för förhandskontrollen av lån innan de förnyas"""
+
+from pyfolioclient import BadRequestError
+
+from automatic_renewals.renewal_filter import (
+    NOT_RENEWABLE,
+    RENEWAL_LIMIT,
+    REQUESTED,
+    RenewalFilter,
+    load_renewal_filter,
+)
+
+POLICY = {
+    "id": "p1",
+    "loanable": True,
+    "renewable": True,
+    "renewalsPolicy": {"unlimited": False, "numberAllowed": 2},
+}
+
+
+class StubFolio:
+    """Svarar på iter_data med lånepolicyer och öppna reservationer"""
+
+    def __init__(self, loan_policies, requests, error=None):
+        self.data = {
+            "/loan-policy-storage/loan-policies": loan_policies,
+            "/circulation/requests": requests,
+        }
+        self.error = error
+
+    def iter_data(self, path, key="", cql_query=""):
+        # pylint: disable=unused-argument
+        if self.error is not None:
+            raise self.error
+        yield from self.data[path]
+
+
+def renewal_filter(*policies, recalled=(), held=()):
+    """Förhandskontroll med givna policyer och reserverade verk"""
+    return RenewalFilter(
+        {policy["id"]: policy for policy in policies}, set(recalled), set(held)
+    )
+
+
+def loan(renewal_count=0, item_id="i1", policy_id="p1"):
+    """Ett lån enligt policy_id"""
+    return {
+        "id": "l1",
+        "itemId": item_id,
+        "loanPolicyId": policy_id,
+        "renewalCount": renewal_count,
+    }
+
+
+def test_renewable_loan_is_tried():
+    assert renewal_filter(POLICY).skip_reason(loan(renewal_count=1)) is None
+
+
+def test_unknown_policy_is_tried():
+    assert renewal_filter(POLICY).skip_reason(loan(policy_id="okänd")) is None
+
+
+def test_policy_without_renewals_is_skipped():
+    policy = {**POLICY, "renewable": False}
+    assert renewal_filter(policy).skip_reason(loan()) == NOT_RENEWABLE
+
+
+def test_renewal_limit():
+    assert renewal_filter(POLICY).skip_reason(loan(renewal_count=2)) == RENEWAL_LIMIT
+
+
+def test_unlimited_renewals():
+    policy = {**POLICY, "renewalsPolicy": {"unlimited": True, "numberAllowed": 2}}
+    assert renewal_filter(policy).skip_reason(loan(renewal_count=5)) is None
+
+
+def test_recall_is_skipped():
+    assert renewal_filter(POLICY, recalled={"i1"}).skip_reason(loan()) == REQUESTED
+    assert renewal_filter(POLICY, recalled={"i2"}).skip_reason(loan()) is None
+
+
+def test_hold_is_skipped_unless_policy_renews_requested_items():
+    assert renewal_filter(POLICY, held={"i1"}).skip_reason(loan()) == REQUESTED
+
+    policy = {
+        **POLICY,
+        "requestManagement": {"holds": {"renewItemsWithRequest": True}},
+    }
+    assert renewal_filter(policy, held={"i1"}).skip_reason(loan()) is None
+
+
+def test_load_sorts_requests_by_type():
+    folio = StubFolio(
+        [POLICY],
+        [
+            {"requestType": "Recall", "itemId": "i1"},
+            {"requestType": "Hold", "itemId": "i2"},
+        ],
+    )
+
+    loaded = load_renewal_filter(folio)
+
+    assert loaded.loan_policies == {"p1": POLICY}
+    assert loaded.recalled_items == {"i1"}
+    assert loaded.held_items == {"i2"}
+    assert loaded.skip_reason(loan(item_id="i2")) == REQUESTED
+
+
+def test_load_failure_renews_without_filter():
+    folio = StubFolio([POLICY], [], error=BadRequestError("Bad request"))
+    assert load_renewal_filter(folio) is None
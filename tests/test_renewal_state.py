@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+"""Tester för minnet av förnyelser mellan körningar"""
+
+import time
+
+from automatic_renewals.renewal_state import REFUSED, RenewalState
+
+LOAN = {"id": "l1", "dueDate": "2026-02-01T23:59:00.000+00:00", "renewalCount": 1}
+
+
+def test_refusal_remembered_between_runs(tmp_path):
+    path = tmp_path / "state.sqlite"
+    with RenewalState(path, max_age_days=7) as state:
+        assert not state.is_unchanged_refusal(LOAN)
+        state.record(LOAN, REFUSED)
+
+    with RenewalState(path, max_age_days=7) as state:
+        assert state.is_unchanged_refusal(LOAN)
+        assert state.skipped == 1
+
+
+def test_changed_loan_is_tried_again(tmp_path):
+    path = tmp_path / "state.sqlite"
+    with RenewalState(path, max_age_days=7) as state:
+        state.record(LOAN, REFUSED)
+
+    with RenewalState(path, max_age_days=7) as state:
+        assert not state.is_unchanged_refusal({**LOAN, "renewalCount": 2})
+        assert not state.is_unchanged_refusal(
+            {**LOAN, "dueDate": "2026-03-01T23:59:00.000+00:00"}
+        )
+        assert state.skipped == 0
+
+
+def test_other_outcome_replaces_refusal(tmp_path):
+    path = tmp_path / "state.sqlite"
+    with RenewalState(path, max_age_days=7) as state:
+        state.record(LOAN, REFUSED)
+        state.record(LOAN, "renewed")
+
+    with RenewalState(path, max_age_days=7) as state:
+        assert not state.is_unchanged_refusal(LOAN)
+
+
+def test_old_entries_expire(tmp_path, monkeypatch):
+    path = tmp_path / "state.sqlite"
+    with RenewalState(path, max_age_days=7) as state:
+        state.record(LOAN, REFUSED)
+
+    eight_days_later = time.time() + 8 * 24 * 60 * 60
+    monkeypatch.setattr(time, "time", lambda: eight_days_later)
+    with RenewalState(path, max_age_days=7) as state:
+        assert state.expired == 1
+        assert not state.is_unchanged_refusal(LOAN)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+"""Tester för körning av flera jobb i samma process"""
+
+import sys
+import types
+
+import pytest
+
+from utils import run_jobs
+
+
+@pytest.fixture(name="job")
+def fixture_job(tmp_path, monkeypatch):
+    """En jobbmodul vars main() gör det som testet anger"""
+    monkeypatch.chdir(tmp_path)
+    module = types.ModuleType("fake_job")
+    monkeypatch.setitem(sys.modules, "fake_job", module)
+    return module
+
+
+@pytest.mark.parametrize("returned", [None, True])
+def test_job_succeeds(job, returned):
+    job.main = lambda: returned
+    assert run_jobs.run_job("fake_job").succeeded
+
+
+def test_job_returning_false_fails(job):
+    job.main = lambda: False
+    assert not run_jobs.run_job("fake_job").succeeded
+
+
+def test_job_raising_fails(job):
+    def main():
+        raise RuntimeError("trasigt")
+
+    job.main = main
+    assert not run_jobs.run_job("fake_job").succeeded
+
+
+@pytest.mark.parametrize("code, succeeded", [(0, True), (None, True), (1, False)])
+def test_job_exit_code(job, code, succeeded):
+    def main():
+        sys.exit(code)
+
+    job.main = main
+    assert run_jobs.run_job("fake_job").succeeded is succeeded
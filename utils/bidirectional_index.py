@@ -0,0 +1,123 @@
+"""
+Lookup between field values (names, codes) and IDs for FOLIO reference data.
+
+Values and IDs are kept in separate maps, so a value that looks like an ID can
+never overwrite a real ID. The index is a read-only Mapping that still works as
+the old mixed dict: index[name] gives the ID and index[id] gives the name. The
+two maps together hold as many entries as the old dict, and strings are interned
+so each value and ID is stored once.
+"""
+
+import sys
+from collections.abc import Callable, Iterable, Iterator, Mapping
+
+_AMBIGUOUS = object()
+
+
+class BidirectionalIndex(Mapping):
+    """Read-only index field value <-> ID with O(1) lookups in both directions.
+
+    With case_insensitive (or a normalize function) values can also be looked up
+    by their normalized form. Normalized forms shared by several values are not
+    used, since they cannot be resolved to a single ID. The normalized map is
+    built on the first lookup that needs it.
+    """
+
+    __slots__ = ("_forward", "_reverse", "_normalize", "_normalized", "_length")
+
+    def __init__(
+        self,
+        entries: Iterable[tuple[str, str]] = (),
+        case_insensitive: bool = False,
+        normalize: Callable[[str], str] | None = None,
+    ) -> None:
+        self._forward: dict[str, str] = {}
+        self._reverse: dict[str, str] = {}
+        self._normalize = normalize or (str.casefold if case_insensitive else None)
+        self._normalized: dict[str, object] | None = None
+        for value, entry_id in entries:
+            value = sys.intern(value)
+            entry_id = sys.intern(entry_id)
+            self._forward[value] = entry_id
+            self._reverse[entry_id] = value
+        self._length = len(self._forward) + len(self._reverse.keys() - self._forward)
+
+    def _normalized_id(self, value: str) -> object:
+        """Return the ID for the normalized form of value, or _AMBIGUOUS"""
+        if self._normalize is None:
+            return _AMBIGUOUS
+        if self._normalized is None:
+            normalized: dict[str, object] = {}
+            for known_value, entry_id in self._forward.items():
+                key = self._normalize(known_value)
+                existing = normalized.get(key, entry_id)
+                normalized[key] = entry_id if existing == entry_id else _AMBIGUOUS
+            self._normalized = normalized
+        return self._normalized.get(self._normalize(value), _AMBIGUOUS)
+
+    def id_for(self, value: str) -> str:
+        """Return the ID for a field value (normalized if the index normalizes)"""
+        try:
+            return self._forward[value]
+        except KeyError:
+            if self._normalize is None:
+                raise
+        entry_id = self._normalized_id(value)
+        if entry_id is _AMBIGUOUS:
+            raise KeyError(value)
+        return entry_id
+
+    def value_for(self, entry_id: str) -> str:
+        """Return the field value for an ID"""
+        return self._reverse[entry_id]
+
+    def direction(self, key: str) -> str | None:
+        """Return "id" if key is a field value (maps to an ID), "value" if key is
+        an ID (maps to a value), or None. Field values take precedence."""
+        if key in self._forward:
+            return "id"
+        if key in self._reverse:
+            return "value"
+        if self._normalized_id(key) is not _AMBIGUOUS:
+            return "id"
+        return None
+
+    @property
+    def forward(self) -> Mapping[str, str]:
+        """Field value -> ID (a plain dict, fastest for lookups in tight loops)"""
+        return self._forward
+
+    @property
+    def reverse(self) -> Mapping[str, str]:
+        """ID -> field value"""
+        return self._reverse
+
+    def __getitem__(self, key: str) -> str:
+        # Field values take precedence over IDs with the same string. Membership
+        # tests instead of catching KeyError, which is slow for IDs.
+        forward = self._forward
+        if key in forward:
+            return forward[key]
+        reverse = self._reverse
+        if key in reverse:
+            return reverse[key]
+        if self._normalize is None:
+            raise KeyError(key)
+        return self.id_for(key)
+
+    def __contains__(self, key: object) -> bool:
+        if key in self._forward or key in self._reverse:
+            return True
+        return isinstance(key, str) and self._normalized_id(key) is not _AMBIGUOUS
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._forward
+        for entry_id in self._reverse:
+            if entry_id not in self._forward:
+                yield entry_id
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({list(self._forward.items())!r})"
@@ -0,0 +1,243 @@
+"""
+Lightweight timing and metrics instrumentation for the scripts.
+
+Scripts record timing spans, counters and histograms through the module-level
+functions (span, increment, observe). Nothing is recorded until a script calls
+start(), so the functions are close to free when instrumentation is disabled.
+At the end of a run, write() saves a JSON summary and a file in the format read
+by the Prometheus node exporter textfile collector.
+
+Example:
+    with metrics.span("libris_download"):
+        ...
+    metrics.increment("records_written", record_count)
+"""
+
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+
+# Upper bounds (seconds) for histogram buckets, as in the Prometheus client
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+    1800.0,
+)
+PROMETHEUS_PREFIX = "folio_scripts"
+
+_NULL_SPAN = nullcontext()
+
+
+class Histogram:
+    """Count, sum, min, max and cumulative bucket counts of observed values"""
+
+    __slots__ = ("count", "sum", "min", "max", "buckets")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.buckets = [0] * len(DEFAULT_BUCKETS)
+
+    def observe(self, value: float) -> None:
+        """Add an observed value"""
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        for index, bound in enumerate(DEFAULT_BUCKETS):
+            if value <= bound:
+                self.buckets[index] += 1
+
+    def summary(self) -> dict:
+        """The histogram as a JSON-serializable dict"""
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "mean": self.sum / self.count if self.count else None,
+        }
+
+
+class Span:
+    """Context manager that observes its duration in the histogram <name>_seconds
+    and counts exceptions in <name>_errors"""
+
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics: "Metrics", name: str) -> None:
+        self.metrics = metrics
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.metrics.observe(f"{self.name}_seconds", time.perf_counter() - self.start)
+        if exc_type is not None:
+            self.metrics.increment(f"{self.name}_errors")
+
+
+class Metrics:
+    """Counters and histograms for one run of a script. Thread-safe."""
+
+    def __init__(self, script: str) -> None:
+        self.script = script
+        self.started = time.time()
+        self.counters: dict[str, float] = {}
+        self.histograms: dict[str, Histogram] = {}
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1) -> None:
+        """Add value to a counter"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float) -> None:
+        """Add a value (a duration in seconds for spans) to a histogram"""
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def span(self, name: str) -> Span:
+        """Time a block of code and observe the duration in a histogram"""
+        return Span(self, name)
+
+    def summary(self) -> dict:
+        """All metrics as a JSON-serializable dict"""
+        with self._lock:
+            return {
+                "script": self.script,
+                "started": self.started,
+                "duration": time.perf_counter() - self._start,
+                "counters": dict(sorted(self.counters.items())),
+                "histograms": {
+                    name: histogram.summary()
+                    for name, histogram in sorted(self.histograms.items())
+                },
+            }
+
+    def prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        label = f'script="{self.script}"'
+        lines = []
+        summary = self.summary()
+        for name, value in [
+            ("run_duration_seconds", summary["duration"]),
+            ("run_started_timestamp_seconds", summary["started"]),
+        ]:
+            metric = metric_name(name)
+            lines += [f"# TYPE {metric} gauge", f"{metric}{{{label}}} {value}"]
+        for name, value in summary["counters"].items():
+            metric = metric_name(f"{name}_total")
+            lines += [f"# TYPE {metric} counter", f"{metric}{{{label}}} {value}"]
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            for name, histogram in histograms:
+                metric = metric_name(name)
+                lines.append(f"# TYPE {metric} histogram")
+                for bound, count in zip(DEFAULT_BUCKETS, histogram.buckets):
+                    lines.append(f'{metric}_bucket{{{label},le="{bound}"}} {count}')
+                lines += [
+                    f'{metric}_bucket{{{label},le="+Inf"}} {histogram.count}',
+                    f"{metric}_sum{{{label}}} {histogram.sum}",
+                    f"{metric}_count{{{label}}} {histogram.count}",
+                ]
+        return "\n".join(lines) + "\n"
+
+    def write(self, json_path: str | None = None, prometheus_path: str | None = None):
+        """Save the JSON summary and/or the Prometheus textfile"""
+        if json_path:
+            write_atomic(json_path, json.dumps(self.summary(), indent=4))
+        if prometheus_path:
+            write_atomic(prometheus_path, self.prometheus())
+
+
+def metric_name(name: str) -> str:
+    """Prometheus metric name for a metric recorded by a script"""
+    return f"{PROMETHEUS_PREFIX}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}"
+
+
+def write_atomic(path: str, content: str) -> None:
+    """Write a file atomically so that collectors never read a partial file"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", dir=directory, delete=False
+    ) as file:
+        file.write(content)
+    os.replace(file.name, path)
+
+
+_current: Metrics | None = None
+
+
+def start(script: str) -> Metrics:
+    """Start collecting metrics for a run of a script"""
+    global _current  # pylint: disable=global-statement
+    _current = Metrics(script)
+    return _current
+
+
+def stop() -> Metrics | None:
+    """Stop collecting metrics and return what was collected"""
+    global _current  # pylint: disable=global-statement
+    metrics, _current = _current, None
+    return metrics
+
+
+def increment(name: str, value: float = 1) -> None:
+    """Add value to a counter (no-op when metrics are not collected)"""
+    if _current is not None:
+        _current.increment(name, value)
+
+
+def observe(name: str, value: float) -> None:
+    """Add a value to a histogram (no-op when metrics are not collected)"""
+    if _current is not None:
+        _current.observe(name, value)
+
+
+def span(name: str) -> Span | nullcontext:
+    """Time a block of code (no-op when metrics are not collected)"""
+    if _current is None:
+        return _NULL_SPAN
+    return _current.span(name)
+
+
+def log_summary(metrics: Metrics) -> None:
+    """Log the spans of a run on one line"""
+    summary = metrics.summary()
+    logging.info(
+        "Metrics for %s: %.1f s in total, %s",
+        metrics.script,
+        summary["duration"],
+        ", ".join(
+            f"{name} {histogram['sum']:.2f} s ({histogram['count']})"
+            for name, histogram in summary["histograms"].items()
+        ),
+    )
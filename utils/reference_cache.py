@@ -0,0 +1,132 @@
+"""
+On-disk cache for FOLIO reference data (locations, material types, loan types...).
+
+Each table is stored as a JSON file with the (field value, id) pairs and the time
+it was fetched. Entries older than the TTL are fetched again from FOLIO. The cache
+is shared by all scripts running from the same directory and can be invalidated
+or refreshed with `python -m utils.refresh_reference_data`.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+
+from pyfolioclient import FolioClient
+
+DEFAULT_TTL = 24 * 60 * 60
+CACHE_VERSION = 1
+
+
+class ReferenceCache:
+    """Cache of reference tables on disk, one JSON file per table and FOLIO tenant"""
+
+    def __init__(self, directory: str, ttl: float = DEFAULT_TTL) -> None:
+        self.directory = directory
+        self.ttl = ttl
+
+    def path(self, folio: FolioClient, endpoint: str, field_name: str) -> str:
+        """Path to the cache file for a table in the tenant that folio is logged into"""
+        tenant = f"{getattr(folio, '_base_url', '')}|{getattr(folio, '_tenant', '')}"
+        tenant_hash = hashlib.sha1(tenant.encode("utf-8")).hexdigest()[:12]
+        table = re.sub(r"[^A-Za-z0-9]+", "_", f"{endpoint}_{field_name}").strip("_")
+        return os.path.join(self.directory, f"{tenant_hash}_{table}.json")
+
+    def load(
+        self, folio: FolioClient, endpoint: str, field_name: str
+    ) -> list[tuple[str, str]] | None:
+        """Return the cached (field value, id) pairs, or None if missing or expired"""
+        path = self.path(folio, endpoint, field_name)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning("Ignoring unreadable reference cache %s: %s", path, e)
+            return None
+        if (
+            data.get("version") != CACHE_VERSION
+            or time.time() - data.get("fetched", 0) > self.ttl
+        ):
+            return None
+        return [tuple(pair) for pair in data["entries"]]
+
+    def store(
+        self,
+        folio: FolioClient,
+        endpoint: str,
+        field_name: str,
+        entries: list[tuple[str, str]],
+    ) -> None:
+        """Save (field value, id) pairs for a table, replacing the file atomically"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(folio, endpoint, field_name)
+        data = {
+            "version": CACHE_VERSION,
+            "endpoint": endpoint,
+            "field_name": field_name,
+            "fetched": time.time(),
+            "entries": entries,
+        }
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(file_descriptor, "w", encoding="utf-8") as file:
+                json.dump(data, file)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logging.warning("Could not save reference cache %s: %s", path, e)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def get_entries(
+        self,
+        folio: FolioClient,
+        endpoint: str,
+        key: str,
+        field_name: str,
+        refresh: bool = False,
+    ) -> list[tuple[str, str]]:
+        """Return (field value, id) pairs for a table, from the cache if it is fresh,
+        otherwise fetched from FOLIO and saved to the cache"""
+        if not refresh:
+            entries = self.load(folio, endpoint, field_name)
+            if entries is not None:
+                return entries
+        entries = fetch_entries(folio, endpoint, key, field_name)
+        self.store(folio, endpoint, field_name, entries)
+        return entries
+
+    def invalidate(self, endpoints: list[str] | None = None) -> int:
+        """Remove cached tables (all, or those for the given endpoints).
+        Returns the number of removed files."""
+        if not os.path.isdir(self.directory):
+            return 0
+        removed = 0
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, file_name)
+            if endpoints is not None:
+                try:
+                    with open(path, "r", encoding="utf-8") as file:
+                        endpoint = json.load(file).get("endpoint")
+                except (OSError, ValueError):
+                    endpoint = None
+                if endpoint not in endpoints:
+                    continue
+            os.remove(path)
+            removed += 1
+        return removed
+
+
+def fetch_entries(
+    folio: FolioClient, endpoint: str, key: str, field_name: str
+) -> list[tuple[str, str]]:
+    """Fetch (field value, id) pairs for a table from FOLIO"""
+    return [
+        (entry[field_name], entry["id"]) for entry in folio.iter_data(endpoint, key=key)
+    ]
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+"""
+Skript för att tömma eller uppdatera cachen med referensdata (se reference_cache.py).
+
+python -m utils.refresh_reference_data invalidate [tabell ...]
+python -m utils.refresh_reference_data refresh [tabell ...]
+
+Utan tabeller gäller kommandot alla tabeller i utils.REFERENCE_TABLES.
+"""
+
+import argparse
+import logging
+
+from pyfolioclient import BadRequestError
+
+from utils import utils
+
+
+def main():
+    """Huvudfunktion"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "command",
+        choices=["invalidate", "refresh"],
+        help="invalidate raderar cachade tabeller, refresh hämtar dem på nytt från Folio",
+    )
+    parser.add_argument(
+        "tables",
+        nargs="*",
+        metavar="tabell",
+        help="tabeller att tömma eller uppdatera (standard: alla)",
+    )
+    args = parser.parse_args()
+    unknown = sorted(set(args.tables) - set(utils.REFERENCE_TABLES))
+    if unknown:
+        parser.error(
+            f"okända tabeller: {', '.join(unknown)} "
+            f"(välj bland {', '.join(sorted(utils.REFERENCE_TABLES))})"
+        )
+
+    cache = utils.get_reference_cache()
+    if cache is None:
+        logging.info("Cachen för referensdata är avstängd i config.json")
+        return
+    tables = args.tables or sorted(utils.REFERENCE_TABLES)
+
+    if args.command == "invalidate":
+        endpoints = [utils.REFERENCE_TABLES[name][0] for name in tables]
+        removed = cache.invalidate(None if not args.tables else endpoints)
+        logging.info("Raderade %s cachade tabeller i %s", removed, cache.directory)
+        return
+
+    folio_config = utils.load_env()
+    try:
+        with utils.folio_session(folio_config) as folio:
+            for name in tables:
+                endpoint, key, field_name = utils.REFERENCE_TABLES[name]
+                try:
+                    entries = cache.get_entries(
+                        folio, endpoint, key, field_name, refresh=True
+                    )
+                except (BadRequestError, RuntimeError) as e:
+                    logging.error("Kunde inte hämta %s: %s", name, e)
+                    continue
+                logging.info("Uppdaterade %s (%s poster)", name, len(entries))
+    except (ConnectionError, TimeoutError, RuntimeError) as e:
+        logging.error("Misslyckades att ansluta fill Folio: %s", e)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+"""
+Kör flera skript (jobb) efter varandra i samma process med en gemensam
+inloggning mot Folio.
+
+python -m utils.run_jobs [modul ...]
+
+Ett jobb är en modul med en main()-funktion, t.ex. libris_import.libris_to_folio.
+Jobbet räknas som misslyckat om main() lyfter ett undantag, avslutar med felkod
+eller returnerar False. Utan moduler körs jobben i avsnittet "run_jobs" i config.json. Jobben delar
+samma inloggade FolioClient (se utils.shared_folio_session), så inloggning och
+nya anslutningar görs bara en gång. Ett jobb som misslyckas loggas och hindrar
+inte de andra. Tid och utfall loggas per jobb och skriptet avslutas med
+felkod 1 om något jobb misslyckades.
+"""
+
+import argparse
+import importlib
+import logging
+import sys
+import time
+from dataclasses import dataclass
+
+from utils import utils
+
+
+@dataclass
+class JobResult:
+    """Utfall för ett jobb"""
+
+    name: str
+    succeeded: bool
+    seconds: float
+
+
+def load_jobs():
+    """Läs listan med jobb från config.json (om den finns)"""
+    return utils.load_config_section("run_jobs").get("jobs", [])
+
+
+def run_job(name):
+    """Kör ett jobb och mät tiden. Fel i jobbet loggas och avbryter inte körningen."""
+    logging.info("Startar jobb %s", name)
+    start = time.perf_counter()
+    try:
+        module = importlib.import_module(name)
+        with utils.collect_metrics(name.rsplit(".", 1)[-1]):
+            succeeded = module.main() is not False
+        if not succeeded:
+            logging.error("Jobb %s rapporterade att körningen misslyckades", name)
+    except SystemExit as e:
+        succeeded = e.code in (None, 0)
+        if not succeeded:
+            logging.error("Jobb %s avslutades med felkod %s", name, e.code)
+    except Exception:  # pylint: disable=broad-exception-caught
+        logging.exception("Jobb %s misslyckades", name)
+        succeeded = False
+    result = JobResult(name, succeeded, time.perf_counter() - start)
+    logging.info(
+        "Jobb %s %s efter %.1f s",
+        name,
+        "klart" if result.succeeded else "misslyckades",
+        result.seconds,
+    )
+    return result
+
+
+def run_jobs(jobs, folio_config):
+    """Kör jobben efter varandra med en gemensam inloggning mot Folio"""
+    with utils.shared_folio_session(folio_config):
+        return [run_job(name) for name in jobs]
+
+
+def main():
+    """Huvudfunktion"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "jobs",
+        nargs="*",
+        metavar="modul",
+        help='moduler att köra (standard: "jobs" i avsnittet "run_jobs" i config.json)',
+    )
+    args = parser.parse_args()
+    jobs = args.jobs or load_jobs()
+    if not jobs:
+        parser.error('inga jobb angivna (ange moduler eller "run_jobs" i config.json)')
+
+    folio_config = utils.load_env()
+    try:
+        results = run_jobs(jobs, folio_config)
+    except (ConnectionError, TimeoutError, RuntimeError) as e:
+        logging.error("Misslyckades att ansluta fill Folio: %s", e)
+        sys.exit(1)
+
+    failed = [result.name for result in results if not result.succeeded]
+    logging.info(
+        "Körde %s jobb på %.1f s, %s misslyckades%s",
+        len(results),
+        sum(result.seconds for result in results),
+        len(failed),
+        f" ({', '.join(failed)})" if failed else "",
+    )
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
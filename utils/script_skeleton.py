@@ -6,8 +6,6 @@ Skelett för skript.
 
 import logging
 
-from pyfolioclient import FolioClient
-
 from utils import utils
 
 
@@ -22,12 +20,7 @@ def main():
         return
 
     try:
-        with FolioClient(
-            folio_config.base_url,
-            folio_config.tenant,
-            folio_config.username,
-            folio_config.password,
-        ) as folio:
+        with utils.folio_session(folio_config) as folio:
             print(folio)
     except (ConnectionError, TimeoutError, RuntimeError) as e:
         logging.error("Misslyckades att ansluta fill Folio: %s", e)
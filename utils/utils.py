@@ -1,10 +1,53 @@
 import json
 import logging
 import os
-from dataclasses import dataclass
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
 
 from dotenv import load_dotenv
-from pyfolioclient import FolioClient
+from httpx import ConnectError, HTTPStatusError, TimeoutException
+from pyfolioclient import (
+    BadRequestError,
+    FolioClient,
+    ItemNotFoundError,
+    UnprocessableContentError,
+)
+
+from utils import metrics
+from utils.bidirectional_index import BidirectionalIndex
+from utils.reference_cache import DEFAULT_TTL, ReferenceCache, fetch_entries
+
+_TOKEN_LOCK = threading.Lock()
+_SHARED_FOLIO: FolioClient | None = None
+
+REFERENCE_CACHE_DIR = os.path.join(".cache", "reference_data")
+REFERENCE_CONCURRENCY = 4
+METRICS_DIR = "metrics"
+
+# Reference tables: name -> (endpoint, key in response, field mapped to/from id)
+REFERENCE_TABLES = {
+    "address_types": ("/addresstypes", "addressTypes", "addressType"),
+    "callnumber_types": ("/call-number-types", "callNumberTypes", "name"),
+    "contributor_types": ("/contributor-types", "contributorTypes", "name"),
+    "contributor_name_types": (
+        "/contributor-name-types",
+        "contributorNameTypes",
+        "name",
+    ),
+    "departments": ("/departments", "departments", "name"),
+    "holdings_types": ("/holdings-types", "holdingsTypes", "name"),
+    "identifier_types": ("/identifier-types", "identifierTypes", "name"),
+    "instance_types": ("/instance-types", "instanceTypes", "name"),
+    "loan_types": ("/loan-types", "loantypes", "name"),
+    "locations": ("/locations", "locations", "code"),
+    "material_types": ("/material-types", "mtypes", "name"),
+    "patron_groups": ("/groups", "usergroups", "group"),
+    "service_points": ("/service-points", "servicepoints", "code"),
+    "statistical_codes": ("/statistical-codes", "statisticalCodes", "name"),
+}
 
 
 @dataclass
@@ -18,6 +61,26 @@ class FolioConfig:
     mode: str
 
 
+@dataclass
+class ReferenceTables:
+    """Reference tables loaded by load_reference_tables, by name in REFERENCE_TABLES"""
+
+    tables: dict[str, BidirectionalIndex] = field(default_factory=dict)
+    errors: dict[str, Exception] = field(default_factory=dict)
+
+    def __getitem__(self, name: str) -> BidirectionalIndex:
+        if name in self.errors:
+            raise RuntimeError(
+                f"Reference table {name} could not be loaded: {self.errors[name]}"
+            ) from self.errors[name]
+        return self.tables[name]
+
+    @property
+    def succeeded(self) -> bool:
+        """All tables were loaded"""
+        return not self.errors
+
+
 def load_env() -> FolioConfig:
     """Load configuration from environment variables"""
     env_dir = os.path.join(os.getcwd(), ".env")
@@ -37,6 +100,14 @@ def load_config() -> dict:
     return load_json_file(config_path)
 
 
+def load_config_section(section: str) -> dict:
+    """Load a section of config.json, or an empty dict if the file or section is missing"""
+    config_path = os.path.join(os.getcwd(), "config.json")
+    if not os.path.exists(config_path):
+        return {}
+    return load_config().get(section, {})
+
+
 def load_json_file(file_path: str) -> dict:
     """Load a JSON file and return its content as a dictionary"""
     try:
@@ -77,97 +148,296 @@ def update_last_run_timestamp(last_run_timestamp_path, current_utc_timestamp):
         raise
 
 
-def build_bidirectional_dict(
-    folio: FolioClient, endpoint: str, key: str, field_name: str
-) -> dict[str, str]:
-    """Build a bidirectional dictionary between field values and IDs"""
-    index = {}
+def new_folio_client(folio_config: FolioConfig) -> FolioClient:
+    """Log in to FOLIO with a new client (and connection pool)"""
+    return FolioClient(
+        folio_config.base_url,
+        folio_config.tenant,
+        folio_config.username,
+        folio_config.password,
+    )
 
-    for entry in folio.iter_data(endpoint, key=key):
-        index[entry[field_name]] = entry["id"]
-        index[entry["id"]] = entry[field_name]
 
-    return index
+@contextmanager
+def folio_session(folio_config: FolioConfig):
+    """Context manager for a logged in FolioClient. Inside shared_folio_session the
+    shared client is reused (and kept open afterwards), otherwise a new client is
+    logged in and logged out when the block ends."""
+    if _SHARED_FOLIO is not None:
+        ensure_token(_SHARED_FOLIO)
+        yield _SHARED_FOLIO
+        return
+    with new_folio_client(folio_config) as folio:
+        yield folio
+
+
+@contextmanager
+def shared_folio_session(folio_config: FolioConfig):
+    """Log in once and share the client with every folio_session opened inside the
+    block, so that jobs run in the same process reuse the token and connections.
+    The token is refreshed by the client when it is about to expire."""
+    global _SHARED_FOLIO  # pylint: disable=global-statement
+    with new_folio_client(folio_config) as folio:
+        _SHARED_FOLIO = folio
+        try:
+            yield folio
+        finally:
+            _SHARED_FOLIO = None
+
+
+def ensure_token(folio: FolioClient) -> None:
+    """Renew the FOLIO token if it is about to expire. Serialized, so that threads
+    sharing one client don't renew the token at the same time."""
+    with _TOKEN_LOCK:
+        folio._manage_token()  # pylint: disable=protected-access
+
+
+class RateLimiter:
+    """Limit calls to a number per second, shared by several threads (0 = no limit)"""
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        """Wait until the next call is allowed"""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def post_binary(folio: FolioClient, endpoint: str, content) -> dict | int:
+    """Post raw bytes (or a binary file object) to a FOLIO endpoint.
+
+    Unlike FolioClient.post_data, the Content-Type header is set on the request
+    instead of on the shared client, so this can be called from several threads
+    sharing one client and its connection pool. Raises the same exceptions as
+    FolioClient.post_data.
+    """
+    ensure_token(folio)
+    url = f"{folio._base_url}{endpoint}"  # pylint: disable=protected-access
+    try:
+        response = folio.client.post(
+            url,
+            content=content,
+            headers={"Content-Type": "application/octet-stream"},
+            timeout=folio.timeout,
+        )
+        response.raise_for_status()
+    except ConnectError as connection_err:
+        raise ConnectionError("Connection error") from connection_err
+    except TimeoutException as timeout_err:
+        raise TimeoutError("Server timeout") from timeout_err
+    except HTTPStatusError as http_err:
+        status_code = http_err.response.status_code
+        if status_code == 400:
+            raise BadRequestError("Bad request") from http_err
+        if status_code == 404:
+            raise ItemNotFoundError("Item not found") from http_err
+        if status_code == 422:
+            raise UnprocessableContentError(http_err.response.text) from http_err
+        raise RuntimeError("HTTP error") from http_err
+    try:
+        return response.json()
+    except json.JSONDecodeError:
+        return int(response.status_code)
+
+
+def get_reference_cache() -> ReferenceCache | None:
+    """Return the shared reference data cache (section "reference_cache" in
+    config.json), or None if the cache is disabled"""
+    config = load_config_section("reference_cache")
+    if not config.get("enabled", True):
+        return None
+    directory = config.get("directory") or os.path.join(
+        os.getcwd(), REFERENCE_CACHE_DIR
+    )
+    ttl_hours = float(config.get("ttl_hours", DEFAULT_TTL / 3600))
+    return ReferenceCache(directory, ttl_hours * 3600)
+
+
+@contextmanager
+def collect_metrics(script: str):
+    """Collect metrics for a run of a script and write them when the run ends
+    (section "metrics" in config.json). Does nothing unless metrics are enabled."""
+    config = load_config_section("metrics")
+    if not config.get("enabled", False):
+        yield None
+        return
+    directory = config.get("directory") or os.path.join(os.getcwd(), METRICS_DIR)
+    collected = metrics.start(script)
+    try:
+        with collected.span("run"):
+            yield collected
+    finally:
+        metrics.stop()
+        metrics.log_summary(collected)
+        try:
+            collected.write(
+                json_path=(
+                    os.path.join(directory, f"{script}.json")
+                    if config.get("json", True)
+                    else None
+                ),
+                prometheus_path=(
+                    os.path.join(directory, f"{script}.prom")
+                    if config.get("prometheus", True)
+                    else None
+                ),
+            )
+        except OSError as e:
+            logging.error("Error writing metrics for %s: %s", script, e)
 
 
-def build_address_types_dict(folio: FolioClient) -> dict[str, str]:
-    """Return a bidirectional dictionary of address types"""
+def build_bidirectional_dict(
+    folio: FolioClient,
+    endpoint: str,
+    key: str,
+    field_name: str,
+    use_cache: bool = True,
+    case_insensitive: bool = False,
+) -> BidirectionalIndex:
+    """Build a bidirectional index between field values and IDs.
+    The table is read from the reference data cache if it is fresh."""
+    cache = get_reference_cache() if use_cache else None
+    if cache:
+        entries = cache.get_entries(folio, endpoint, key, field_name)
+    else:
+        entries = fetch_entries(folio, endpoint, key, field_name)
+
+    return BidirectionalIndex(entries, case_insensitive=case_insensitive)
+
+
+def build_reference_dict(
+    folio: FolioClient,
+    name: str,
+    use_cache: bool = True,
+    case_insensitive: bool = False,
+) -> BidirectionalIndex:
+    """Return a bidirectional index for a table in REFERENCE_TABLES"""
+    endpoint, key, field_name = REFERENCE_TABLES[name]
     return build_bidirectional_dict(
-        folio, "/addresstypes", "addressTypes", "addressType"
+        folio, endpoint, key, field_name, use_cache, case_insensitive
     )
 
 
-def build_callnumber_types_dict(folio: FolioClient) -> dict[str, str]:
+def load_reference_tables(
+    folio: FolioClient,
+    names: list[str] | None = None,
+    concurrency: int = REFERENCE_CONCURRENCY,
+    use_cache: bool = True,
+) -> ReferenceTables:
+    """Load several tables in REFERENCE_TABLES (default all) concurrently over the
+    same FOLIO session. A table that cannot be loaded is logged and recorded in
+    errors without stopping the others; looking it up raises RuntimeError."""
+    names = list(names or REFERENCE_TABLES)
+    unknown = [name for name in names if name not in REFERENCE_TABLES]
+    if unknown:
+        raise KeyError(f"Unknown reference tables: {', '.join(unknown)}")
+
+    result = ReferenceTables()
+    if not names:
+        return result
+
+    # Renew the token up front so that the threads don't all renew it at once
+    ensure_token(folio)
+
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(concurrency, len(names)))
+    ) as executor:
+        futures = {
+            executor.submit(build_reference_dict, folio, name, use_cache): name
+            for name in names
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                result.tables[name] = future.result()
+            except (
+                ConnectionError,
+                TimeoutError,
+                BadRequestError,
+                ItemNotFoundError,
+                RuntimeError,
+                KeyError,
+            ) as e:
+                logging.error("Could not load reference table %s: %s", name, e)
+                result.errors[name] = e
+
+    return result
+
+
+def build_address_types_dict(folio: FolioClient) -> BidirectionalIndex:
+    """Return a bidirectional dictionary of address types"""
+    return build_reference_dict(folio, "address_types")
+
+
+def build_callnumber_types_dict(folio: FolioClient) -> BidirectionalIndex:
     """Return a bidirectional dictionary of callnumber types"""
-    return build_bidirectional_dict(
-        folio, "/call-number-types", "callNumberTypes", "name"
-    )
+    return build_reference_dict(folio, "callnumber_types")
 
 
-def build_contributor_types_dict(folio: FolioClient) -> dict[str, str]:
+def build_contributor_types_dict(folio: FolioClient) -> BidirectionalIndex:
     """Return a bidirectional dictionary of contributor types"""
-    return build_bidirectional_dict(
-        folio, "/contributor-types", "contributorTypes", "name"
-    )
+    return build_reference_dict(folio, "contributor_types")
 
 
-def build_contributor_name_types_dict(folio: FolioClient) -> dict[str, str]:
+def build_contributor_name_types_dict(folio: FolioClient) -> BidirectionalIndex:
     """Return a bidirectional dictionary of contributor name types"""
-    return build_bidirectional_dict(
-        folio, "/contributor-name-types", "contributorNameTypes", "name"
-    )
+    return build_reference_dict(folio, "contributor_name_types")
 
 
-def build_departments_dict(folio: FolioClient) -> dict[str, str]:
+def build_departments_dict(folio: FolioClient) -> BidirectionalIndex:
     """Return a bidirectional dictionary of departments"""
-    return build_bidirectional_dict(folio, "/departments", "departments", "name")
+    return build_reference_dict(folio, "departments")
 
 
-def build_holdings_types_dict(folio: FolioClient) -> dict[str, str]:
+def build_holdings_types_dict(folio: FolioClient) -> BidirectionalIndex:
     """Return a bidirectional dictionary of holdings types"""
-    return build_bidirectional_dict(folio, "/holdings-types", "holdingsTypes", "name")
+    return build_reference_dict(folio, "holdings_types")
 
 
-def build_identifier_types_dict(folio: FolioClient) -> dict[str, str]:
+def build_identifier_types_dict(folio: FolioClient) -> BidirectionalIndex:
     """Return a bidirectional dictionary of identifier types"""
-    return build_bidirectional_dict(
-        folio, "/identifier-types", "identifierTypes", "name"
-    )
+    return build_reference_dict(folio, "identifier_types")
 
 
-def build_instance_types_dict(folio: FolioClient) -> dict[str, str]:
+def build_instance_types_dict(folio: FolioClient) -> BidirectionalIndex:
     """Return a bidirectional dictionary of instance types"""
-    return build_bidirectional_dict(folio, "/instance-types", "instanceTypes", "name")
+    return build_reference_dict(folio, "instance_types")
 
 
-def build_loan_types_dict(folio: FolioClient) -> dict[str, str]:
+def build_loan_types_dict(folio: FolioClient) -> BidirectionalIndex:
     """Return a bidirectional dictionary of loan types"""
-    return build_bidirectional_dict(folio, "/loan-types", "loantypes", "name")
+    return build_reference_dict(folio, "loan_types")
 
 
-def build_locations_dict(folio: FolioClient) -> dict[str, str]:
+def build_locations_dict(folio: FolioClient) -> BidirectionalIndex:
     """Return a bidirectional dictionary of locations"""
-    return build_bidirectional_dict(folio, "/locations", "locations", "code")
+    return build_reference_dict(folio, "locations")
 
 
-def build_material_types_dict(folio: FolioClient) -> dict[str, str]:
+def build_material_types_dict(folio: FolioClient) -> BidirectionalIndex:
     """Return a bidirectional dictionary of material types"""
-    return build_bidirectional_dict(folio, "/material-types", "mtypes", "name")
+    return build_reference_dict(folio, "material_types")
 
 
-def build_patron_groups_lookup_dict(folio: FolioClient) -> dict[str, str]:
+def build_patron_groups_lookup_dict(folio: FolioClient) -> BidirectionalIndex:
     """Return a bidirectional dictionary of patron groups"""
-    return build_bidirectional_dict(folio, "/groups", "usergroups", "group")
+    return build_reference_dict(folio, "patron_groups")
 
 
-def build_service_points_lookup_dict(folio: FolioClient) -> dict[str, str]:
+def build_service_points_lookup_dict(folio: FolioClient) -> BidirectionalIndex:
     """Return a bidirectional dictionary of service points"""
-    return build_bidirectional_dict(folio, "/service-points", "servicepoints", "code")
+    return build_reference_dict(folio, "service_points")
 
 
-def build_statistical_codes_lookup_dict(folio: FolioClient) -> dict[str, str]:
+def build_statistical_codes_lookup_dict(folio: FolioClient) -> BidirectionalIndex:
     """Return a bidirectional dictionary of statistical codes"""
-    return build_bidirectional_dict(
-        folio, "/statistical-codes", "statisticalCodes", "name"
-    )
-
+    return build_reference_dict(folio, "statistical_codes")